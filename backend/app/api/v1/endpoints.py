@@ -1,9 +1,10 @@
-import json
+import threading
+from datetime import date
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
-from typing import List, Optional, Union
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile
+from fastapi.responses import ORJSONResponse, Response
+from typing import TYPE_CHECKING, List, Optional, Union
 
-import aiohttp
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.responses import FileResponse
 
@@ -14,34 +15,59 @@ from app.schemas.document import (
     FolderResponse,
     PlaceResponse,
     ArchData,
+    BulkUploadResponse,
 )
 from app.services.document import DocumentService
-from app.services.rag import DocumentProcessor
 from app.services.search import SearchService
 from app.core.database import get_session
+from app.core.limits import upstream_stats
+from app.core.tracing import run_in_thread, span
 from app.repositories.document import DocumentRepository
 
-router = APIRouter()
+if TYPE_CHECKING:
+    from app.services.rag import DocumentProcessor
 
+router = APIRouter(default_response_class=ORJSONResponse)
 
-async def get_document_processor(session: AsyncSession = Depends(get_session)) -> DocumentProcessor:
-    return DocumentProcessor(
-        qdrant_location="http://31.31.201.198:6333"
-    )
+_processor: Optional["DocumentProcessor"] = None
+_processor_lock = threading.Lock()
+
+
+def _document_processor() -> "DocumentProcessor":
+    # One processor per worker: clients, collection check and state load happen once.
+    # llama_index, qdrant_client and the readers are imported here, not at app import.
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                from app.services.rag import DocumentProcessor
+
+                _processor = DocumentProcessor()
+    return _processor
+
+
+async def get_document_processor() -> "DocumentProcessor":
+    with span("deps.document_processor"):
+        if _processor is not None:
+            return _processor
+        # First use, or the startup warm-up is still running: wait off the event loop
+        return await run_in_thread(_document_processor)
 
 
 async def get_document_service(
         session: AsyncSession = Depends(get_session),
-        document_processor: DocumentProcessor = Depends(get_document_processor)
+        document_processor: "DocumentProcessor" = Depends(get_document_processor)
 ) -> DocumentService:
-    return DocumentService(DocumentRepository(session), document_processor)
+    with span("deps.document_service"):
+        return DocumentService(DocumentRepository(session), document_processor)
 
 
 async def get_search_service(
         session: AsyncSession = Depends(get_session),
-        document_processor: DocumentProcessor = Depends(get_document_processor)
+        document_processor: "DocumentProcessor" = Depends(get_document_processor)
 ) -> SearchService:
-    return SearchService(document_processor)
+    with span("deps.search_service"):
+        return SearchService(document_processor, DocumentRepository(session))
 
 
 @router.post("/documents/get_place/", response_model=PlaceResponse)
@@ -55,9 +81,10 @@ async def get_document_place(
 @router.delete("/documents/{document_id}")
 async def delete_document(
     document_id: int,
+    recursive: bool = Query(False, description="Delete a folder together with everything inside it"),
     service: DocumentService = Depends(get_document_service)
 ):
-    await service.delete_document(document_id)
+    await service.delete_document(document_id, recursive=recursive)
     return {"status": "success"}
 
 @router.post("/documents/create_folder/", response_model=FolderResponse)
@@ -73,9 +100,25 @@ async def create_document(
     file: UploadFile,
     parent_id: Optional[int] = None,
     metadata: Optional[str] = None,
+    replace: bool = Query(False, description="Overwrite the file uploaded from source_path, or with the same name in parent_id"),
+    source_path: Optional[str] = Query(None, description="Path of the file on the client, stored in metadata"),
+    service: DocumentService = Depends(get_document_service)
+):
+    return await service.create_document(file, parent_id, metadata, replace=replace, source_path=source_path)
+
+
+@router.post("/documents/bulk/", response_model=BulkUploadResponse)
+async def create_documents(
+    files: List[UploadFile],
+    parent_id: Optional[int] = None,
+    metadata: Optional[str] = None,
+    replace: bool = Query(False, description="Overwrite files uploaded from the same source_paths or names"),
+    source_paths: Optional[List[str]] = Query(None, description="Client path of every file, in order, repeatable"),
     service: DocumentService = Depends(get_document_service)
 ):
-    return await service.create_document(file, parent_id, metadata)
+    return {"documents": await service.create_documents(
+        files, parent_id, metadata, replace=replace, source_paths=source_paths
+    )}
 
 
 @router.get("/documents/", response_model=List[DocumentResponse])
@@ -97,9 +140,27 @@ async def get_documents(
 @router.get("/search/")
 async def search_documents(
     query: str,
+    mode: str = Query("answer", pattern="^(answer|retrieve)$"),
+    retrieval: str = Query("hybrid", pattern="^(hybrid|dense|lexical)$"),
+    aggregate: str = Query("max", pattern="^(max|sum)$"),
+    diversity: Optional[float] = Query(None, ge=0.0, le=1.0),
+    limit: int = Query(10, ge=1, le=100),
+    folder_id: Optional[int] = Query(None, description="Only documents in this folder or its subfolders"),
+    file_type: Optional[List[str]] = Query(None, description="Only these file types (MIME), repeatable"),
+    date_from: Optional[date] = Query(None, description="Created on or after this date"),
+    date_to: Optional[date] = Query(None, description="Created on or before this date"),
+    include_metadata: bool = Query(False, description="Add metadata and hierarchy_info to every document"),
+    strategy: Optional[str] = Query(
+        None, pattern="^(flat|two_stage)$", description="Chunk search strategy, SEARCH_STRATEGY by default"
+    ),
     service: SearchService = Depends(get_search_service)
 ):
-    return await service.search_documents(query)
+    # Plain dicts: skip jsonable_encoder and serialize straight with orjson
+    return ORJSONResponse(await service.search_documents(
+        query, retrieval, mode, aggregate, diversity, limit,
+        folder_id=folder_id, file_types=file_type, date_from=date_from, date_to=date_to,
+        include_metadata=include_metadata, strategy=strategy
+    ))
 
 
 @router.post("/documents/{document_id}/move/{new_parent_id}")
@@ -130,11 +191,18 @@ async def download_document(
 
 
 @router.get("/graph/")
-async def get_graph(service: DocumentService = Depends(get_document_service)):
-    with open("./storage/document_state.json", "r") as f:
-        raw_documents = json.loads(f.read())
+async def get_graph(document_processor: "DocumentProcessor" = Depends(get_document_processor)):
+    return Response(document_processor.get_state_json(), media_type="application/json")
 
-        return raw_documents
+
+@router.get("/llm/stats/")
+async def llm_stats(processor: "DocumentProcessor" = Depends(get_document_processor)):
+    return processor.llm_gateway.stats()
+
+
+@router.get("/upstream/stats/")
+async def get_upstream_stats():
+    return upstream_stats()
 
 
 @router.post("/arch/update/")
@@ -153,6 +221,8 @@ async def arch_update(
     if "callback_url" not in document.doc_metadata and "document_id" not in document.doc_metadata:
         raise HTTPException(status_code=404, detail="Document for arch not found")
 
+    import aiohttp
+
     async with aiohttp.ClientSession() as session:
         await session.post(
             document.doc_metadata["callback_url"],
@@ -0,0 +1,89 @@
+import argparse
+import asyncio
+from pathlib import Path
+
+from app.core.config import settings
+
+
+def reindex(args: argparse.Namespace) -> None:
+    from app.services.rag import DocumentProcessor
+
+    processor = DocumentProcessor()
+    processor.reindex(source_dir=Path(args.source_dir), keep_old=args.keep_old)
+
+
+def gc(args: argparse.Namespace) -> None:
+    from app.services.gc import collect_garbage_once
+    from app.services.rag import DocumentProcessor
+
+    report = asyncio.run(collect_garbage_once(DocumentProcessor()))
+    print(f"{report['live']} live documents, removed {len(report['removed'])}: {report['removed']}")
+
+
+def sync_folders(args: argparse.Namespace) -> None:
+    from app.core.database import async_session
+    from app.repositories.document import DocumentRepository
+    from app.services.document import DocumentService
+    from app.services.rag import DocumentProcessor
+
+    async def run() -> int:
+        async with async_session() as session:
+            return await DocumentService(DocumentRepository(session), DocumentProcessor()).sync_folder_paths()
+
+    print(f"Updated folder paths of {asyncio.run(run())} documents")
+
+
+def migrate_chunk_texts(args: argparse.Namespace) -> None:
+    from app.services.rag import DocumentProcessor
+
+    DocumentProcessor().migrate_chunk_texts()
+
+
+def index_summaries(args: argparse.Namespace) -> None:
+    from app.services.rag import DocumentProcessor
+
+    DocumentProcessor().rebuild_summary_index()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Document Management maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    reindex_parser = subparsers.add_parser(
+        "reindex",
+        help="Build a new versioned Qdrant collection and switch the collection alias to it"
+    )
+    reindex_parser.add_argument("--source-dir", default=str(settings.UPLOAD_DIR))
+    reindex_parser.add_argument("--keep-old", action="store_true", help="Do not drop the previous collection")
+    reindex_parser.set_defaults(func=reindex)
+
+    gc_parser = subparsers.add_parser(
+        "gc",
+        help="Remove points, lexical entries and state of documents that no longer exist"
+    )
+    gc_parser.set_defaults(func=gc)
+
+    sync_folders_parser = subparsers.add_parser(
+        "sync-folders",
+        help="Write the folder path of every file into its points (for folder-scoped search)"
+    )
+    sync_folders_parser.set_defaults(func=sync_folders)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate-chunk-texts",
+        help="Move chunk texts from Qdrant payloads to the local chunk store"
+    )
+    migrate_parser.set_defaults(func=migrate_chunk_texts)
+
+    summaries_parser = subparsers.add_parser(
+        "index-summaries",
+        help="Fill the document summary collection used by two-stage search"
+    )
+    summaries_parser.set_defaults(func=index_summaries)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Shared protection for upstream calls (Claude, TEI, Qdrant).
+
+Every upstream has one AdaptiveLimiter per process. Its concurrency limit grows
+additively while latency stays near the observed baseline and halves on overload
+errors (AIMD). Retryable failures are retried with jittered exponential backoff.
+SingleFlight coalesces identical in-flight calls into one upstream request.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from app.core.config import settings
+from app.core.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+RETRYABLE_NAMES = ("Timeout", "Connect", "RateLimit", "Overloaded", "InternalServer", "ServiceUnavailable")
+# Latency growth below this (seconds) is jitter, not queueing
+LATENCY_SLACK = 0.05
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream kept failing or the limiter queue timed out; the API answers 503"""
+
+    def __init__(self, upstream: str, reason: str):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for candidate in (exc, getattr(exc, "response", None)):
+        code = getattr(candidate, "status_code", None)
+        if isinstance(code, int):
+            return code
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Overload, rate limit and transport errors; client errors (4xx) are not retried"""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = _status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return any(name in type(exc).__name__ for name in RETRYABLE_NAMES)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts to latency and errors (AIMD).
+
+    - success while the smoothed latency stays under ``tolerance`` x baseline
+      (+ LATENCY_SLACK): limit += 1 / limit;
+    - success with higher latency: limit *= 0.9;
+    - retryable error (429, 5xx, timeouts): limit *= ``backoff_ratio``.
+
+    The baseline is a slowly rising minimum of observed latencies, so it follows an
+    upstream that legitimately got slower.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            max_limit: int,
+            min_limit: int = 1,
+            initial_limit: Optional[int] = None,
+            tolerance: float = 2.0,
+            backoff_ratio: float = 0.5
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit or max(min_limit, max_limit // 2))
+        self.tolerance = tolerance
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self.smoothed: Optional[float] = None
+        self._cond = threading.Condition()
+        self._stats = {"calls": 0, "errors": 0, "retries": 0, "rejected": 0, "coalesced": 0}
+
+    def acquire(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["rejected"] += 1
+                    raise UpstreamUnavailable(self.name, "concurrency limit queue timed out")
+                self._cond.wait(remaining)
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float], overloaded: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif latency is not None:
+                self.smoothed = latency if self.smoothed is None else self.smoothed * 0.8 + latency * 0.2
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # Let the baseline drift up slowly (about 1% per call)
+                    self.baseline += (self.smoothed - self.baseline) * 0.01
+                if self.smoothed <= self.baseline * self.tolerance + LATENCY_SLACK:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                else:
+                    self.limit = max(self.min_limit, self.limit * 0.9)
+            self._cond.notify_all()
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run ``fn`` under the limit, retrying retryable errors with backoff"""
+        retries = settings.UPSTREAM_RETRIES
+        for attempt in range(retries + 1):
+            self.acquire(settings.UPSTREAM_QUEUE_TIMEOUT)
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                self.release(None, overloaded=retryable)
+                with self._cond:
+                    self._stats["errors"] += 1
+                if not retryable:
+                    raise
+                if attempt == retries:
+                    raise UpstreamUnavailable(self.name, str(e)) from e
+
+                # Full jitter: a burst of failures does not come back in lockstep
+                delay = random.uniform(0, min(settings.UPSTREAM_BACKOFF_MAX, settings.UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+                logger.warning("%s call failed (%s), retry %d in %.2fs", self.name, e, attempt + 1, delay)
+                with self._cond:
+                    self._stats["retries"] += 1
+                with span("upstream.backoff", upstream=self.name, attempt=attempt + 1):
+                    time.sleep(delay)
+                continue
+
+            self.release(time.perf_counter() - start)
+            with self._cond:
+                self._stats["calls"] += 1
+            return result
+
+    def record_coalesced(self) -> None:
+        with self._cond:
+            self._stats["coalesced"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "baseline_ms": round(self.baseline * 1000, 1) if self.baseline is not None else None,
+                "latency_ms": round(self.smoothed * 1000, 1) if self.smoothed is not None else None,
+            }
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: one runs, the others get its result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], on_shared: Optional[Callable[[], None]] = None) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if on_shared is not None:
+                on_shared()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+class LimitedClient:
+    """Proxy that sends every method call of ``client`` through ``limiter``"""
+
+    def __init__(self, client: Any, limiter: AdaptiveLimiter):
+        self._client = client
+        self._limiter = limiter
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def limited(*args: Any, **kwargs: Any) -> Any:
+            return self._limiter.call(attr, *args, **kwargs)
+
+        return limited
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def upstream_limiter(name: str) -> AdaptiveLimiter:
+    """Process-wide limiter of an upstream ("llm", "tei", "qdrant"), see UPSTREAM_MAX_CONCURRENCY"""
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = AdaptiveLimiter(
+                name,
+                max_limit=settings.UPSTREAM_MAX_CONCURRENCY.get(name, 8),
+                min_limit=settings.UPSTREAM_MIN_CONCURRENCY
+            )
+        return _limiters[name]
+
+
+def upstream_stats() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,13 @@
+"""Compact JSON encoding shared by the API responses and the state files (orjson)"""
+from typing import Any
+
+import orjson
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON; non-string dict keys (e.g. int folder ids) become strings"""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+def loads(data: Any) -> Any:
+    return orjson.loads(data)
@@ -0,0 +1,238 @@
+"""Lightweight span tracing.
+
+Spans are kept in a context variable, so nested ``span()`` blocks and ``@traced`` calls
+form a tree per request. Sampling is decided once at the root span; sampled traces are
+exported in the background to a JSONL file or an OTLP/HTTP (JSON) collector.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6 if self.end_ns else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class FileSpanExporter:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def export(self, spans: List[Span]) -> None:
+        with self.path.open("a") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+class OTLPHttpSpanExporter:
+    """Sends spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    def _attributes(self, attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+
+    def export(self, spans: List[Span]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": self.service_name})},
+                "scopeSpans": [{
+                    "scope": {"name": "app.core.tracing"},
+                    "spans": [{
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": self._attributes(span.attributes),
+                        "status": {"code": 1 if span.status == "ok" else 2},
+                    } for span in spans]
+                }]
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+class _BatchProcessor:
+    """Exports finished spans from a daemon thread so requests never wait on I/O"""
+
+    def __init__(self, exporter, max_batch: int = 256, interval: float = 1.0):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.interval = interval
+        self.queue: "queue.Queue[Span]" = queue.Queue(maxsize=10000)
+        threading.Thread(target=self._run, name="span-exporter", daemon=True).start()
+
+    def submit(self, span: Span) -> None:
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch and time.monotonic() < deadline:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                logger.warning("Failed to export %d spans: %s", len(batch), e)
+
+
+_processor: Optional[_BatchProcessor] = None
+_processor_lock = threading.Lock()
+
+
+def _get_processor() -> Optional[_BatchProcessor]:
+    global _processor
+    if settings.TRACE_EXPORTER == "none":
+        return None
+    with _processor_lock:
+        if _processor is None:
+            if settings.TRACE_EXPORTER == "otlp":
+                exporter = OTLPHttpSpanExporter(settings.TRACE_OTLP_ENDPOINT, settings.TRACE_SERVICE_NAME)
+            else:
+                exporter = FileSpanExporter(settings.TRACE_FILE)
+            _processor = _BatchProcessor(exporter)
+    return _processor
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Parse a W3C ``traceparent`` header: version-traceid-spanid-flags"""
+    if not header:
+        return None
+    parts = header.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return {"trace_id": parts[1], "parent_id": parts[2], "sampled": parts[3] == "01"}
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, parent: Optional[Dict[str, Any]] = None, **attributes: Any) -> Iterator[Span]:
+    """Open a child span of the current one, or a new (sampled by config) root span"""
+    active = _current_span.get()
+    if active is not None:
+        new_span = Span(name, active.trace_id, active.span_id, active.sampled, attributes)
+    elif parent is not None:
+        new_span = Span(name, parent["trace_id"], parent["parent_id"], parent["sampled"], attributes)
+    else:
+        sampled = random.random() < settings.TRACE_SAMPLE_RATE
+        new_span = Span(name, os.urandom(16).hex(), None, sampled, attributes)
+
+    token = _current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.status = "error"
+        new_span.set_attribute("error", repr(e))
+        raise
+    finally:
+        new_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        if new_span.sampled:
+            processor = _get_processor()
+            if processor is not None:
+                processor.submit(new_span)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator wrapping a sync or async function call in a span"""
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def context_bound(func: Callable) -> Callable:
+    """Wrap ``func`` for executor threads: every call runs in a copy of the caller's
+    context, so spans it opens stay children of the current one"""
+    context = copy_context()
+
+    def run(*args: Any, **kwargs: Any) -> Any:
+        # One Context cannot be entered by several threads at once
+        return context.copy().run(func, *args, **kwargs)
+
+    return run
+
+
+async def run_in_thread(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking call in the threadpool; spans it opens stay children of the current one"""
+    context = copy_context()
+    return await run_in_threadpool(context.run, functools.partial(func, *args, **kwargs))
@@ -1,8 +1,14 @@
+import asyncio
 import json
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1.endpoints import router as v1_router
+from fastapi.responses import JSONResponse
+from app.api.v1.endpoints import _document_processor, get_document_processor, router as v1_router
+from app.core.compression import CompressionMiddleware
+from app.core.config import settings
+from app.core.limits import UpstreamUnavailable
+from app.core.tracing import parse_traceparent, span
 
 
 app = FastAPI(title="Document Management API")
@@ -18,7 +24,53 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
-    allow_headers=["X-Requested-With", "Content-Type"],
+    allow_headers=["X-Requested-With", "Content-Type", "traceparent"],
+    expose_headers=["X-Trace-Id"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    parent = parse_traceparent(request.headers.get("traceparent"))
+    with span(f"{request.method} {request.url.path}", parent=parent, method=request.method) as root:
+        response = await call_next(request)
+        root.set_attribute("status_code", response.status_code)
+    response.headers["X-Trace-Id"] = root.trace_id
+    return response
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: UpstreamUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{exc.upstream} is temporarily unavailable, retry later"},
+        headers={"Retry-After": "5"}
+    )
+
+
+def _warm_up() -> None:
+    try:
+        _document_processor()
+    except Exception as e:
+        # The first request that needs the processor retries and reports the error
+        print(f"Processor warm-up failed: {str(e)}")
+
+
+@app.on_event("startup")
+async def warm_up_processor():
+    # Import the RAG stack and connect to Qdrant/state in the background; requests that
+    # need the processor before it is ready wait for it without blocking the event loop
+    if settings.WARMUP_ON_STARTUP:
+        asyncio.get_running_loop().run_in_executor(None, _warm_up)
+
+
+@app.on_event("startup")
+async def start_garbage_collection():
+    if settings.GC_INTERVAL_SECONDS > 0:
+        from app.services.gc import run_periodic_gc
+
+        asyncio.create_task(run_periodic_gc(get_document_processor, settings.GC_INTERVAL_SECONDS))
+
 
 app.include_router(v1_router, prefix="/v1")
@@ -1,11 +1,7 @@
-from pathlib import Path
-
 from sqlalchemy import Column, Integer, String, JSON, ForeignKey, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
-from app.core.config import settings
-
 Base = declarative_base()
 
 
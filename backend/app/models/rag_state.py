@@ -0,0 +1,22 @@
+from sqlalchemy import BigInteger, Column, DateTime, Integer, JSON, Text, func
+
+from app.models.document import Base
+
+
+class RAGDocumentState(Base):
+    """Summary and hierarchy entry of one document (STATE_BACKEND=postgres)"""
+    __tablename__ = "rag_documents"
+
+    doc_id = Column(Text, primary_key=True)
+    summary = Column(Text, nullable=True)
+    hierarchy = Column(JSON, nullable=True)
+    version = Column(BigInteger, nullable=False, index=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class RAGStateVersion(Base):
+    """Single-row counter bumped by every state write"""
+    __tablename__ = "rag_state"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
@@ -1,6 +1,7 @@
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, literal
+from app.core.tracing import traced
 from app.models.document import Document
 
 
@@ -8,12 +9,22 @@ class DocumentRepository:
     def __init__(self, session: AsyncSession):
         self.session = session
     
+    @traced()
     async def create(self, document: Document) -> Document:
         self.session.add(document)
         await self.session.commit()
         await self.session.refresh(document)
         return document
     
+    @traced()
+    async def create_many(self, documents: List[Document]) -> List[Document]:
+        """Insert several documents in a single transaction"""
+        self.session.add_all(documents)
+        await self.session.flush()
+        await self.session.commit()
+        return documents
+
+    @traced()
     async def get_by_parent(self, parent_id: Optional[int]) -> List[Document]:
         query = select(Document)
 
@@ -23,23 +34,98 @@ class DocumentRepository:
         result = await self.session.execute(query)
         return result.scalars().all()
 
+    @traced()
     async def get_by_id(self, document_id: int) -> Optional[Document]:
         query = select(Document).where(Document.id == document_id)
         result = await self.session.execute(query)
         return result.scalar_one_or_none()
 
+    @traced()
+    async def get_subtree(self, document_id: int) -> List[Document]:
+        """Document and all its descendants (recursive CTE over parent_id)"""
+        tree = select(Document.id).where(Document.id == document_id).cte(name="tree", recursive=True)
+        tree = tree.union_all(select(Document.id).where(Document.parent_id == tree.c.id))
+        query = select(Document).where(Document.id.in_(select(tree.c.id)))
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    @traced()
+    async def get_ancestor_ids(self, document_id: Optional[int]) -> List[int]:
+        """Ids from the top-level folder down to ``document_id`` itself"""
+        if document_id is None:
+            return []
+        chain = select(Document.id, Document.parent_id, literal(0).label("depth")) \
+            .where(Document.id == document_id).cte(name="chain", recursive=True)
+        chain = chain.union_all(
+            select(Document.id, Document.parent_id, chain.c.depth + 1).where(Document.id == chain.c.parent_id)
+        )
+        result = await self.session.execute(select(chain.c.id).order_by(chain.c.depth.desc()))
+        return list(result.scalars().all())
+
+    @traced()
+    async def get_file_by_name(self, filename: str, parent_id: Optional[int]) -> Optional[Document]:
+        """File uploaded as ``filename`` into ``parent_id`` (download_url is '<8 chars>_<filename>')"""
+        escaped = filename.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = select(Document).where(Document.download_url.like("_" * 8 + "\\_" + escaped, escape="\\"))
+        if parent_id is None:
+            query = query.where(Document.parent_id.is_(None))
+        else:
+            query = query.where(Document.parent_id == parent_id)
+        result = await self.session.execute(query.order_by(Document.id.desc()).limit(1))
+        return result.scalar_one_or_none()
+
+    @traced()
+    async def get_file_by_source_path(self, source_path: str) -> Optional[Document]:
+        """File uploaded from ``source_path`` (doc_metadata.source_path, set by the file monitor)"""
+        query = select(Document).where(Document.doc_metadata["source_path"].as_string() == source_path)
+        result = await self.session.execute(query.order_by(Document.id.desc()).limit(1))
+        return result.scalar_one_or_none()
+
+    @traced()
+    async def get_by_download_urls(self, download_urls: List[str]) -> List[Document]:
+        if not download_urls:
+            return []
+        query = select(Document).where(Document.download_url.in_(download_urls))
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    @traced()
+    async def get_by_type(self, doc_type: str) -> List[Document]:
+        """All folders or all files (doc_metadata.type)"""
+        query = select(Document).where(Document.doc_metadata["type"].as_string() == doc_type)
+        result = await self.session.execute(query)
+        return result.scalars().all()
+
+    @traced()
     async def update(self, document: Document) -> Document:
         await self.session.commit()
         await self.session.refresh(document)
         return document
 
+    @traced()
+    async def update_many(self, documents: List[Document]) -> List[Document]:
+        """Commit pending changes of several documents at once"""
+        await self.session.commit()
+        return documents
+
+    @traced()
     async def search(self, query: str) -> list[Document]:
         sql_query = select(Document).limit(3)
         result = await self.session.execute(sql_query)
         return result.scalars().all()
 
+    @traced()
     async def delete(self, document_id: int) -> None:
         """Delete document by id"""
         query = delete(Document).where(Document.id == document_id)
         await self.session.execute(query)
         await self.session.commit()
+
+    @traced()
+    async def delete_many(self, document_ids: List[int]) -> None:
+        """Delete several documents in one statement"""
+        if not document_ids:
+            return
+        query = delete(Document).where(Document.id.in_(document_ids))
+        await self.session.execute(query)
+        await self.session.commit()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 
 class DocumentBase(BaseModel):
@@ -34,6 +34,26 @@ class FolderResponse(BaseModel):
     id: int
 
 
+class PlaceCandidate(BaseModel):
+    folder_id: int
+    folder_name: str
+    score: float
+
+
 class PlaceResponse(BaseModel):
-    folder_parent_id: int
+    folder_parent_id: Optional[int] = None
     folder_name: str
+    score: Optional[float] = None
+    source: str = "centroid"
+    candidates: List[PlaceCandidate] = []
+
+
+class BulkUploadItem(BaseModel):
+    filename: str
+    id: Optional[int] = None
+    status: str
+    detail: Optional[str] = None
+
+
+class BulkUploadResponse(BaseModel):
+    documents: List[BulkUploadItem]
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import math
+import re
+import time
+from pathlib import Path
+from typing import Any, List, Optional
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import (
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.embeddings.text_embeddings_inference import TextEmbeddingsInference
+from llama_index.llms.anthropic import Anthropic
+from pydantic import Field
+from qdrant_client import QdrantClient
+
+from app.core.config import settings
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedding(BaseEmbedding):
+    """Deterministic offline embedder: signed feature hashing of words and character trigrams.
+
+    Same dimension as bge-small so collections and payloads stay interchangeable; texts
+    sharing vocabulary get similar vectors, which is enough for profiling and CI.
+    """
+
+    dim: int = Field(default=384, description="Embedding dimension")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashingEmbedding"
+
+    def _features(self, text: str) -> List[str]:
+        words = TOKEN_RE.findall(text.lower())
+        trigrams = [word[i:i + 3] for word in words if len(word) > 3 for i in range(len(word) - 2)]
+        return words + trigrams
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "big") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+
+class StubLLM(CustomLLM):
+    """Scripted LLM with configurable latency for offline runs.
+
+    Rules are ``[{"match": "substring", "response": "text"}]``, checked in order; prompts
+    that ask for JSON get ``{}`` and everything else an echo of the prompt head.
+    """
+
+    latency_ms: int = 0
+    rules: List[dict] = Field(default_factory=list)
+    model_name: str = "stub"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "StubLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model_name, num_output=512, context_window=200000)
+
+    def _respond(self, prompt: str) -> str:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+        for rule in self.rules:
+            if rule["match"] in prompt:
+                return rule["response"]
+
+        if "valid JSON" in prompt:
+            return "{}"
+        return "Stub response: " + " ".join(prompt.split())[:200]
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self._respond(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        text = self._respond(prompt)
+        yield CompletionResponse(text=text, delta=text)
+
+
+def build_llm(model_name: str):
+    if settings.LLM_BACKEND == "stub":
+        rules = []
+        if settings.STUB_LLM_SCRIPT:
+            rules = json.loads(Path(settings.STUB_LLM_SCRIPT).read_text())
+        return StubLLM(latency_ms=settings.STUB_LLM_LATENCY_MS, rules=rules)
+
+    if settings.LLM_BACKEND != "anthropic":
+        raise ValueError(f"Unsupported LLM_BACKEND: {settings.LLM_BACKEND}")
+    return Anthropic(
+        model=model_name,
+        api_key=settings.ANTHROPIC_API_KEY,
+        max_tokens=8000
+    )
+
+
+def build_anthropic_client():
+    """Raw Anthropic client for calls that need prompt caching, None for other backends"""
+    if settings.LLM_BACKEND != "anthropic":
+        return None
+
+    import anthropic
+
+    return anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
+
+
+def build_embed_model(model_name: str):
+    if settings.EMBEDDING_BACKEND == "hashing":
+        return HashingEmbedding(dim=settings.QDRANT_VECTOR_SIZE)
+
+    if settings.EMBEDDING_BACKEND != "tei":
+        raise ValueError(f"Unsupported EMBEDDING_BACKEND: {settings.EMBEDDING_BACKEND}")
+    if not settings.TEI_BASE_URL:
+        raise ValueError("TEI_BASE_URL is required for EMBEDDING_BACKEND=tei")
+    return TextEmbeddingsInference(
+        model_name=model_name,
+        base_url=settings.TEI_BASE_URL
+    )
+
+
+def build_qdrant_client(location: Optional[str] = None) -> QdrantClient:
+    """Remote Qdrant by URL, embedded on disk (QDRANT_PATH) or in memory (":memory:")"""
+    if settings.QDRANT_PATH:
+        return QdrantClient(path=settings.QDRANT_PATH)
+    return QdrantClient(location=location or settings.QDRANT_URL)
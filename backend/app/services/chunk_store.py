@@ -0,0 +1,321 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.core.serialization import dumps, loads
+
+try:
+    import zstandard
+except ImportError:  # optional dependency, zlib is used instead
+    zstandard = None
+
+
+# Index entry: key hash, record offset in the segment, record length (0 marks a deletion)
+INDEX_DTYPE = np.dtype([("key", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+# Record: codec, key length, key (checked on read), compressed text
+RECORD_HEADER = struct.Struct("<BH")
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+# Appended entries are looked up in a dict until there are this many, then the sorted index is rebuilt
+TAIL_REBUILD_ENTRIES = 65536
+MANIFEST_PREFIX = "doc:"
+
+
+def key_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class ChunkStore:
+    """Append-only, compressed store of chunk texts keyed by node_id.
+
+    Texts are compressed one by one (zstd when installed, else zlib) and appended to
+    ``<path>.seg``; ``<path>.idx`` is an append-only array of fixed-size entries that is
+    memory-mapped and searched through a sorted copy of its keys, so lookups never read
+    the segment index into Python objects. Later entries win, deletions append
+    tombstones, and ``compact()`` rewrites the live records.
+
+    Each document also has a manifest (``set_documents``): its node ids in node order
+    with their character offsets, so the neighbours of a hit are read locally.
+    Appends take a lock file, so several workers on one host can share the store; a
+    worker notices appends and compactions of the others on its next read.
+    """
+
+    def __init__(self, path: Path, codec: str = "zstd", level: int = 3):
+        path = Path(path)
+        self.segment_path = path.with_name(path.name + ".seg")
+        self.index_path = path.with_name(path.name + ".idx")
+        self.lock_path = path.with_name(path.name + ".lock")
+        if codec == "zstd" and zstandard is not None:
+            self.codec = CODEC_ZSTD
+            self._compressor = zstandard.ZstdCompressor(level=level)
+        else:
+            self.codec = CODEC_ZLIB
+            self._compressor = None
+        self.level = level
+        self._lock = threading.RLock()
+        self._file_locked = False
+        self._segment = None
+        self._index = None
+        self._open()
+
+    # Files and the in-memory view of the index
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool = True) -> Iterator[None]:
+        """Lock file shared by the workers; re-entrant within this process (call under self._lock)"""
+        if self._file_locked:
+            yield
+            return
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._file_locked = True
+            try:
+                yield
+            finally:
+                self._file_locked = False
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open(self) -> None:
+        with self._lock, self._file_lock(exclusive=False):
+            for f in (self._segment, self._index):
+                if f is not None:
+                    f.close()
+            self._segment = open(self.segment_path, "a+b")
+            self._index = open(self.index_path, "a+b")
+            stat = os.fstat(self._index.fileno())
+            self._inode = stat.st_ino
+            self._entries = np.empty(0, dtype=INDEX_DTYPE)
+            self._loaded = 0
+            self._map(stat.st_size // INDEX_DTYPE.itemsize, tail=False)
+            self._rebuild()
+
+    def _map(self, count: int, tail: bool = True) -> None:
+        """Map the first ``count`` index entries; with ``tail`` the new ones are added to the tail dict"""
+        if count <= self._loaded:
+            return
+        # Older mappings are released once no array refers to them
+        mapping = mmap.mmap(self._index.fileno(), count * INDEX_DTYPE.itemsize, access=mmap.ACCESS_READ)
+        self._entries = np.frombuffer(mapping, dtype=INDEX_DTYPE, count=count)
+        if tail:
+            for key, offset, length in self._entries[self._loaded:count].tolist():
+                self._tail[key] = (offset, length)
+        self._loaded = count
+        if tail and len(self._tail) >= TAIL_REBUILD_ENTRIES:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        keys = self._entries["key"]
+        # Stable sort: among equal keys the last entry is the current one
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+        self._tail: Dict[int, Tuple[int, int]] = {}
+
+    def _refresh(self) -> None:
+        """Pick up entries appended by other workers, reopen after a compaction"""
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode:
+            self._open()
+        else:
+            self._map(stat.st_size // INDEX_DTYPE.itemsize)
+
+    def _locate(self, hashes: List[int]) -> List[Optional[Tuple[int, int]]]:
+        """(offset, length) of the current entry of each key hash, None if missing or deleted"""
+        found = [self._tail.get(h) for h in hashes]
+        pending = [i for i, location in enumerate(found) if location is None]
+        if pending and len(self._sorted_keys):
+            query = np.array([hashes[i] for i in pending], dtype=np.uint64)
+            positions = np.searchsorted(self._sorted_keys, query, side="right") - 1
+            valid = positions >= 0
+            valid[valid] = self._sorted_keys[positions[valid]] == query[valid]
+            entries = self._entries[self._order[positions[valid]]]
+            for i, offset, length in zip(
+                    np.asarray(pending)[valid].tolist(), entries["offset"].tolist(), entries["length"].tolist()
+            ):
+                found[i] = (offset, length)
+        return [location if location and location[1] else None for location in found]
+
+    # Records
+
+    def _encode(self, key: str, text: str) -> bytes:
+        key_bytes = key.encode("utf-8")
+        data = text.encode("utf-8")
+        if self.codec == CODEC_ZSTD:
+            data = self._compressor.compress(data)
+        else:
+            data = zlib.compress(data, self.level)
+        return RECORD_HEADER.pack(self.codec, len(key_bytes)) + key_bytes + data
+
+    @staticmethod
+    def _decode(record: bytes, key: str, decompressor) -> Optional[str]:
+        codec, key_length = RECORD_HEADER.unpack_from(record)
+        start = RECORD_HEADER.size
+        if record[start:start + key_length] != key.encode("utf-8"):
+            return None  # hash collision
+        data = record[start + key_length:]
+        if codec == CODEC_ZSTD:
+            if decompressor is None:
+                raise RuntimeError("Chunk store has zstd records, install zstandard to read them")
+            return decompressor.decompress(data).decode("utf-8")
+        return zlib.decompress(data).decode("utf-8")
+
+    def _append(self, records: List[Tuple[int, bytes]]) -> None:
+        """Append (key hash, record) pairs; an empty record is a deletion"""
+        if not records:
+            return
+        with self._lock, self._file_lock():
+            # Another worker may have compacted the files since our last read
+            self._refresh()
+            offset = os.fstat(self._segment.fileno()).st_size
+            entries = np.zeros(len(records), dtype=INDEX_DTYPE)
+            for i, (h, record) in enumerate(records):
+                entries[i] = (h, offset if record else 0, len(record))
+                offset += len(record)
+            # Records first: an index entry never points past the end of the segment
+            self._segment.write(b"".join(record for _, record in records))
+            self._segment.flush()
+            self._index.write(entries.tobytes())
+            self._index.flush()
+            self._refresh()
+
+    def put_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        self._append([(key_hash(key), self._encode(key, text)) for key, text in items])
+
+    def delete(self, keys: Iterable[str]) -> None:
+        self._append([(key_hash(key), b"") for key in keys])
+
+    def contains_many(self, keys: Iterable[str]) -> Set[str]:
+        keys = list(keys)
+        with self._lock:
+            self._refresh()
+            locations = self._locate([key_hash(key) for key in keys])
+        return {key for key, location in zip(keys, locations) if location is not None}
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Texts of the stored keys; adjacent records are read with one pread"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        with self._lock:
+            self._refresh()
+            located = sorted(
+                (location, key)
+                for key, location in zip(keys, self._locate([key_hash(key) for key in keys]))
+                if location is not None
+            )
+            reads = []
+            run: List[Tuple[Tuple[int, int], str]] = []
+            for location, key in located:
+                if run and location[0] != run[-1][0][0] + run[-1][0][1]:
+                    reads.append(run)
+                    run = []
+                run.append((location, key))
+            if run:
+                reads.append(run)
+
+            fd = self._segment.fileno()
+            blocks = []
+            for run in reads:
+                start = run[0][0][0]
+                end = run[-1][0][0] + run[-1][0][1]
+                blocks.append((start, os.pread(fd, end - start, start), run))
+
+        decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+        texts = {}
+        for start, block, run in blocks:
+            for (offset, length), key in run:
+                text = self._decode(block[offset - start:offset - start + length], key, decompressor)
+                if text is not None:
+                    texts[key] = text
+        return texts
+
+    def get(self, key: str) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    # Document manifests
+
+    def set_documents(self, manifests: Dict[str, List[Tuple[str, Optional[int], Optional[int]]]]) -> None:
+        """Store each document's (node_id, start_char_idx, end_char_idx) list in node order"""
+        self.put_many((MANIFEST_PREFIX + doc_id, dumps(nodes).decode("utf-8")) for doc_id, nodes in manifests.items())
+
+    def documents(self, doc_ids: Iterable[str]) -> Dict[str, List[list]]:
+        manifests = self.get_many(MANIFEST_PREFIX + doc_id for doc_id in doc_ids)
+        return {key[len(MANIFEST_PREFIX):]: loads(value) for key, value in manifests.items()}
+
+    def delete_documents(self, doc_ids: Iterable[str]) -> None:
+        """Delete the documents' manifests and every chunk listed in them"""
+        doc_ids = list(doc_ids)
+        manifests = self.documents(doc_ids)
+        self.delete(
+            [node[0] for nodes in manifests.values() for node in nodes]
+            + [MANIFEST_PREFIX + doc_id for doc_id in doc_ids]
+        )
+
+    # Maintenance
+
+    def _live_entries(self) -> np.ndarray:
+        """Current entry of every stored key, in segment order; call under the lock after _rebuild"""
+        if not len(self._sorted_keys):
+            return np.empty(0, dtype=INDEX_DTYPE)
+        last = np.append(self._sorted_keys[1:] != self._sorted_keys[:-1], True)
+        live = self._entries[self._order[last]]
+        live = live[live["length"] > 0]
+        return live[np.argsort(live["offset"], kind="stable")]
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            self._refresh()
+            self._rebuild()
+            live = self._live_entries()
+            segment_bytes = os.fstat(self._segment.fileno()).st_size
+        live_bytes = int(live["length"].sum())
+        return {
+            "codec": "zstd" if self.codec == CODEC_ZSTD else "zlib",
+            "records": len(live),
+            "live_bytes": live_bytes,
+            "segment_bytes": segment_bytes,
+            "index_bytes": self._loaded * INDEX_DTYPE.itemsize,
+            "garbage_ratio": 1 - live_bytes / segment_bytes if segment_bytes else 0.0,
+        }
+
+    def compact(self) -> int:
+        """Rewrite only the live records; returns the bytes reclaimed"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            self._rebuild()
+            live = self._live_entries()
+            fd = self._segment.fileno()
+            before = os.fstat(fd).st_size
+
+            tmp_segment = self.segment_path.with_name(self.segment_path.name + ".tmp")
+            tmp_index = self.index_path.with_name(self.index_path.name + ".tmp")
+            entries = np.zeros(len(live), dtype=INDEX_DTYPE)
+            offset = 0
+            with open(tmp_segment, "wb") as segment:
+                for i, (key, old_offset, length) in enumerate(live.tolist()):
+                    segment.write(os.pread(fd, length, old_offset))
+                    entries[i] = (key, offset, length)
+                    offset += length
+            tmp_index.write_bytes(entries.tobytes())
+
+            # Readers open both files under the shared lock, so they never see a mixed pair
+            os.replace(tmp_segment, self.segment_path)
+            os.replace(tmp_index, self.index_path)
+        self._open()
+        return before - offset
+
+    def close(self) -> None:
+        with self._lock:
+            self._segment.close()
+            self._index.close()
@@ -0,0 +1,141 @@
+import logging
+import time
+from datetime import date, datetime, time as day_time
+from typing import Dict, List, Optional, Set, Tuple
+
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from qdrant_client.http.models import Distance, VectorParams
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def collection_names(client: QdrantClient) -> Tuple[Set[str], Dict[str, str]]:
+    """Return (concrete collection names, alias -> collection)"""
+    collections = {collection.name for collection in client.get_collections().collections}
+    aliases = {alias.alias_name: alias.collection_name for alias in client.get_aliases().aliases}
+    return collections, aliases
+
+
+def quantization_config() -> Optional[models.ScalarQuantization]:
+    if settings.QDRANT_QUANTIZATION == "none":
+        return None
+    if settings.QDRANT_QUANTIZATION != "int8":
+        raise ValueError(f"Unsupported QDRANT_QUANTIZATION: {settings.QDRANT_QUANTIZATION}")
+
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8,
+            quantile=0.99,
+            always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM
+        )
+    )
+
+
+def search_params() -> models.SearchParams:
+    """Search-time HNSW ef and rescoring of quantized candidates with original vectors"""
+    quantization = None
+    if settings.QDRANT_QUANTIZATION != "none":
+        quantization = models.QuantizationSearchParams(rescore=True)
+
+    return models.SearchParams(hnsw_ef=settings.QDRANT_HNSW_EF, quantization=quantization)
+
+
+def search_filter(
+        folder_id: Optional[int] = None,
+        file_types: Optional[List[str]] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None
+) -> Optional[models.Filter]:
+    """Payload filter for scoped searches, None when nothing is restricted.
+
+    ``folder_id`` matches files anywhere below the folder (``folder_path`` holds all
+    ancestor folder ids); dates are compared against ``creation_ts``.
+    """
+    conditions = []
+    if folder_id is not None:
+        conditions.append(models.FieldCondition(key="folder_path", match=models.MatchValue(value=folder_id)))
+    if file_types:
+        conditions.append(models.FieldCondition(key="metadata.file_type", match=models.MatchAny(any=list(file_types))))
+    if date_from is not None or date_to is not None:
+        conditions.append(models.FieldCondition(key="creation_ts", range=models.Range(
+            gte=datetime.combine(date_from, day_time.min).timestamp() if date_from else None,
+            lte=datetime.combine(date_to, day_time.max).timestamp() if date_to else None
+        )))
+    return models.Filter(must=conditions) if conditions else None
+
+
+def create_collection(client: QdrantClient, collection_name: str, vector_size: Optional[int] = None) -> None:
+    """Create a collection with the layout from settings and its payload indexes"""
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(
+            size=vector_size or settings.QDRANT_VECTOR_SIZE,
+            distance=Distance.COSINE,
+            on_disk=settings.QDRANT_ON_DISK_VECTORS
+        ),
+        hnsw_config=models.HnswConfigDiff(
+            m=settings.QDRANT_HNSW_M,
+            ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT,
+            on_disk=settings.QDRANT_ON_DISK_VECTORS
+        ),
+        quantization_config=quantization_config(),
+        on_disk_payload=settings.QDRANT_ON_DISK_PAYLOAD
+    )
+
+    ensure_payload_indexes(client, collection_name)
+    logger.info("Created Qdrant collection %s", collection_name)
+
+
+def ensure_payload_indexes(client: QdrantClient, collection_name: str) -> None:
+    """Create the payload indexes from settings that the collection does not have yet"""
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field_name, field_schema in settings.QDRANT_PAYLOAD_INDEXES.items():
+        if field_name in existing:
+            continue
+        client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=models.PayloadSchemaType(field_schema)
+        )
+
+
+def ensure_collection(client: QdrantClient, name: str, vector_size: Optional[int] = None) -> None:
+    """Create the collection unless a collection or alias with this name already exists;
+    an existing one gets any payload indexes added to settings since it was created"""
+    collections, aliases = collection_names(client)
+    if name not in collections and name not in aliases:
+        create_collection(client, name, vector_size)
+    else:
+        ensure_payload_indexes(client, aliases.get(name, name))
+
+
+def versioned_collection_name(alias: str) -> str:
+    return f"{alias}_v{int(time.time())}"
+
+
+def switch_alias(client: QdrantClient, alias: str, collection_name: str) -> Optional[str]:
+    """Point ``alias`` to ``collection_name`` atomically, return the previous target.
+
+    A legacy deployment may still have a concrete collection named like the alias; it
+    has to be dropped before the alias can be created, which is the only moment the
+    name is briefly unavailable.
+    """
+    collections, aliases = collection_names(client)
+    operations = []
+    previous = aliases.get(alias)
+
+    if previous:
+        operations.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    elif alias in collections:
+        logger.warning("Replacing concrete collection %s with an alias", alias)
+        client.delete_collection(collection_name=alias)
+
+    operations.append(models.CreateAliasOperation(
+        create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias)
+    ))
+    client.update_collection_aliases(change_aliases_operations=operations)
+    return previous
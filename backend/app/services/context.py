@@ -0,0 +1,111 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+# A span that only partly fits is trimmed to the rest of the budget unless less than this is left
+MIN_TRIMMED_SPAN_TOKENS = 64
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for Claude/BGE tokenizers)"""
+    return (len(text) + 3) // 4
+
+
+def merge_windows(hits: List[Dict[str, Any]], context_window: int) -> List[Dict[str, Any]]:
+    """Merge overlapping or adjacent node windows of the same document into spans.
+
+    Each hit is ``{"doc_id", "index", "total_nodes", "score"}``; the returned spans are
+    ``{"doc_id", "start", "end", "score", "hit"}`` with inclusive node indices, the best hit
+    score and the node index of that hit.
+    """
+    windows: Dict[str, List[Tuple[int, int, float, int]]] = {}
+    for hit in hits:
+        start = max(0, hit["index"] - context_window)
+        end = min(hit["total_nodes"] - 1, hit["index"] + context_window)
+        windows.setdefault(hit["doc_id"], []).append((start, end, hit["score"], hit["index"]))
+
+    spans = []
+    for doc_id, doc_windows in windows.items():
+        doc_windows.sort()
+        current = None
+        for start, end, score, index in doc_windows:
+            if current and start <= current["end"] + 1:
+                current["end"] = max(current["end"], end)
+                if score > current["score"]:
+                    current.update(score=score, hit=index)
+            else:
+                current = {"doc_id": doc_id, "start": start, "end": end, "score": score, "hit": index}
+                spans.append(current)
+
+    return spans
+
+
+def join_nodes(nodes: List[Dict[str, Any]]) -> str:
+    """Concatenate consecutive node texts, cutting the chunk overlap shared by neighbours.
+
+    Nodes are ``{"text", "start_char_idx", "end_char_idx"}`` in document order.
+    """
+    return join_nodes_with_offsets(nodes)[0]
+
+
+def join_nodes_with_offsets(nodes: List[Dict[str, Any]]) -> Tuple[str, List[Tuple[int, int]]]:
+    """join_nodes plus the (start, end) character range of every node in the joined text"""
+    text = ""
+    offsets = []
+    prev_end: Optional[int] = None
+    for node in nodes:
+        node_text = node["text"]
+        start = node.get("start_char_idx")
+        if offsets and prev_end is not None and start is not None and 0 < prev_end - start < len(node_text):
+            # Continuous text: drop the overlap and glue to the previous node
+            offsets.append((len(text) - (prev_end - start), len(text) + len(node_text) - (prev_end - start)))
+            text += node_text[prev_end - start:]
+        else:
+            if offsets:
+                text += "\n"
+            offsets.append((len(text), len(text) + len(node_text)))
+            text += node_text
+        prev_end = node.get("end_char_idx")
+    return text, offsets
+
+
+def trim_span(span: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+    """Cut the span text to ``max_tokens`` around its best hit (``hit_chars``, else the start)"""
+    max_chars = max(0, max_tokens) * 4
+    text = span["text"]
+    if len(text) <= max_chars:
+        return span
+
+    hit_start, hit_end = span.get("hit_chars") or (0, 0)
+    start = min(max(0, (hit_start + hit_end) // 2 - max_chars // 2), len(text) - max_chars)
+    if hit_end - hit_start <= max_chars:
+        # The whole hit node fits: keep it
+        start = min(max(start, hit_end - max_chars), hit_start)
+    return {**span, "text": text[start:start + max_chars], "trimmed": True}
+
+
+def pack_spans(spans: List[Dict[str, Any]], token_budget: int) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Greedily pack the best-scoring spans (which carry ``text``) under a token budget.
+
+    The best span is always included and the first span that only partly fits is trimmed
+    around its hit (see trim_span) instead of being skipped.
+    """
+    packed = []
+    stats = {"packed_tokens": 0, "dropped_tokens": 0, "packed_spans": 0, "dropped_spans": 0, "trimmed_spans": 0}
+
+    for rank, span in enumerate(sorted(spans, key=lambda span: span["score"], reverse=True)):
+        tokens = estimate_tokens(span["text"])
+        remaining = token_budget - stats["packed_tokens"]
+        if tokens > remaining and (rank == 0 or remaining >= MIN_TRIMMED_SPAN_TOKENS):
+            span = trim_span(span, remaining)
+            stats["dropped_tokens"] += tokens - estimate_tokens(span["text"])
+            stats["trimmed_spans"] += 1
+            tokens = estimate_tokens(span["text"])
+
+        if tokens <= remaining:
+            packed.append(span)
+            stats["packed_tokens"] += tokens
+            stats["packed_spans"] += 1
+        else:
+            stats["dropped_tokens"] += tokens
+            stats["dropped_spans"] += 1
+
+    return packed, stats
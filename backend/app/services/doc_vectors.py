@@ -0,0 +1,109 @@
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+class DocumentVectorIndex:
+    """Document-level vectors (chunk-embedding centroids) in one normalized NumPy matrix.
+
+    Rows are appended in place with amortized growth; cosine neighbours of one or many
+    documents are a single matrix product.
+    """
+
+    def __init__(self, path: Path, dim: int):
+        self.path = Path(path)
+        self.dim = dim
+        self._lock = threading.RLock()
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.matrix = np.zeros((16, dim), dtype=np.float32)
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.rows
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            ids = [str(doc_id) for doc_id in data["ids"]]
+            vectors = data["vectors"].astype(np.float32)
+        with self._lock:
+            self.ids = ids
+            self.rows = {doc_id: row for row, doc_id in enumerate(ids)}
+            self.matrix = np.zeros((max(16, len(ids) * 2), self.dim), dtype=np.float32)
+            self.matrix[:len(ids)] = vectors
+
+    def save(self) -> None:
+        with self._lock:
+            ids = np.array(self.ids, dtype=str)
+            vectors = self.matrix[:len(self.ids)].copy()
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez(tmp_path, ids=ids, vectors=vectors)
+        tmp_path.replace(self.path)
+
+    def upsert(self, doc_id: str, vector: Iterable[float]) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / (np.linalg.norm(vector) + 1e-12)
+        with self._lock:
+            row = self.rows.get(doc_id)
+            if row is None:
+                row = len(self.ids)
+                if row == len(self.matrix):
+                    grown = np.zeros((len(self.matrix) * 2, self.dim), dtype=np.float32)
+                    grown[:row] = self.matrix[:row]
+                    self.matrix = grown
+                self.ids.append(doc_id)
+                self.rows[doc_id] = row
+            self.matrix[row] = vector
+
+    def remove(self, doc_ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in doc_ids:
+                row = self.rows.pop(doc_id, None)
+                if row is None:
+                    continue
+                last = len(self.ids) - 1
+                if row != last:
+                    # Move the last row into the hole
+                    moved_id = self.ids[last]
+                    self.matrix[row] = self.matrix[last]
+                    self.ids[row] = moved_id
+                    self.rows[moved_id] = row
+                self.ids.pop()
+
+    def get(self, doc_id: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self.rows.get(doc_id)
+            return None if row is None else self.matrix[row].copy()
+
+    def neighbors(
+            self,
+            doc_ids: List[str],
+            top_k: int = 5,
+            threshold: float = 0.0
+    ) -> Dict[str, List[Tuple[str, float]]]:
+        """Top-k most similar other documents for each of ``doc_ids`` (one matrix product)"""
+        with self._lock:
+            query_rows = [self.rows[doc_id] for doc_id in doc_ids if doc_id in self.rows]
+            size = len(self.ids)
+            if not query_rows or size < 2:
+                return {doc_id: [] for doc_id in doc_ids}
+
+            scores = self.matrix[query_rows] @ self.matrix[:size].T
+            ids = list(self.ids)
+
+        scores[np.arange(len(query_rows)), query_rows] = -np.inf
+        k = min(top_k, size - 1)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        result = {}
+        for i, row in enumerate(query_rows):
+            candidates = sorted(((float(scores[i, j]), ids[j]) for j in top[i]), reverse=True)
+            result[ids[row]] = [(doc_id, score) for score, doc_id in candidates if score >= threshold]
+        return result
@@ -4,19 +4,22 @@ import shutil
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, List, Tuple
+from typing import TYPE_CHECKING, Optional, Dict, List, Tuple
 
 from fastapi import UploadFile, HTTPException
 
 from app.core.config import settings
+from app.core.tracing import run_in_thread, traced
 from app.models.document import Document
 from app.schemas.document import DocumentCreate, FolderCreate
 from app.repositories.document import DocumentRepository
-from app.services.rag import DocumentProcessor
+
+if TYPE_CHECKING:
+    from app.services.rag import DocumentProcessor
 
 
 class DocumentService:
-    def __init__(self, repository: DocumentRepository, processor: DocumentProcessor):
+    def __init__(self, repository: DocumentRepository, processor: "DocumentProcessor"):
         self.repository = repository
         self.processor = processor
 
@@ -26,30 +29,154 @@ class DocumentService:
         safe_name = f"{unique_id}_{original_filename}"
         return safe_name
 
-    async def save_file(self, file: UploadFile) -> Path:
-        """Safely save uploaded file with unique name"""
-        safe_filename = self._generate_safe_filename(file.filename)
+    @staticmethod
+    def _read_texts(file_paths: List[Optional[Path]]) -> List[Optional[str]]:
+        """Full extracted text of the stored files (None for no path or an unreadable file).
+
+        The indexed Document only carries a preview, but ``content`` is shown and edited as
+        the whole file.
+        """
+        from app.services.extraction import read_text
+
+        texts = []
+        for file_path in file_paths:
+            if file_path is None:
+                texts.append(None)
+                continue
+            try:
+                texts.append(read_text(file_path))
+            except Exception as e:
+                print(f"Error reading {file_path}: {e}")
+                texts.append(None)
+        return texts
+
+    @traced()
+    async def save_file(self, file: UploadFile, filename: Optional[str] = None) -> Path:
+        """Safely save uploaded file with unique name, or replace the stored ``filename``"""
+        safe_filename = filename or self._generate_safe_filename(file.filename)
+        settings.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         file_path = settings.UPLOAD_DIR / safe_filename
+        tmp_path = file_path.with_name(file_path.name + ".part")
 
         try:
-            with file_path.open("wb") as buffer:
+            with tmp_path.open("wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
+            os.replace(tmp_path, file_path)
         except Exception as e:
-            if file_path.exists():
-                file_path.unlink()
+            if tmp_path.exists():
+                tmp_path.unlink()
             raise Exception(f"Failed to save file: {str(e)}")
 
         return file_path
 
+    async def _replaced_file(
+            self,
+            filename: str,
+            parent_id: Optional[int],
+            source_path: Optional[str]
+    ) -> Optional[Document]:
+        """File that an upload with ``replace`` overwrites: the one uploaded from the same
+        ``source_path`` if given, otherwise the one with the same name in the same folder"""
+        if source_path:
+            return await self.repository.get_file_by_source_path(source_path)
+        return await self.repository.get_file_by_name(filename, parent_id)
+
+    @staticmethod
+    def _file_metadata(metadata: Dict, file: UploadFile, source_path: Optional[str]) -> Dict:
+        file_metadata = {**metadata, "type": "file", "mime_type": file.content_type}
+        if source_path:
+            file_metadata["source_path"] = source_path
+        return file_metadata
+
+    def _untrack_placement(self, docs: List[Document]) -> None:
+        """Take files out of their folder centroids before their vectors change"""
+        folder_index = self.processor.folder_index
+        if not folder_index.exists():
+            return
+        for doc in docs:
+            folder_index.remove(doc.parent_id, self.processor.document_vector(doc.download_url))
+
+    @traced()
+    async def _ensure_folder_index(self) -> None:
+        """Build the folder centroid index from the document tree on first use"""
+        folder_index = self.processor.folder_index
+        if folder_index.exists():
+            return
+        files = await self.repository.get_by_type("file")
+        folder_index.rebuild(
+            (doc.parent_id, self.processor.document_vector(doc.download_url))
+            for doc in files
+            if doc.parent_id is not None and doc.download_url
+        )
+        folder_index.save()
+
+    def _track_placement(self, docs: List[Document]) -> None:
+        """Add newly indexed files to the centroids of their folders"""
+        folder_index = self.processor.folder_index
+        if not folder_index.exists():
+            # Not built yet: the first get_place builds it from the whole tree
+            return
+        for doc in docs:
+            folder_index.add(doc.parent_id, self.processor.document_vector(doc.download_url))
+        folder_index.save()
+
+    @traced()
     async def get_place(self, document: DocumentCreate) -> Dict[str, any]:
-        """Determine the best place for a document based on content"""
-        # Here you would implement your logic to analyze content and suggest placement
-        # For now, returning mock data
-        return {
-            "folder_parent_id": 1,
-            "folder_name": "suggested_folder"
+        """Suggest folders for a document by similarity to the folder centroids.
+
+        Falls back to an LLM pick when the best folder scores below PLACEMENT_MIN_SCORE.
+        """
+        await self._ensure_folder_index()
+        vector = await run_in_thread(self.processor.embed_document_text, document.content)
+        ranked = self.processor.folder_index.suggest(vector, top_k=settings.PLACEMENT_TOP_K)
+
+        folders = {
+            folder.id: (folder.doc_metadata or {}).get("name", folder.content)
+            for folder in await self.repository.get_by_type("folder")
         }
+        candidates = [
+            {"folder_id": folder_id, "folder_name": folders[folder_id], "score": round(score, 4)}
+            for folder_id, score in ranked
+            if folder_id in folders
+        ]
+
+        if candidates and candidates[0]["score"] >= settings.PLACEMENT_MIN_SCORE:
+            best = candidates[0]
+            return {
+                "folder_parent_id": best["folder_id"],
+                "folder_name": best["folder_name"],
+                "score": best["score"],
+                "source": "centroid",
+                "candidates": candidates
+            }
+
+        from app.services.placement import suggest_folder_with_llm
+
+        folder_id = await run_in_thread(
+            suggest_folder_with_llm, self.processor.llm_gateway.complete, document.content, folders
+        )
+        if folder_id is not None:
+            return {
+                "folder_parent_id": folder_id,
+                "folder_name": folders[folder_id],
+                "score": None,
+                "source": "llm",
+                "candidates": candidates
+            }
+
+        if candidates:
+            best = candidates[0]
+            return {
+                "folder_parent_id": best["folder_id"],
+                "folder_name": best["folder_name"],
+                "score": best["score"],
+                "source": "centroid",
+                "candidates": candidates
+            }
 
+        return {"folder_parent_id": None, "folder_name": "root", "score": None, "source": "none", "candidates": []}
+
+    @traced()
     async def create_folder(self, folder: FolderCreate) -> Dict[str, int]:
         doc = Document(
             content=folder.name,
@@ -59,41 +186,143 @@ class DocumentService:
         created = await self.repository.create(doc)
         return {"id": created.id}
     
-    async def create_document(self, file: UploadFile, parent_id: Optional[int] = None, metadata: Optional[str] = None) -> Document:
+    @traced()
+    async def create_document(
+            self,
+            file: UploadFile,
+            parent_id: Optional[int] = None,
+            metadata: Optional[str] = None,
+            replace: bool = False,
+            source_path: Optional[str] = None
+    ) -> Document:
         if not metadata:
             metadata = {}
         else:
             metadata = json.loads(metadata)
 
-        file_path = await self.save_file(file)
+        # With ``replace`` a re-uploaded file overwrites the stored one (see _replaced_file) and
+        # keeps its doc id, so only its changed chunks are re-embedded; otherwise it is a new document
+        existing = await self._replaced_file(file.filename, parent_id, source_path) if replace else None
+        if existing:
+            self._untrack_placement([existing])
+        file_path = await self.save_file(file, existing.download_url if existing else None)
 
-        doc = Document(
-            content=file.filename,
-            doc_metadata={**metadata, "type": "file", "mime_type": file.content_type},
-            parent_id=parent_id,
-            download_url=str(file_path.name),
-        )
-        doc = await self.repository.create(doc)
+        if existing:
+            doc = existing
+            doc.doc_metadata = {**(doc.doc_metadata or {}), **self._file_metadata(metadata, file, source_path)}
+        else:
+            doc = Document(
+                content=file.filename,
+                doc_metadata=self._file_metadata(metadata, file, source_path),
+                parent_id=parent_id,
+                download_url=str(file_path.name),
+            )
+            doc = await self.repository.create(doc)
 
-        llama_document = self.processor.add_document("data/" + doc.download_url)
+        folder_path = await self.repository.get_ancestor_ids(parent_id)
+        llama_document = await run_in_thread(self.processor.add_document, "data/" + doc.download_url, folder_path)
 
         if llama_document:
             doc.metadata = llama_document.metadata
-            doc.content = llama_document.get_content()
+            [text] = await run_in_thread(self._read_texts, [settings.UPLOAD_DIR / doc.download_url])
+            if text is not None:
+                doc.content = text
+            self._track_placement([doc])
 
         return await self.repository.update(doc)
 
+    @traced()
+    async def create_documents(
+            self,
+            files: List[UploadFile],
+            parent_id: Optional[int] = None,
+            metadata: Optional[str] = None,
+            replace: bool = False,
+            source_paths: Optional[List[str]] = None
+    ) -> List[Dict[str, any]]:
+        """Upload many files: one DB transaction and one batched RAG ingest.
+
+        ``replace`` and ``source_paths`` (aligned with ``files``) work as in create_document.
+        """
+        if not metadata:
+            metadata = {}
+        else:
+            metadata = json.loads(metadata)
+        if source_paths and len(source_paths) != len(files):
+            raise HTTPException(status_code=400, detail="source_paths must have one entry per file")
+        source_paths = source_paths or [None] * len(files)
+
+        results = [{"filename": file.filename, "id": None, "status": "failed", "detail": None} for file in files]
+        saved: List[Tuple[int, UploadFile, Path, Optional[Document]]] = []
+
+        for idx, (file, source_path) in enumerate(zip(files, source_paths)):
+            try:
+                existing = await self._replaced_file(file.filename, parent_id, source_path) if replace else None
+                if existing:
+                    self._untrack_placement([existing])
+                    existing.doc_metadata = {
+                        **(existing.doc_metadata or {}), **self._file_metadata(metadata, file, source_path)
+                    }
+                file_path = await self.save_file(file, existing.download_url if existing else None)
+                saved.append((idx, file, file_path, existing))
+            except Exception as e:
+                results[idx]["detail"] = str(e)
+
+        created = await self.repository.create_many([
+            Document(
+                content=file.filename,
+                doc_metadata=self._file_metadata(metadata, file, source_paths[idx]),
+                parent_id=parent_id,
+                download_url=str(file_path.name),
+            )
+            for idx, file, file_path, existing in saved
+            if existing is None
+        ])
+        created = iter(created)
+        docs = [existing or next(created) for _, _, _, existing in saved]
+
+        folder_path = await self.repository.get_ancestor_ids(parent_id)
+        llama_documents = await run_in_thread(
+            self.processor.add_documents,
+            ["data/" + doc.download_url for doc in docs],
+            [folder_path] * len(docs)
+        )
+
+        texts = await run_in_thread(self._read_texts, [
+            settings.UPLOAD_DIR / doc.download_url if llama_document else None
+            for doc, llama_document in zip(docs, llama_documents)
+        ])
+        for (idx, _, _, _), doc, llama_document, text in zip(saved, docs, llama_documents, texts):
+            results[idx]["id"] = doc.id
+            if llama_document:
+                if text is not None:
+                    doc.content = text
+                results[idx]["status"] = "indexed"
+            else:
+                results[idx]["status"] = "not_indexed"
+                results[idx]["detail"] = "Document was stored but could not be indexed"
+
+        self._track_placement([
+            doc for doc, llama_document in zip(docs, llama_documents) if llama_document
+        ])
+        await self.repository.update_many(docs)
+        return results
+
+    @traced()
     async def get_documents(self, parent_id: Optional[int] = None) -> List[Document]:
         return await self.repository.get_by_parent(parent_id)
 
+    @traced()
     async def get_file(self, document_id: int) -> Optional[Path]:
         """Get file path for document"""
         doc = await self.repository.get_by_id(document_id)
         return settings.UPLOAD_DIR / doc.download_url
 
+    @traced()
     async def get_document_by_id(self, document_id: int) -> Document:
         return await self.repository.get_by_id(document_id)
 
+    @traced()
     async def move_document(self, document_id: int, new_parent_id: int) -> Document:
         """Move document to new parent folder"""
         doc = await self.repository.get_by_id(document_id)
@@ -105,15 +334,48 @@ class DocumentService:
             if not new_parent or new_parent.doc_metadata.get("type") != "folder":
                 raise HTTPException(status_code=400, detail="Invalid destination folder")
 
+        if doc.doc_metadata.get("type") == "file" and self.processor.folder_index.exists():
+            vector = self.processor.document_vector(doc.download_url or "")
+            self.processor.folder_index.move(vector, doc.parent_id, new_parent_id)
+            self.processor.folder_index.save()
+
         doc.parent_id = new_parent_id
-        return await self.repository.update(doc)
+        doc = await self.repository.update(doc)
+
+        # Scoped search matches files by their ancestor folders, which just changed
+        await self.sync_folder_paths(await self.repository.get_subtree(doc.id))
+        return doc
+
+    @traced()
+    async def sync_folder_paths(self, docs: Optional[List[Document]] = None) -> int:
+        """Write the current ancestor folder ids of files into their points (all files by default)"""
+        if docs is None:
+            docs = await self.repository.get_by_type("file")
+
+        ancestors: Dict[Optional[int], List[int]] = {}
+        folder_paths = {}
+        for doc in docs:
+            if doc.doc_metadata.get("type") != "file" or not doc.download_url:
+                continue
+            if doc.parent_id not in ancestors:
+                ancestors[doc.parent_id] = await self.repository.get_ancestor_ids(doc.parent_id)
+            folder_paths[Path(doc.download_url).stem] = ancestors[doc.parent_id]
 
-    async def delete_document(self, document_id: int) -> None:
+        await run_in_thread(self.processor.set_folder_paths, folder_paths)
+        return len(folder_paths)
+
+    @traced()
+    async def delete_document(self, document_id: int, recursive: bool = False) -> None:
+        """Delete a document, or a folder with its whole subtree when ``recursive``.
+
+        Removes the rows, the stored files and everything indexed for them (points,
+        lexical entries, summaries, hierarchy edges, folder centroids).
+        """
         doc = await self.repository.get_by_id(document_id)
         if not doc:
             raise HTTPException(status_code=404, detail="Document not found")
 
-        if doc.doc_metadata.get("type") == "folder":
+        if doc.doc_metadata.get("type") == "folder" and not recursive:
             # Проверяем, есть ли документы в папке
             children = await self.repository.get_by_parent(doc.id)
             if children:
@@ -122,12 +384,36 @@ class DocumentService:
                     detail="Cannot delete folder with documents"
                 )
 
-        # Если это файл, удаляем физический файл
-        if doc.doc_metadata.get("type") == "file" and doc.download_url:
+        subtree = await self.repository.get_subtree(doc.id) if recursive else [doc]
+        files = [item for item in subtree if item.doc_metadata.get("type") == "file" and item.download_url]
+        folders = [item.id for item in subtree if item.doc_metadata.get("type") == "folder"]
+
+        folder_index = self.processor.folder_index
+        if folder_index.exists():
+            for item in files:
+                folder_index.remove(item.parent_id, self.processor.document_vector(item.download_url))
+            folder_index.drop_folders(folders)
+            folder_index.save()
+
+        await run_in_thread(self.processor.delete_documents, [Path(item.download_url).stem for item in files])
+
+        # Удаляем физические файлы
+        for item in files:
             try:
-                file_path = settings.UPLOAD_DIR / doc.download_url
+                file_path = settings.UPLOAD_DIR / item.download_url
                 file_path.unlink(missing_ok=True)
             except Exception as e:
                 print(f"Error deleting file: {e}")
 
-        await self.repository.delete(doc.id)
+        await self.repository.delete_many([item.id for item in subtree])
+
+    @traced()
+    async def collect_garbage(self) -> Dict[str, any]:
+        """Remove index entries of documents that have neither a database row nor a stored file"""
+        files = await self.repository.get_by_type("file")
+        live_doc_ids = {Path(doc.download_url).stem for doc in files if doc.download_url}
+        # Files indexed straight from the upload directory (process_directory) have no rows
+        if settings.UPLOAD_DIR.exists():
+            live_doc_ids |= {path.stem for path in settings.UPLOAD_DIR.iterdir() if path.is_file()}
+        removed = await run_in_thread(self.processor.collect_garbage, live_doc_ids)
+        return {"live": len(live_doc_ids), "removed": removed}
@@ -0,0 +1,119 @@
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.schema import TextNode
+
+
+# Characters of text kept in memory before the buffer is split into chunks
+CHUNK_BUFFER_CHARS = 64_000
+
+
+def iter_pages(path: Path) -> Iterator[Tuple[Optional[int], str]]:
+    """Yield (page number, text) one page at a time.
+
+    PDFs are read page by page; other formats have no pages and come from the regular
+    readers in one piece (page number None).
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".pdf":
+        from pypdf import PdfReader
+
+        reader = PdfReader(str(path))
+        for page_number in range(len(reader.pages)):
+            yield page_number + 1, reader.pages[page_number].extract_text() or ""
+        return
+
+    for doc in SimpleDirectoryReader(input_files=[path]).load_data():
+        yield None, doc.get_content()
+
+
+def read_preview(path: Path, max_chars: int) -> str:
+    """First ``max_chars`` characters of the document, reading only the pages needed"""
+    parts: List[str] = []
+    size = 0
+    for _, text in iter_pages(path):
+        parts.append(text)
+        size += len(text) + 1
+        if size >= max_chars:
+            break
+    return "\n".join(parts)[:max_chars]
+
+
+def read_text(path: Path) -> str:
+    """Full text of the document, pages joined with "\\n" as in the chunk offsets"""
+    return "\n".join(text for _, text in iter_pages(path))
+
+
+def iter_chunks(
+        pages: Iterable[Tuple[Optional[int], str]],
+        splitter,
+        buffer_chars: int = CHUNK_BUFFER_CHARS
+) -> Iterator[TextNode]:
+    """Chunk a page stream incrementally.
+
+    Pages are joined with "\\n" and appended to a buffer; once it holds ``buffer_chars``
+    the buffer is split and every chunk but the last is emitted. The last chunk may
+    continue on the next page, so it is carried over and split again with it. Chunks get
+    char offsets in the joined text and the pages they span (``page_start``/``page_end``).
+    """
+    buffer = ""
+    buffer_start = 0  # offset of buffer[0] in the joined text
+    total = 0
+    page_offsets: List[int] = []
+    page_numbers: List[Optional[int]] = []
+
+    def make_nodes(final: bool) -> Tuple[List[TextNode], int]:
+        """Nodes to emit and the buffer position to carry over from"""
+        chunks = splitter.split_text(buffer)
+        positions = []
+        search_from = 0
+        for chunk in chunks:
+            position = buffer.find(chunk, search_from)
+            positions.append(position)
+            if position >= 0:
+                search_from = position + 1
+
+        emitted = len(chunks) if final else len(chunks) - 1
+        nodes = []
+        carry_from = 0
+        for chunk, position in zip(chunks[:emitted], positions):
+            node = TextNode(text=chunk)
+            if position >= 0:
+                node.start_char_idx = buffer_start + position
+                node.end_char_idx = node.start_char_idx + len(chunk)
+                carry_from = position + len(chunk)
+                if page_numbers[0] is not None:
+                    node.metadata["page_start"] = page_numbers[bisect_right(page_offsets, node.start_char_idx) - 1]
+                    node.metadata["page_end"] = page_numbers[bisect_right(page_offsets, node.end_char_idx - 1) - 1]
+            nodes.append(node)
+
+        if not final and chunks and positions[-1] >= 0:
+            # The unfinished last chunk (with its overlap) is split again with the next page
+            carry_from = positions[-1]
+        return nodes, carry_from
+
+    for page_number, text in pages:
+        separator = "\n" if total else ""
+        page_offsets.append(total + len(separator))
+        page_numbers.append(page_number)
+        buffer += separator + text
+        total += len(separator) + len(text)
+
+        if len(buffer) < buffer_chars:
+            continue
+
+        nodes, carry_from = make_nodes(final=False)
+        yield from nodes
+
+        buffer = buffer[carry_from:]
+        buffer_start += carry_from
+        # Forget pages that ended before the buffer
+        first = max(bisect_right(page_offsets, buffer_start) - 1, 0)
+        page_offsets = page_offsets[first:]
+        page_numbers = page_numbers[first:]
+
+    if buffer.strip():
+        nodes, _ = make_nodes(final=True)
+        yield from nodes
@@ -0,0 +1,28 @@
+import asyncio
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict
+
+from app.core.database import async_session
+from app.repositories.document import DocumentRepository
+from app.services.document import DocumentService
+
+if TYPE_CHECKING:
+    from app.services.rag import DocumentProcessor
+
+
+async def collect_garbage_once(processor: "DocumentProcessor") -> Dict[str, Any]:
+    """Reconcile Qdrant, the lexical index and the RAG state with Postgres"""
+    async with async_session() as session:
+        service = DocumentService(DocumentRepository(session), processor)
+        return await service.collect_garbage()
+
+
+async def run_periodic_gc(get_processor: Callable[[], Awaitable["DocumentProcessor"]], interval_seconds: int) -> None:
+    """Sweep every ``interval_seconds``; ``get_processor`` builds the processor off the event loop"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            report = await collect_garbage_once(await get_processor())
+            if report["removed"]:
+                print(f"Garbage collection removed {len(report['removed'])} documents: {report['removed']}")
+        except Exception as e:
+            print(f"Garbage collection failed: {str(e)}")
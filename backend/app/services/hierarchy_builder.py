@@ -0,0 +1,151 @@
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.core.tracing import context_bound, span
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_entry(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Hierarchy entry in the shape stored in state and served by /v1/graph/"""
+    return {
+        "title": info.get("title", ""),
+        "summary": info.get("summary", ""),
+        "parent_id": info.get("parent_id"),
+        "children": [str(child) for child in info.get("children", []) if child],
+        "level": info.get("level", 0),
+        "relationships": [str(rel) for rel in info.get("relationships", []) if rel],
+        "relationship_type": info.get("relationship_type", "root"),
+        "key_concepts": info.get("key_concepts", [])
+    }
+
+
+def extract_json(text: str) -> Optional[Dict[str, Any]]:
+    """Outermost JSON object of an LLM response, None if there is none"""
+    text = text.strip()
+    start = text.find('{')
+    end = text.rfind('}') + 1
+    if start < 0 or end <= start:
+        return None
+    try:
+        return json.loads(text[start:end])
+    except json.JSONDecodeError:
+        return None
+
+
+class ClusteredHierarchyBuilder:
+    """Map-reduce corpus hierarchy.
+
+    Document summaries are embedded and clustered with k-means into groups of about
+    ``cluster_size``; each cluster is labelled and ordered by its own LLM call (in
+    parallel), and the per-cluster results are merged. Prompt size stays bounded and
+    the number of calls grows linearly with the corpus; a failed cluster only loses its
+    own structure, its documents are kept as roots.
+    """
+
+    def __init__(
+            self,
+            complete: Callable[..., str],
+            embed_texts: Callable[[List[str]], List[List[float]]],
+            cluster_size: int = 25,
+            max_workers: int = 4
+    ):
+        self.complete = complete
+        self.embed_texts = embed_texts
+        self.cluster_size = cluster_size
+        self.max_workers = max_workers
+
+    def cluster(self, doc_ids: List[str], summaries: Dict[str, str]) -> List[List[str]]:
+        if len(doc_ids) <= self.cluster_size:
+            return [doc_ids]
+
+        # scikit-learn is slow to import and only needed for large corpora
+        from sklearn.cluster import KMeans
+
+        with span("hierarchy.cluster", documents=len(doc_ids)):
+            vectors = np.array(self.embed_texts([summaries[doc_id] for doc_id in doc_ids]), dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+
+            n_clusters = math.ceil(len(doc_ids) / self.cluster_size)
+            labels = KMeans(n_clusters=n_clusters, n_init=3, random_state=0).fit_predict(vectors)
+
+        clusters: Dict[int, List[str]] = {}
+        for doc_id, label in zip(doc_ids, labels):
+            clusters.setdefault(int(label), []).append(doc_id)
+
+        # k-means does not bound cluster sizes; keep every prompt within budget
+        bounded = []
+        for members in clusters.values():
+            for i in range(0, len(members), 2 * self.cluster_size):
+                bounded.append(members[i:i + 2 * self.cluster_size])
+        return bounded
+
+    def label_cluster(self, cluster_idx: int, members: List[str], summaries: Dict[str, str]) -> Dict[str, Any]:
+        prompt = f"""You are a document analysis expert. Create a hierarchical structure for this group of related documents.
+
+        Documents to analyze:
+        {json.dumps({doc_id: summaries[doc_id] for doc_id in members}, ensure_ascii=False)}
+
+        IMPORTANT: Respond ONLY with a valid JSON object. Do not include any explanations or additional text.
+        The JSON should follow this exact structure:
+        {{
+            "cluster_title": "short name of the topic shared by the group",
+            "documents": {{
+                "doc_id": {{
+                    "title": "clear title",
+                    "summary": "brief summary",
+                    "parent_id": "id of parent document in this group or null if root",
+                    "children": ["child_doc_ids"],
+                    "level": 0,
+                    "relationships": ["related_doc_ids"],
+                    "relationship_type": "parent/child/sibling/related",
+                    "key_concepts": ["main concepts"]
+                }}
+            }}
+        }}
+        """
+
+        member_set = set(members)
+        try:
+            response = extract_json(self.complete(prompt, call_site="analyze_hierarchy_cluster"))
+            if response is None or not isinstance(response.get("documents"), dict):
+                raise ValueError("no valid JSON in response")
+        except Exception as e:
+            logger.warning("Hierarchy cluster %d (%d documents) failed: %s", cluster_idx, len(members), e)
+            response = {"cluster_title": "", "documents": {}}
+
+        entries = {}
+        for doc_id in members:
+            entry = normalize_entry(response["documents"].get(doc_id) or {"relationship_type": "none"})
+            # Links may only point inside the cluster; cross-cluster links are added elsewhere
+            if entry["parent_id"] not in member_set:
+                entry["parent_id"] = None
+            entry["children"] = [child for child in entry["children"] if child in member_set]
+            entry["relationships"] = [rel for rel in entry["relationships"] if rel in member_set]
+            entry["cluster"] = response.get("cluster_title", "")
+            entries[doc_id] = entry
+        return entries
+
+    def build(self, summaries: Dict[str, str]) -> Dict[str, Any]:
+        doc_ids = sorted(summaries)
+        if not doc_ids:
+            return {}
+
+        clusters = self.cluster(doc_ids, summaries)
+        print(f"Analyzing hierarchy of {len(doc_ids)} documents in {len(clusters)} clusters...")
+
+        hierarchy: Dict[str, Any] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                context_bound(lambda item: self.label_cluster(item[0], item[1], summaries)),
+                enumerate(clusters)
+            )
+            for entries in results:
+                hierarchy.update(entries)
+        return hierarchy
@@ -0,0 +1,222 @@
+from collections import deque
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+# Entry fields derived from the graph structure; everything else is a plain attribute
+EDGE_FIELDS = ("parent_id", "children", "level", "relationships", "similarity_scores")
+
+
+class HierarchyGraph:
+    """Document hierarchy with indexed edges.
+
+    The parent map is the only source of parent/child edges; children are its reverse
+    index, so the two can not disagree. Related-document links are symmetric and keep
+    their similarity score (None for links without one). Setting a parent that would
+    close a cycle is refused, and levels are recomputed only for the moved subtree.
+
+    ``entry``/``to_dict`` produce the JSON shape stored in state and served by
+    /v1/graph/: title, summary, parent_id, children, level, relationships (best score
+    first), similarity_scores, relationship_type, key_concepts.
+    """
+
+    def __init__(self):
+        self.attributes: Dict[str, Dict[str, Any]] = {}
+        self.parent: Dict[str, Optional[str]] = {}
+        self.children: Dict[str, Dict[str, None]] = {}  # insertion-ordered sets
+        self.related: Dict[str, Dict[str, Optional[float]]] = {}
+        self.level: Dict[str, int] = {}
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self.attributes
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.attributes)
+
+    def __len__(self) -> int:
+        return len(self.attributes)
+
+    # Structure
+
+    def _add_node(self, doc_id: str) -> None:
+        if doc_id not in self.attributes:
+            self.attributes[doc_id] = {}
+            self.parent[doc_id] = None
+            self.children[doc_id] = {}
+            self.related[doc_id] = {}
+            self.level[doc_id] = 0
+
+    def ancestors(self, doc_id: str) -> Iterator[str]:
+        parent_id = self.parent.get(doc_id)
+        while parent_id is not None:
+            yield parent_id
+            parent_id = self.parent.get(parent_id)
+
+    def descendants(self, doc_id: str) -> Iterator[str]:
+        queue = deque(self.children.get(doc_id, ()))
+        while queue:
+            child_id = queue.popleft()
+            yield child_id
+            queue.extend(self.children[child_id])
+
+    def would_cycle(self, doc_id: str, parent_id: str) -> bool:
+        return parent_id == doc_id or any(ancestor == doc_id for ancestor in self.ancestors(parent_id))
+
+    def set_parent(self, doc_id: str, parent_id: Optional[str]) -> bool:
+        """Move ``doc_id`` under ``parent_id`` (None: make it a root).
+
+        Unknown parents and parents that would create a cycle are refused (False).
+        """
+        if parent_id is not None and (parent_id not in self.attributes or self.would_cycle(doc_id, parent_id)):
+            return False
+
+        old_parent = self.parent[doc_id]
+        if old_parent == parent_id:
+            return True
+        if old_parent is not None:
+            self.children[old_parent].pop(doc_id, None)
+        self.parent[doc_id] = parent_id
+        if parent_id is not None:
+            self.children[parent_id][doc_id] = None
+        self._recompute_levels([doc_id])
+        return True
+
+    def _recompute_levels(self, root_ids: Iterable[str]) -> None:
+        """Levels of the subtrees below ``root_ids`` from their parents' levels"""
+        queue = deque(doc_id for doc_id in root_ids if doc_id in self.attributes)
+        while queue:
+            doc_id = queue.popleft()
+            parent_id = self.parent[doc_id]
+            self.level[doc_id] = self.level[parent_id] + 1 if parent_id is not None else 0
+            queue.extend(self.children[doc_id])
+
+    def link(self, doc_id: str, rel_id: str, score: Optional[float] = None) -> None:
+        """Symmetric related-document link"""
+        if doc_id == rel_id or doc_id not in self.attributes or rel_id not in self.attributes:
+            return
+        self.related[doc_id][rel_id] = score
+        self.related[rel_id][doc_id] = score
+
+    def clear_links(self, doc_id: str) -> None:
+        for rel_id in self.related.get(doc_id, {}):
+            self.related[rel_id].pop(doc_id, None)
+        if doc_id in self.related:
+            self.related[doc_id] = {}
+
+    # Entries
+
+    def upsert(self, doc_id: str, entry: Dict[str, Any], keep_links: bool = False) -> None:
+        """Add or replace a document from an entry in the JSON shape.
+
+        ``parent_id`` and ``children`` that exist (and keep the graph acyclic) become
+        edges; with ``keep_links`` the document's current related links are kept and the
+        entry's ``relationships`` are ignored.
+        """
+        self._add_node(doc_id)
+        self.attributes[doc_id] = {key: value for key, value in entry.items() if key not in EDGE_FIELDS}
+
+        if not self.set_parent(doc_id, entry.get("parent_id") or None):
+            self.set_parent(doc_id, None)
+        for child_id in entry.get("children", []):
+            if child_id in self.attributes:
+                self.set_parent(child_id, doc_id)
+
+        if not keep_links:
+            self.clear_links(doc_id)
+            scores = entry.get("similarity_scores") or {}
+            for rel_id in entry.get("relationships", []):
+                self.link(doc_id, rel_id, scores.get(rel_id))
+
+    def ensure(self, doc_id: str, entry: Dict[str, Any]) -> None:
+        """Add ``doc_id`` from ``entry`` unless it is already in the graph"""
+        if doc_id not in self.attributes:
+            self.upsert(doc_id, entry)
+
+    def remove(self, doc_ids: Iterable[str]) -> List[str]:
+        """Drop documents and every edge to them; their children become roots.
+
+        Returns the orphaned children.
+        """
+        removed = {doc_id for doc_id in doc_ids if doc_id in self.attributes}
+        orphans = []
+        for doc_id in removed:
+            self.clear_links(doc_id)
+            parent_id = self.parent[doc_id]
+            if parent_id is not None and parent_id not in removed:
+                self.children[parent_id].pop(doc_id, None)
+            for child_id in self.children[doc_id]:
+                if child_id not in removed:
+                    self.parent[child_id] = None
+                    orphans.append(child_id)
+
+        for doc_id in removed:
+            for index in (self.attributes, self.parent, self.children, self.related, self.level):
+                del index[doc_id]
+
+        self._recompute_levels(orphans)
+        return orphans
+
+    def entry(self, doc_id: str) -> Dict[str, Any]:
+        """The document's entry in the JSON shape, {} if unknown"""
+        if doc_id not in self.attributes:
+            return {}
+        links = self.related[doc_id]
+        scored = {rel_id: score for rel_id, score in links.items() if score is not None}
+        # Scored links first, best first; unscored links keep their order
+        relationships = sorted(scored, key=scored.get, reverse=True)
+        relationships += [rel_id for rel_id, score in links.items() if score is None]
+        return {
+            **self.attributes[doc_id],
+            "parent_id": self.parent[doc_id],
+            "children": list(self.children[doc_id]),
+            "level": self.level[doc_id],
+            "relationships": relationships,
+            "similarity_scores": scored,
+        }
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {doc_id: self.entry(doc_id) for doc_id in self.attributes}
+
+    @classmethod
+    def from_dict(cls, hierarchy: Dict[str, Dict[str, Any]]) -> "HierarchyGraph":
+        """Build from the JSON shape, dropping edges to unknown documents and cycles.
+
+        A child listed in ``children`` without a ``parent_id`` of its own is adopted.
+        """
+        graph = cls()
+        for doc_id, entry in hierarchy.items():
+            graph._add_node(doc_id)
+            graph.attributes[doc_id] = {key: value for key, value in entry.items() if key not in EDGE_FIELDS}
+
+        for doc_id, entry in hierarchy.items():
+            parent_id = entry.get("parent_id")
+            if parent_id:
+                graph._attach(doc_id, parent_id)
+        for doc_id, entry in hierarchy.items():
+            for child_id in entry.get("children", []):
+                if child_id in graph.attributes and graph.parent[child_id] is None:
+                    graph._attach(child_id, doc_id)
+
+        # Each document's own links first, in its order, so a consistent hierarchy round-trips
+        for doc_id, entry in hierarchy.items():
+            scores = entry.get("similarity_scores") or {}
+            for rel_id in entry.get("relationships", []):
+                if rel_id in graph.attributes and rel_id != doc_id:
+                    graph.related[doc_id][rel_id] = scores.get(rel_id)
+        for doc_id, links in graph.related.items():
+            for rel_id, score in links.items():
+                reverse = graph.related[rel_id]
+                if reverse.get(doc_id) is None:
+                    reverse[doc_id] = score
+                elif score is None:
+                    links[rel_id] = reverse[doc_id]
+
+        graph._recompute_levels(doc_id for doc_id, parent_id in graph.parent.items() if parent_id is None)
+        return graph
+
+    def _attach(self, doc_id: str, parent_id: str) -> None:
+        """Parent edge without level maintenance (bulk loading)"""
+        if parent_id in self.attributes and not self.would_cycle(doc_id, parent_id):
+            self.parent[doc_id] = parent_id
+            self.children[parent_id][doc_id] = None
+
+    def roots(self) -> Set[str]:
+        return {doc_id for doc_id, parent_id in self.parent.items() if parent_id is None}
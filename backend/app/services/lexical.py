@@ -0,0 +1,115 @@
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def is_exact_match_query(query_text: str, max_terms: int = 3) -> bool:
+    """Short queries made of identifiers (document numbers, product codes) or quoted phrases"""
+    stripped = query_text.strip()
+    if len(stripped) > 2 and stripped[0] == stripped[-1] == '"':
+        return True
+
+    terms = tokenize(stripped)
+    return 0 < len(terms) <= max_terms and any(any(ch.isdigit() for ch in term) for term in terms)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60) -> Dict[Hashable, float]:
+    """Fuse several ranked lists: score = sum(1 / (k + rank))"""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+class LexicalIndex:
+    """On-disk BM25 inverted index over chunk text (SQLite FTS5)"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT NOT NULL,
+                node_id TEXT NOT NULL UNIQUE,
+                text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_doc_id ON chunks(doc_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                text,
+                content='chunks',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+        """)
+        self._conn.commit()
+
+    def replace_documents(self, chunks_by_doc: Dict[str, Iterable[Tuple[str, str]]]) -> None:
+        """Replace all chunks of the given documents with (node_id, text) pairs"""
+        with self._lock, self._conn:
+            for doc_id, chunks in chunks_by_doc.items():
+                self._conn.execute("DELETE FROM chunks WHERE doc_id = ?", (doc_id,))
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunks(doc_id, node_id, text) VALUES (?, ?, ?)",
+                    [(doc_id, node_id, text) for node_id, text in chunks]
+                )
+
+    def add_chunks(self, chunks_by_doc: Dict[str, Iterable[Tuple[str, str]]]) -> None:
+        """Append (node_id, text) pairs without touching the documents' other chunks"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks(doc_id, node_id, text) VALUES (?, ?, ?)",
+                [(doc_id, node_id, text) for doc_id, chunks in chunks_by_doc.items() for node_id, text in chunks]
+            )
+
+    def delete_documents(self, doc_ids: Iterable[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def doc_ids(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT DISTINCT doc_id FROM chunks")}
+
+    def search(self, query_text: str, limit: int = 10, phrase: bool = False) -> List[Tuple[str, str, float]]:
+        """Return (node_id, doc_id, score) ranked by BM25, higher score is better"""
+        terms = tokenize(query_text)
+        if not terms:
+            return []
+
+        if phrase:
+            match = '"' + " ".join(terms) + '"'
+        else:
+            match = " OR ".join(f'"{term}"' for term in terms)
+
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT chunks.node_id, chunks.doc_id, bm25(chunks_fts) AS rank
+                FROM chunks_fts JOIN chunks ON chunks.id = chunks_fts.rowid
+                WHERE chunks_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (match, limit)
+            ).fetchall()
+
+        # FTS5 bm25() is negative, smaller means more relevant
+        return [(node_id, doc_id, -rank) for node_id, doc_id, rank in rows]
@@ -0,0 +1,176 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Union
+
+from app.core.config import settings
+from app.core.limits import SingleFlight, upstream_limiter
+from app.core.tracing import span
+from app.services.context import estimate_tokens
+
+# Anthropic allows 4 cache breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+
+
+class LLMGateway:
+    """Single entry point for every LLM completion of the DocumentProcessor.
+
+    - memoizes completions on disk, keyed by model and a hash of the prompt;
+    - sends a stable ``prefix`` (static instructions, then append-only context such as
+      the existing summaries) as cached system blocks when talking to Anthropic directly,
+      so it is not re-billed in full;
+    - records calls, cache hits, tokens and latency per call site;
+    - runs completions under the shared "llm" limiter, and concurrent calls with the same
+      prompt (e.g. the same summary requested by two uploads) share one completion.
+    """
+
+    def __init__(self, llm, model_name: str, cache_path: Optional[Path] = None, anthropic_client=None):
+        self.llm = llm
+        self.model_name = model_name
+        self.anthropic_client = anthropic_client
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self.limiter = upstream_limiter("llm")
+        self._flights = SingleFlight()
+
+        self._conn = None
+        if cache_path is not None:
+            self._conn = sqlite3.connect(str(cache_path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _prefix_blocks(prefix: Union[str, Sequence[str]]) -> list:
+        return [block for block in ([prefix] if isinstance(prefix, str) else prefix) if block]
+
+    def _key(self, prompt: str, prefix: Sequence[str]) -> str:
+        digest = hashlib.sha256()
+        for part in (self.model_name, "\n\n".join(prefix), prompt):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _cached(self, key: str) -> Optional[str]:
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _store(self, key: str, response: str) -> None:
+        if self._conn is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions(key, response, created) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+
+    def _record(self, call_site: str, **values: float) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(call_site, {
+                "calls": 0,
+                "cache_hits": 0,
+                "input_tokens": 0,
+                "output_tokens": 0,
+                "cache_read_tokens": 0,
+                "cache_write_tokens": 0,
+                "latency_ms": 0.0,
+            })
+            stats["calls"] += 1
+            for name, value in values.items():
+                stats[name] += value
+
+    def _complete_with_prefix_cache(self, prompt: str, prefix: Sequence[str]) -> Dict[str, Any]:
+        # Breakpoints on the last blocks: when only the last block grew, the previous ones still hit
+        cached_from = len(prefix) - MAX_CACHE_BREAKPOINTS
+        system = [
+            {"type": "text", "text": block, **({"cache_control": {"type": "ephemeral"}} if idx >= cached_from else {})}
+            for idx, block in enumerate(prefix)
+        ]
+        response = self.anthropic_client.messages.create(
+            model=self.model_name,
+            max_tokens=8000,
+            system=system,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        usage = response.usage
+        return {
+            "text": "".join(block.text for block in response.content if block.type == "text"),
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_read_tokens": getattr(usage, "cache_read_input_tokens", 0) or 0,
+            "cache_write_tokens": getattr(usage, "cache_creation_input_tokens", 0) or 0,
+        }
+
+    def _complete_plain(self, prompt: str, prefix: Sequence[str]) -> Dict[str, Any]:
+        full_prompt = "\n\n".join([*prefix, prompt])
+        response = self.llm.complete(full_prompt)
+        text = str(response.text)
+
+        raw = response.raw or {}
+        usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+        if not isinstance(usage, dict):
+            usage = vars(usage) if usage is not None else {}
+        input_tokens = usage.get("input_tokens")
+        output_tokens = usage.get("output_tokens")
+        return {
+            "text": text,
+            "input_tokens": input_tokens if input_tokens is not None else estimate_tokens(full_prompt),
+            "output_tokens": output_tokens if output_tokens is not None else estimate_tokens(text),
+        }
+
+    def complete(
+            self,
+            prompt: str,
+            call_site: str,
+            prefix: Union[str, Sequence[str]] = "",
+            use_cache: bool = True
+    ) -> str:
+        """Complete ``prefix`` + ``prompt``.
+
+        ``prefix`` holds the part shared between calls, a string or blocks ordered from the
+        most to the least stable; context that grows between calls should only ever add
+        blocks or grow the last one. Anything else that changes belongs in ``prompt``.
+        """
+        prefix = self._prefix_blocks(prefix)
+        with span("llm.complete", call_site=call_site) as llm_span:
+            key = self._key(prompt, prefix)
+            if use_cache:
+                cached = self._cached(key)
+                if cached is not None:
+                    llm_span.set_attribute("cache_hit", True)
+                    self._record(call_site, cache_hits=1)
+                    return cached
+
+            def run() -> str:
+                start = time.perf_counter()
+                if prefix and self.anthropic_client is not None and settings.LLM_PROMPT_CACHING:
+                    result = self.limiter.call(self._complete_with_prefix_cache, prompt, prefix)
+                else:
+                    result = self.limiter.call(self._complete_plain, prompt, prefix)
+                latency_ms = (time.perf_counter() - start) * 1000
+
+                text = result.pop("text")
+                self._record(call_site, latency_ms=latency_ms, **result)
+                llm_span.set_attribute("input_tokens", result["input_tokens"])
+                llm_span.set_attribute("output_tokens", result["output_tokens"])
+
+                if use_cache:
+                    self._store(key, text)
+                return text
+
+            def shared() -> None:
+                llm_span.set_attribute("coalesced", True)
+                self.limiter.record_coalesced()
+
+            return self._flights.do(key, run, on_shared=shared)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {call_site: dict(values) for call_site, values in self._stats.items()}
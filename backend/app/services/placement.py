@@ -0,0 +1,153 @@
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.hierarchy_builder import extract_json
+
+
+logger = logging.getLogger(__name__)
+
+
+class FolderCentroidIndex:
+    """Per-folder centroid of the document vectors of the files directly inside it.
+
+    Folders keep a running sum and count, so adding, removing or moving a file is O(dim);
+    ranking folders for a new document is one matrix-vector product. The saved file carries
+    a ``built`` marker: files without it (written before the index was built from the
+    document tree) do not count as an index.
+    """
+
+    def __init__(self, path: Path, dim: int):
+        self.path = Path(path)
+        self.dim = dim
+        self._lock = threading.RLock()
+        self.sums: Dict[int, np.ndarray] = {}
+        self.counts: Dict[int, int] = {}
+        self.built = False
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def exists(self) -> bool:
+        """Whether the index has been built from the document tree (here or by another worker)"""
+        if not self.built and self.path.exists():
+            self.load()
+        return self.built
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            if "built" not in data.files:
+                return
+            folder_ids = [int(folder_id) for folder_id in data["folder_ids"]]
+            sums = data["sums"].astype(np.float32)
+            counts = [int(count) for count in data["counts"]]
+        with self._lock:
+            self.sums = {folder_id: sums[row] for row, folder_id in enumerate(folder_ids)}
+            self.counts = dict(zip(folder_ids, counts))
+            self.built = True
+
+    def save(self) -> None:
+        with self._lock:
+            folder_ids = sorted(self.counts)
+            sums = np.array([self.sums[folder_id] for folder_id in folder_ids], dtype=np.float32).reshape(-1, self.dim)
+            counts = np.array([self.counts[folder_id] for folder_id in folder_ids], dtype=np.int64)
+        tmp_path = self.path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path, folder_ids=np.array(folder_ids, dtype=np.int64), sums=sums, counts=counts, built=np.array(self.built)
+        )
+        tmp_path.replace(self.path)
+
+    def add(self, folder_id: Optional[int], vector: Optional[np.ndarray]) -> None:
+        if folder_id is None or vector is None:
+            return
+        with self._lock:
+            if folder_id not in self.counts:
+                self.sums[folder_id] = np.zeros(self.dim, dtype=np.float32)
+                self.counts[folder_id] = 0
+            self.sums[folder_id] += vector
+            self.counts[folder_id] += 1
+
+    def remove(self, folder_id: Optional[int], vector: Optional[np.ndarray]) -> None:
+        if folder_id is None or vector is None:
+            return
+        with self._lock:
+            if folder_id not in self.counts:
+                return
+            self.counts[folder_id] -= 1
+            if self.counts[folder_id] <= 0:
+                del self.counts[folder_id]
+                del self.sums[folder_id]
+            else:
+                self.sums[folder_id] -= vector
+
+    def move(self, vector: Optional[np.ndarray], old_folder_id: Optional[int], new_folder_id: Optional[int]) -> None:
+        if old_folder_id == new_folder_id:
+            return
+        with self._lock:
+            self.remove(old_folder_id, vector)
+            self.add(new_folder_id, vector)
+
+    def drop_folders(self, folder_ids: Iterable[int]) -> None:
+        with self._lock:
+            for folder_id in folder_ids:
+                self.counts.pop(folder_id, None)
+                self.sums.pop(folder_id, None)
+
+    def rebuild(self, members: Iterable[Tuple[int, np.ndarray]]) -> None:
+        """Replace the index with ``(folder_id, document_vector)`` pairs"""
+        with self._lock:
+            self.sums = {}
+            self.counts = {}
+            for folder_id, vector in members:
+                self.add(folder_id, vector)
+            self.built = True
+
+    def suggest(self, vector: np.ndarray, top_k: int = 3) -> List[Tuple[int, float]]:
+        """Folders ranked by cosine similarity of their centroid to ``vector``"""
+        with self._lock:
+            if not self.counts:
+                return []
+            folder_ids = list(self.counts)
+            centroids = np.array([self.sums[folder_id] / self.counts[folder_id] for folder_id in folder_ids])
+
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+        vector = np.asarray(vector, dtype=np.float32)
+        scores = centroids @ (vector / (np.linalg.norm(vector) + 1e-12))
+        order = np.argsort(-scores)[:top_k]
+        return [(folder_ids[i], float(scores[i])) for i in order]
+
+
+def suggest_folder_with_llm(
+        complete: Callable[..., str],
+        content: str,
+        folders: Dict[int, str]
+) -> Optional[int]:
+    """Ask the LLM to pick one of ``folders`` (id -> name); None if it picks none or fails"""
+    if not folders:
+        return None
+
+    prompt = f"""You are organizing a document library. Pick the most suitable existing folder for a new document.
+
+    Folders (id: name):
+    {json.dumps({str(folder_id): name for folder_id, name in folders.items()}, ensure_ascii=False)}
+
+    Document content:
+    {content[:2000]}...
+
+    IMPORTANT: Respond ONLY with a valid JSON object: {{"folder_id": "id of the folder or null if none fits"}}
+    """
+
+    try:
+        response = extract_json(complete(prompt, call_site="get_place"))
+        folder_id = int(response["folder_id"]) if response and response.get("folder_id") is not None else None
+    except Exception as e:
+        logger.warning("LLM folder suggestion failed: %s", e)
+        return None
+    return folder_id if folder_id in folders else None
@@ -1,36 +1,60 @@
 import logging
+import threading
+import time
 import traceback
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 from typing import List, Optional, Dict, Any
 from pathlib import Path
 
-from llama_index.core import (
-    Document,
-    VectorStoreIndex,
-    StorageContext,
-    load_index_from_storage,
-    Settings,
-    SimpleDirectoryReader
-)
+import numpy as np
+from llama_index.core import Document, SimpleDirectoryReader
 from llama_index.core.node_parser import SimpleNodeParser
-from llama_index.core.schema import RelatedNodeInfo, NodeRelationship, TextNode
-from llama_index.llms.anthropic import Anthropic
-from llama_index.embeddings.text_embeddings_inference import TextEmbeddingsInference
-from llama_index.readers.file.docs import PDFReader
-from llama_index.readers.file import MarkdownReader
-from llama_index.core import SimpleDirectoryReader
-
-from qdrant_client import QdrantClient
+from llama_index.core.schema import TextNode
+from llama_index.core.readers.file.base import default_file_metadata_func
+
 from qdrant_client.http import models
-from qdrant_client.http.models import Distance, VectorParams
 
 from app.core.config import settings
+from app.core.limits import LimitedClient, SingleFlight, UpstreamUnavailable, upstream_limiter
+from app.core.serialization import dumps
+from app.core.tracing import context_bound, span, traced
+from app.services.backends import build_anthropic_client, build_embed_model, build_llm, build_qdrant_client
+from app.services.chunk_store import ChunkStore
+from app.services.collections import (
+    create_collection,
+    ensure_collection,
+    search_params,
+    switch_alias,
+    versioned_collection_name,
+)
+from app.services.doc_vectors import DocumentVectorIndex
+from app.services.extraction import iter_chunks, iter_pages, read_preview
+from app.services.hierarchy_builder import ClusteredHierarchyBuilder, extract_json, normalize_entry
+from app.services.hierarchy_graph import HierarchyGraph
+from app.services.context import join_nodes, join_nodes_with_offsets, merge_windows, pack_spans
+from app.services.lexical import LexicalIndex, is_exact_match_query, reciprocal_rank_fusion
+from app.services.llm_gateway import LLMGateway
+from app.services.placement import FolderCentroidIndex
+from app.services.state_store import build_state_store, merge_entry, merge_states
 
 
 logger = logging.getLogger(__name__)
 
+EMBED_BATCH_SIZE = 64
+SNIPPET_CHARS = 300
+UPSERT_BATCH_SIZE = 100
+LEXICAL_FILTER_OVERFETCH = 10
+# Text kept in Document.text by load_doc; the full text is only streamed by ingest_stream
+DOCUMENT_PREVIEW_CHARS = 20_000
+# Existing summaries per cached prompt block of analyze_single_document_hierarchy
+SUMMARY_PROMPT_BLOCK_SIZE = 50
+# Document-level fields that are looked up in the state by doc_id instead of being stored in every point
+DOCUMENT_STATE_FIELDS = ("summary", "hierarchy")
+# collect_garbage compacts the chunk store when more than this share of it is dead records
+CHUNK_STORE_COMPACT_RATIO = 0.5
+
 
 import hashlib
 
@@ -40,8 +64,35 @@ def stable_hash(text: str) -> int:
     return int.from_bytes(hash_bytes, byteorder='big')
 
 
+def chunk_id(doc_id: str, text: str, seen: Dict[str, int]) -> str:
+    """Content-defined node id: hash of the chunk text plus its occurrence number.
+
+    Editing one part of a document leaves the ids of all other chunks unchanged;
+    ``seen`` counts the digests of the document's previous chunks.
+    """
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+    occurrence = seen.get(digest, 0)
+    seen[digest] = occurrence + 1
+    return f"{doc_id}_chunk_{digest}_{occurrence}"
+
+
+def chunk_ids(doc_id: str, nodes: List[TextNode]) -> List[str]:
+    seen: Dict[str, int] = {}
+    return [chunk_id(doc_id, node.text, seen) for node in nodes]
+
+
+def creation_timestamp(creation_date: Optional[str]) -> Optional[float]:
+    """Epoch seconds of a reader's creation_date ("YYYY-MM-DD"), None if missing or invalid"""
+    try:
+        return datetime.fromisoformat(creation_date).timestamp() if creation_date else None
+    except ValueError:
+        return None
+
+
 class CustomDirectoryReader(SimpleDirectoryReader):
     def __init__(self, return_full_document=False, **kwargs):
+        from llama_index.readers.file.docs import PDFReader
+
         super().__init__(**kwargs)
         self.return_full_document = return_full_document
         self.file_extractor[".pdf"] = PDFReader(return_full_document=self.return_full_document)
@@ -53,41 +104,41 @@ class DocumentProcessor:
             model_name: str = "claude-3-5-sonnet-20241022",
             persist_dir: str = "./storage",
             embedding_model_name: str = "bge-small-en-v1.5",
-            qdrant_location: str = "http://31.31.201.198:6333",
-            collection_name: str = "documents",
+            qdrant_location: str = settings.QDRANT_URL,
+            collection_name: str = settings.QDRANT_COLLECTION,
             chunk_size: int = 1024,
             chunk_overlap: int = 20,
             state_file: str = "document_state.json",
+            lexical_index_file: str = "lexical_index.db",
+            llm_cache_file: str = "llm_cache.db",
+            doc_vectors_file: str = "doc_vectors.npz",
+            folder_index_file: str = "folder_centroids.npz",
+            chunk_store_file: str = "chunks",
     ):
         self.model_name = model_name
         self.persist_dir = persist_dir
         self.state_file = Path(persist_dir) / state_file
+        Path(persist_dir).mkdir(parents=True, exist_ok=True)
 
         # Initialize components
-        self.llm = Anthropic(
-            model=model_name,
-            api_key=settings.ANTHROPIC_API_KEY,
-            max_tokens=8000
-        )
-        self.embed_model = TextEmbeddingsInference(
-            model_name=embedding_model_name,
-            base_url=settings.TEI_BASE_URL
+        self.llm = build_llm(model_name)
+        self.llm_gateway = LLMGateway(
+            self.llm,
+            model_name,
+            cache_path=Path(persist_dir) / llm_cache_file if settings.LLM_CACHE_ENABLED else None,
+            anthropic_client=build_anthropic_client()
         )
+        self.embed_model = build_embed_model(embedding_model_name)
+        self.tei_limiter = upstream_limiter("tei")
 
-        # Initialize Qdrant
-        self.qdrant = QdrantClient(location=qdrant_location)
+        # Initialize Qdrant; every client call goes through the shared limiter
+        self.qdrant = LimitedClient(build_qdrant_client(qdrant_location), upstream_limiter("qdrant"))
         self.collection_name = collection_name
+        # One point per document with its summary embedding, for two-stage search
+        self.summary_collection_name = f"{collection_name}_docs"
 
-        try:
-            self.qdrant.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=VectorParams(
-                    size=384,  # BGE-small dimension
-                    distance=Distance.COSINE
-                )
-            )
-        except Exception as e:
-            pass
+        ensure_collection(self.qdrant, self.collection_name)
+        ensure_collection(self.qdrant, self.summary_collection_name)
 
         # Configure node parser
         self.node_parser = SimpleNodeParser.from_defaults(
@@ -95,53 +146,163 @@ class DocumentProcessor:
             chunk_overlap=chunk_overlap
         )
 
-        Path(persist_dir).mkdir(parents=True, exist_ok=True)
+        self.lexical_index = LexicalIndex(Path(persist_dir) / lexical_index_file)
+        # Chunk texts live here, Qdrant payloads only carry ids and filter fields. Other hosts
+        # cannot read this store, so a shared deployment also keeps the texts in the payloads
+        self.chunk_store = ChunkStore(Path(persist_dir) / chunk_store_file, codec=settings.CHUNK_STORE_CODEC)
+        self.chunk_texts = settings.CHUNK_TEXT_STORE or ("qdrant" if settings.STATE_BACKEND == "postgres" else "local")
+        if self.chunk_texts not in ("local", "qdrant"):
+            raise ValueError(f"Unsupported CHUNK_TEXT_STORE: {self.chunk_texts}")
+        self.missing_chunk_texts = 0
+        self.doc_vectors = DocumentVectorIndex(Path(persist_dir) / doc_vectors_file, settings.QDRANT_VECTOR_SIZE)
+        self.folder_index = FolderCentroidIndex(Path(persist_dir) / folder_index_file, settings.QDRANT_VECTOR_SIZE)
+
+        # Summaries and hierarchy are shared between workers through the state store
+        self.state_store = build_state_store(self.state_file)
+        self._state_lock = threading.RLock()
+        self._ingest_lock = threading.Lock()
         self.load_state()
 
+        # Identical concurrent queries and query embeddings share one upstream call
+        self._query_flights = SingleFlight()
+        self._embed_flights = SingleFlight()
+
+    @traced()
     def load_state(self) -> None:
-        """Load document state from file"""
-        try:
-            if self.state_file.exists():
-                with open(self.state_file, 'r') as f:
-                    state = json.load(f)
-                    self.document_summaries = state.get('summaries', {})
-                    self.document_hierarchy = state.get('hierarchy', {})
-            else:
+        """Load document state from the state store"""
+        with self._state_lock:
+            try:
+                with self.state_store.lock():
+                    loaded = self.state_store.load(-1)
+                version, entries, _ = loaded or (0, {}, set())
+                self.document_summaries = {
+                    doc_id: summary for doc_id, (summary, _) in entries.items() if summary is not None
+                }
+                self.hierarchy = HierarchyGraph.from_dict({
+                    doc_id: entry for doc_id, (_, entry) in entries.items() if entry is not None
+                })
+                self._state_version = version
+            except Exception as e:
+                print(f"Error loading state: {str(e)}")
                 self.document_summaries = {}
-                self.document_hierarchy = {}
-        except Exception as e:
-            print(f"Error loading state: {str(e)}")
-            self.document_summaries = {}
-            self.document_hierarchy = {}
+                self.hierarchy = HierarchyGraph()
+                self._state_version = 0
+            self._state_base = json.loads(json.dumps([self.document_summaries, self.document_hierarchy]))
+            self._state_updated = datetime.now().isoformat()
+
+    def _pull_state(self) -> None:
+        """Merge changes written by other workers into the in-memory state, keeping ours.
 
+        Must run under the state store lock.
+        """
+        loaded = self.state_store.load(self._state_version)
+        if loaded is None:
+            return
+        version, entries, doc_ids = loaded
+
+        base_summaries, base_hierarchy = self._state_base
+        their_summaries = {doc_id: value for doc_id, value in base_summaries.items() if doc_id in doc_ids}
+        their_hierarchy = {doc_id: value for doc_id, value in base_hierarchy.items() if doc_id in doc_ids}
+        for doc_id, (summary, entry) in entries.items():
+            their_summaries.pop(doc_id, None)
+            their_hierarchy.pop(doc_id, None)
+            if summary is not None:
+                their_summaries[doc_id] = summary
+            if entry is not None:
+                their_hierarchy[doc_id] = entry
+
+        self.document_summaries = merge_states(
+            base_summaries, self.document_summaries, their_summaries, lambda base, ours, theirs: ours
+        )
+        self.hierarchy = HierarchyGraph.from_dict(merge_states(
+            base_hierarchy, self.hierarchy.to_dict(), their_hierarchy, merge_entry
+        ))
+        self._state_base = json.loads(json.dumps([their_summaries, their_hierarchy]))
+        self._state_version = version
+        self._state_updated = datetime.now().isoformat()
+
+    @traced()
+    def refresh_state(self) -> None:
+        """Pick up state changes of other workers (cheap when there are none)"""
+        with self._state_lock:
+            if self.state_store.version() <= self._state_version:
+                return
+            try:
+                with self.state_store.lock():
+                    self._pull_state()
+            except Exception as e:
+                print(f"Error refreshing state: {str(e)}")
+
+    @traced()
     def save_state(self) -> None:
-        """Save current document state to file"""
+        """Write the documents changed since the last sync, merged with concurrent writes"""
         try:
-            state = {
-                'summaries': self.document_summaries,
-                'hierarchy': self.document_hierarchy,
-                'last_updated': datetime.now().isoformat()
-            }
-            with open(self.state_file, 'w') as f:
-                json.dump(state, f, indent=2)
+            with self._state_lock:
+                with self.state_store.lock():
+                    self._pull_state()
+
+                    base_summaries, base_hierarchy = self._state_base
+                    hierarchy = self.hierarchy.to_dict()
+                    doc_ids = set(self.document_summaries) | set(hierarchy)
+                    upserts = {
+                        doc_id: (self.document_summaries.get(doc_id), hierarchy.get(doc_id))
+                        for doc_id in doc_ids
+                        if self.document_summaries.get(doc_id) != base_summaries.get(doc_id)
+                        or hierarchy.get(doc_id) != base_hierarchy.get(doc_id)
+                    }
+                    deletes = [
+                        doc_id for doc_id in set(base_summaries) | set(base_hierarchy) if doc_id not in doc_ids
+                    ]
+
+                    if upserts or deletes or self._state_version == 0:
+                        self._state_version = self.state_store.write(
+                            self.document_summaries, hierarchy, upserts, deletes
+                        )
+                        self._state_base = json.loads(json.dumps([self.document_summaries, hierarchy]))
+                        self._state_updated = datetime.now().isoformat()
+
+            # The folder index is saved by DocumentService once it has been built from the tree
+            self.doc_vectors.save()
         except Exception as e:
             print(f"Error saving state: {str(e)}")
 
+    def get_state_json(self) -> bytes:
+        """get_state() encoded as compact JSON, taken under the state lock"""
+        state = self.get_state()
+        with self._state_lock:
+            return dumps(state)
+
+    def get_state(self) -> Dict[str, Any]:
+        """Current summaries and hierarchy in the document_state.json shape"""
+        self.refresh_state()
+        return {
+            "summaries": self.document_summaries,
+            "hierarchy": self.hierarchy.to_dict(),
+            "last_updated": self._state_updated,
+            "version": self._state_version
+        }
+
+    @property
+    def document_hierarchy(self) -> Dict[str, Dict[str, Any]]:
+        """The hierarchy in the JSON shape; a snapshot, edit ``self.hierarchy`` instead"""
+        return self.hierarchy.to_dict()
+
+    @document_hierarchy.setter
+    def document_hierarchy(self, hierarchy: Dict[str, Dict[str, Any]]) -> None:
+        self.hierarchy = HierarchyGraph.from_dict(hierarchy)
+
+    @traced()
     def load_doc(self, doc_path: str) -> Document:
-        reader = SimpleDirectoryReader(
-            input_files=[Path(doc_path)]
+        """Document with the file metadata and the first DOCUMENT_PREVIEW_CHARS of text"""
+        doc = Document(
+            text=read_preview(Path(doc_path), DOCUMENT_PREVIEW_CHARS),
+            metadata=default_file_metadata_func(str(doc_path))
         )
-        doc = reader.load_data()[0]
 
         try:
             file_path = doc.metadata.get("file_name", "")
             doc_id = Path(file_path).stem
 
-            # Generate summary once and store it
-            if doc_id not in self.document_summaries:
-                self.document_summaries[doc_id] = self.generate_document_summary(doc)
-            summary = self.document_summaries[doc_id]
-
             document = Document(
                 text=doc.get_content(),
                 doc_id=doc_id,
@@ -153,18 +314,7 @@ class DocumentProcessor:
                     "last_modified_date": doc.metadata.get("last_modified_date", ""),
                     "doc_type": "research_paper",
                     "processed_date": datetime.now().isoformat(),
-                    "doc_id": doc_id,
-                    "summary": summary,
-                    "hierarchy": {
-                        "title": "",
-                        "summary": "",
-                        "parent_id": None,
-                        "children": [],
-                        "level": 0,
-                        "relationships": [],
-                        "relationship_type": "",
-                        "key_concepts": []
-                    }
+                    "doc_id": doc_id
                 }
             )
 
@@ -209,17 +359,6 @@ class DocumentProcessor:
                             "doc_type": "research_paper",
                             "processed_date": datetime.now().isoformat(),
                             "doc_id": doc_id,
-                            "summary": summary,
-                            "hierarchy": {
-                                "title": "",
-                                "summary": "",
-                                "parent_id": None,
-                                "children": [],
-                                "level": 0,
-                                "relationships": [],
-                                "relationship_type": "",
-                                "key_concepts": []
-                            }
                         },
                         doc_id=doc_id
                     )
@@ -244,15 +383,17 @@ class DocumentProcessor:
             )
 
             docs_info = {}
-            for result in search_results[0]:  # [0] contains points, [1] contains next_page_offset
+            # [0] contains points, [1] contains next_page_offset
+            for result in self._attach_texts(search_results[0]):
                 doc_id = result.payload.get("doc_id")
                 if doc_id:
+                    metadata, hierarchy = self._document_fields(doc_id, result.payload.get("metadata", {}))
                     docs_info[doc_id] = {
-                        "metadata": result.payload.get("metadata", {}),
+                        "metadata": metadata,
                         "has_embedding": True,
                         "text_length": len(result.payload.get("text", "")),
-                        "hierarchy": result.payload.get("hierarchy", {}),
-                        "summary": result.payload.get("summary", "")
+                        "hierarchy": hierarchy,
+                        "summary": metadata["summary"]
                     }
 
             return {
@@ -267,6 +408,7 @@ class DocumentProcessor:
             print(f"Error getting document info: {str(e)}")
             return {"error": str(e)}
 
+    @traced()
     def generate_document_summary(self, document: Document) -> str:
         """Generate a summary for a document"""
         prompt = f"""Please provide a concise summary of this document, focusing on:
@@ -277,122 +419,85 @@ class DocumentProcessor:
         Document content:
         {document.get_content()[:2000]}...
         """
-        response = self.llm.complete(prompt)
-        return response.text
+        return self.llm_gateway.complete(prompt, call_site="summary")
 
+    @traced()
     def analyze_hierarchy(self, documents: List[Document]) -> Dict[str, Any]:
-        """Analyze documents to determine hierarchical relationships"""
-        try:
-            doc_summaries = {}
+        """Analyze documents to determine hierarchical relationships.
 
+        Summaries are clustered by embedding and each cluster is analysed by its own LLM
+        call (see ClusteredHierarchyBuilder), so the corpus never goes into one prompt.
+        """
+        try:
             print("Generating document summaries...")
-            for doc in documents:
-                doc_id = doc.doc_id.split('/')[-1]
-                content_preview = doc.get_content()[:2000]
-                summary = self.document_summaries.get(doc_id, self.generate_document_summary(doc))
-                doc_summaries[doc_id] = {
-                    'preview': content_preview,
-                    'summary': summary,
-                    'id': doc_id
-                }
-
-            hierarchy_prompt = f"""You are a document analysis expert. Create a hierarchical structure for these documents.
+            docs_by_id = {doc.doc_id.split('/')[-1]: doc for doc in documents}
+            missing = [doc_id for doc_id in docs_by_id if not self.document_summaries.get(doc_id)]
 
-            Documents to analyze:
-            {json.dumps({k: {'summary': v['summary']} for k, v in doc_summaries.items()}, indent=2)}
-
-            IMPORTANT: Respond ONLY with a valid JSON object. Do not include any explanations or additional text.
-            The JSON should follow this exact structure for each document:
-            {{
-                "doc_id": {{
-                    "title": "clear title",
-                    "summary": "brief summary",
-                    "parent_id": "id of parent document or null if root",
-                    "children": ["child_doc_ids"],
-                    "level": 0,
-                    "relationships": ["related_doc_ids"],
-                    "relationship_type": "parent/child/sibling/related",
-                    "key_concepts": ["main concepts"]
-                }}
-            }}
-            """
-
-            response = self.llm.complete(hierarchy_prompt)
+            with ThreadPoolExecutor(max_workers=settings.HIERARCHY_MAX_WORKERS) as executor:
+                for doc_id, summary in zip(missing, executor.map(
+                        context_bound(lambda doc_id: self.generate_document_summary(docs_by_id[doc_id])), missing
+                )):
+                    self.document_summaries[doc_id] = summary
 
-            try:
-                text = response.text.strip()
-                start = text.find('{')
-                end = text.rfind('}') + 1
-                if start >= 0 and end > start:
-                    json_str = text[start:end]
-                    hierarchy = json.loads(json_str)
-
-                    normalized_hierarchy = {}
-                    for doc_id, info in hierarchy.items():
-                        normalized_info = {
-                            "title": info.get("title", ""),
-                            "summary": info.get("summary", ""),
-                            "parent_id": info.get("parent_id"),
-                            "children": [str(child) for child in info.get("children", []) if child],
-                            "level": info.get("level", 0),
-                            "relationships": [str(rel) for rel in info.get("relationships", []) if rel],
-                            "relationship_type": info.get("relationship_type", "root"),
-                            "key_concepts": info.get("key_concepts", [])
-                        }
-                        normalized_hierarchy[str(doc_id)] = normalized_info
-
-                    self._validate_and_fix_relationships(normalized_hierarchy)
-
-                    print("\nSuccessfully created hierarchy:")
-                    print(json.dumps(normalized_hierarchy, indent=2))
-                    return normalized_hierarchy
-                else:
-                    print("No valid JSON found in response")
-                    return {}
-
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON: {str(e)}")
-                print("Raw response:", response.text)
-                return {}
+            builder = ClusteredHierarchyBuilder(
+                self.llm_gateway.complete,
+                self.embed_texts,
+                cluster_size=settings.HIERARCHY_CLUSTER_SIZE,
+                max_workers=settings.HIERARCHY_MAX_WORKERS
+            )
+            hierarchy = builder.build({doc_id: self.document_summaries[doc_id] for doc_id in docs_by_id})
+            print(f"Successfully created hierarchy for {len(hierarchy)} documents")
+            return hierarchy
 
         except Exception as e:
             print(f"Error in analyze_hierarchy: {str(e)}")
+            print(traceback.format_exc())
             return {}
 
+    @traced()
     def analyze_single_document_hierarchy(self, document: Document) -> Dict[str, Any]:
         """Analyze hierarchical relationships for a single new document"""
         try:
             doc_id = document.doc_id
-            summary = self.document_summaries.get(doc_id, self.generate_document_summary(document))
+            summary = self.document_summaries.get(doc_id) or self.generate_document_summary(document)
             self.save_state()
 
-            # Prepare context of existing documents and the new one
-            existing_docs = {
-                doc_id: {
-                    'summary': summary,
-                    'is_new': True
-                }
-            }
+            # Cached prefix: the static instructions, then the existing summaries in state order,
+            # SUMMARY_PROMPT_BLOCK_SIZE per block, so the blocks of earlier uploads stay a shared
+            # prefix. The hierarchy changes with every upload and goes after the cache breakpoints.
+            hierarchy_instructions = """You are a document analysis expert. Analyze how a new document fits into the existing document hierarchy.
 
-            # Add existing documents for context
-            for existing_id, existing_summary in self.document_summaries.items():
-                if existing_id != doc_id:
-                    existing_docs[existing_id] = {
-                        'summary': existing_summary,
-                        'is_new': False
-                    }
+            Rules for relationship assignment:
+            1. parent_id should be set only if the document directly builds upon or extends another document
+            2. relationship_type "parent" means this document is a foundation for others
+            3. relationship_type "child" means this document builds upon another
+            4. relationship_type "related" means documents share topics but no clear hierarchy
+            5. relationship_type "none" means document is independent
+            6. Set relationship_strength based on confidence in the relationship (0.0-1.0)
+            7. Provide specific topic_overlap only for related documents
+            8. citation_type should reflect how documents reference each other
+            """
+            existing_summaries = [
+                json.dumps({existing_id: existing_summary}, ensure_ascii=False)
+                for existing_id, existing_summary in self.document_summaries.items()
+                if existing_id != doc_id
+            ]
+            summary_blocks = [
+                "\n".join(existing_summaries[i:i + SUMMARY_PROMPT_BLOCK_SIZE])
+                for i in range(0, len(existing_summaries), SUMMARY_PROMPT_BLOCK_SIZE)
+            ]
+            existing_hierarchy = {
+                existing_id: {key: entry.get(key) for key in ("title", "parent_id", "level")}
+                for existing_id, entry in self.document_hierarchy.items()
+                if existing_id != doc_id
+            }
 
-            hierarchy_prompt = f"""You are a document analysis expert. Analyze how this new document fits into the existing document hierarchy.
+            hierarchy_prompt = f"""Existing hierarchy (title, parent and level of every document):
+            {json.dumps(existing_hierarchy, sort_keys=True, ensure_ascii=False)}
 
             New document summary:
             {summary}
 
-            Existing document summaries:
-            {json.dumps({k: v['summary'] for k, v in existing_docs.items() if not v['is_new']}, indent=2)}
-
-            Existing hierarchy:
-            {json.dumps(self.document_hierarchy, indent=2)}
-
             IMPORTANT: Respond ONLY with a valid JSON object for the new document. Do not include any explanations.
             The JSON should follow this structure:
             {{
@@ -402,289 +507,892 @@ class DocumentProcessor:
                     "parent_id": "id of most related parent document or null if root",
                     "children": ["child_doc_ids"],
                     "level": 0,
-                    "relationships": ["related_doc_ids"],
                     "relationship_type": "none",  # Must be one of: "parent", "child", "related", "none"
-                    "key_concepts": ["main concepts"],
-                    "similarity_scores": {{"doc_id": score}} // similarity to other docs
+                    "key_concepts": ["main concepts"]
                 }}
             }}
-            
-            Rules for relationship assignment:
-            1. parent_id should be set only if the document directly builds upon or extends another document
-            2. relationship_type "parent" means this document is a foundation for others
-            3. relationship_type "child" means this document builds upon another
-            4. relationship_type "related" means documents share topics but no clear hierarchy
-            5. relationship_type "none" means document is independent
-            6. Set relationship_strength based on confidence in the relationship (0.0-1.0)
-            7. Provide specific topic_overlap only for related documents
-            8. citation_type should reflect how documents reference each other
             """
 
-            response = self.llm.complete(hierarchy_prompt)
-            print(doc_id, response.text)
-            try:
-                text = response.text.strip()
-                start = text.find('{')
-                end = text.rfind('}') + 1
-                if start >= 0 and end > start:
-                    json_str = text[start:end]
-                    new_hierarchy = json.loads(json_str)
-
-                    if len(new_hierarchy.keys()) == 1:
-                        new_hierarchy = list(new_hierarchy.values())[0]
-
-                    # Normalize the hierarchy entry
-                    normalized_entry = {
-                        "title": new_hierarchy.get("title", ""),
-                        "summary": new_hierarchy.get("summary", ""),
-                        "parent_id": new_hierarchy.get("parent_id"),
-                        "children": [str(child) for child in new_hierarchy.get("children", []) if child],
-                        "level": new_hierarchy.get("level", 0),
-                        "relationships": [str(rel) for rel in new_hierarchy.get("relationships", []) if rel],
-                        "relationship_type": new_hierarchy.get("relationship_type", "root"),
-                        "key_concepts": new_hierarchy.get("key_concepts", []),
-                        "similarity_scores": new_hierarchy.get("similarity_scores", {})
-                    }
+            response_text = self.llm_gateway.complete(
+                hierarchy_prompt,
+                call_site="analyze_single_document_hierarchy",
+                prefix=[hierarchy_instructions, "Existing document summaries:", *summary_blocks]
+            )
+            print(doc_id, response_text)
+            new_hierarchy = extract_json(response_text)
+            if new_hierarchy is None:
+                print("No valid JSON found in response")
+                print("Raw response:", response_text)
+                return {}
 
-                    return {doc_id: normalized_entry}
-                else:
-                    print("No valid JSON found in response")
-                    return {}
+            if len(new_hierarchy.keys()) == 1:
+                new_hierarchy = list(new_hierarchy.values())[0]
 
-            except json.JSONDecodeError as e:
-                print(f"Error parsing JSON: {str(e)}")
-                print("Raw response:", response.text)
-                return {}
+            # Normalize the hierarchy entry; related documents come from embeddings (link_documents)
+            normalized_entry = normalize_entry(new_hierarchy)
+            normalized_entry["relationships"] = []
+
+            return {doc_id: normalized_entry}
 
         except Exception as e:
             print(f"Error in analyze_single_document_hierarchy: {str(e)}")
             print(traceback.format_exc())
             return {}
 
+    @traced()
     def update_hierarchy_with_document(self, doc_id: str, new_hierarchy: Dict[str, Any]) -> None:
         """Update existing hierarchy with a new document's relationships"""
         try:
             if not new_hierarchy or doc_id not in new_hierarchy:
                 return
 
-            doc_info = new_hierarchy[doc_id]
+            # Keep the embedding links of a re-analysed document until link_documents refreshes them.
+            # Parents that would close a cycle are dropped; moved subtrees get their levels recomputed
+            self.hierarchy.upsert(doc_id, new_hierarchy[doc_id], keep_links=True)
 
-            # Update existing relationships based on similarity scores
-            similarity_scores = doc_info.get("similarity_scores", {})
-            threshold = 0.7  # Можно сделать настраиваемым параметром
+            print(f"Successfully updated hierarchy with document: {doc_id}")
 
-            related_docs = [
-                rel_id for rel_id, score in similarity_scores.items()
-                if score >= threshold and rel_id in self.document_hierarchy
-            ]
+        except Exception as e:
+            print(f"Error updating hierarchy: {str(e)}")
 
-            # Add new relationships to existing documents
-            for rel_id in related_docs:
-                if rel_id not in doc_info["relationships"]:
-                    doc_info["relationships"].append(rel_id)
-
-                # Update the related document's relationships
-                if rel_id in self.document_hierarchy:
-                    rel_doc = self.document_hierarchy[rel_id]
-                    if doc_id not in rel_doc["relationships"]:
-                        rel_doc["relationships"].append(doc_id)
-
-            # Handle parent-child relationships
-            parent_id = doc_info["parent_id"]
-            if parent_id and parent_id in self.document_hierarchy:
-                parent = self.document_hierarchy[parent_id]
-                if doc_id not in parent["children"]:
-                    parent["children"].append(doc_id)
-                doc_info["level"] = parent["level"] + 1
-            else:
-                doc_info["parent_id"] = None
-                doc_info["level"] = 0
+    def update_document_vectors(
+            self,
+            documents: List[Optional[Document]],
+            doc_nodes: List[List[TextNode]],
+            embeddings: List[List[float]]
+    ) -> None:
+        """Store each document's chunk-embedding centroid; ``embeddings`` are flat, in node order"""
+        offset = 0
+        for document, nodes in zip(documents, doc_nodes):
+            if document is not None and nodes:
+                centroid = np.mean(np.asarray(embeddings[offset:offset + len(nodes)], dtype=np.float32), axis=0)
+                self.doc_vectors.upsert(document.doc_id, centroid)
+            offset += len(nodes)
+
+    def document_vector(self, file_name: str) -> Optional[np.ndarray]:
+        """Stored document vector of an uploaded file (doc ids are file name stems)"""
+        return self.doc_vectors.get(Path(file_name).stem)
+
+    @traced()
+    def embed_document_text(self, text: str, max_chunks: int = 8) -> np.ndarray:
+        """Centroid of the first chunk embeddings of raw text, comparable to document vectors"""
+        nodes = self.node_parser.get_nodes_from_documents([Document(text=text)])[:max_chunks]
+        embeddings = self.embed_texts([node.text for node in nodes] or [text])
+        return np.mean(np.asarray(embeddings, dtype=np.float32), axis=0)
+
+    @traced()
+    def link_documents(self, doc_ids: List[str]) -> None:
+        """Link documents to their nearest neighbours by centroid cosine similarity.
+
+        Links are symmetric and stored as ``relationships`` (ordered by score) with the
+        scores in ``similarity_scores``; the LLM only labels ``relationship_type``.
+        """
+        neighbors = self.doc_vectors.neighbors(
+            doc_ids,
+            top_k=settings.DOC_LINK_TOP_K,
+            threshold=settings.DOC_LINK_THRESHOLD
+        )
 
-            # Update children's parent references if any
-            for child_id in doc_info["children"]:
-                if child_id in self.document_hierarchy:
-                    child = self.document_hierarchy[child_id]
-                    child["parent_id"] = doc_id
-                    child["level"] = doc_info["level"] + 1
+        # Drop the previous links of the relinked documents first, then add the new ones
+        for doc_id in neighbors:
+            self.hierarchy.ensure(doc_id, normalize_entry({"relationship_type": "none"}))
+            self.hierarchy.clear_links(doc_id)
+
+        for doc_id, links in neighbors.items():
+            for rel_id, score in links:
+                self.hierarchy.link(doc_id, rel_id, round(score, 4))
+
+    @traced("tei.embed_batch")
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in batches instead of one TEI round trip per text"""
+        embeddings = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            embeddings.extend(
+                self.tei_limiter.call(self.embed_model.get_text_embedding_batch, texts[i:i + EMBED_BATCH_SIZE])
+            )
+        return embeddings
+
+    def embed_query(self, query_text: str) -> List[float]:
+        with span("tei.embed_query"):
+            return self._embed_flights.do(
+                query_text,
+                lambda: self.tei_limiter.call(self.embed_model.get_text_embedding, query_text),
+                on_shared=self.tei_limiter.record_coalesced
+            )
 
-            # Add the new document to the hierarchy
-            self.document_hierarchy[doc_id] = doc_info
+    @traced("qdrant.scroll_chunks")
+    def _existing_chunk_ids(self, doc_ids: List[str], collection_name: Optional[str] = None) -> Dict[str, int]:
+        """node_id -> point id of the chunks stored for the documents"""
+        chunks: Dict[str, int] = {}
+        if not doc_ids:
+            return chunks
+
+        offset = None
+        while True:
+            records, offset = self.qdrant.scroll(
+                collection_name=collection_name or self.collection_name,
+                scroll_filter=models.Filter(
+                    must=[models.FieldCondition(key="doc_id", match=models.MatchAny(any=doc_ids))]
+                ),
+                limit=1000,
+                offset=offset,
+                with_payload=["node_id"],
+                with_vectors=False
+            )
+            for record in records:
+                chunks[record.payload["node_id"]] = record.id
+            if offset is None:
+                break
+        return chunks
 
-            print(f"Successfully updated hierarchy with document: {doc_id}")
+    def _embed_reusing(
+            self,
+            node_ids: List[str],
+            texts: List[str],
+            existing: Dict[str, int],
+            collection_name: Optional[str] = None
+    ) -> List[List[float]]:
+        """Embeddings aligned with ``node_ids``: stored vectors for known chunks, TEI for the rest"""
+        reused = [existing[node_id] for node_id in node_ids if node_id in existing]
+        stored = {}
+        if reused:
+            records = self.qdrant.retrieve(
+                collection_name=collection_name or self.collection_name,
+                ids=reused,
+                with_payload=False,
+                with_vectors=True
+            )
+            stored = {record.id: record.vector for record in records}
 
-        except Exception as e:
-            print(f"Error updating hierarchy: {str(e)}")
+        embeddings = [stored.get(existing.get(node_id)) for node_id in node_ids]
+        missing = [pos for pos, embedding in enumerate(embeddings) if embedding is None]
+        with span("rag.embed_changed", nodes=len(node_ids), embedded=len(missing)):
+            for pos, embedding in zip(missing, self.embed_texts([texts[pos] for pos in missing])):
+                embeddings[pos] = embedding
+        return embeddings
 
-    def add_document(self, doc_path: str) -> Optional[Document]:
-        """Add a single document to the system"""
-        try:
-            # Load document
-            document = self.load_doc(doc_path)
-            if not document:
-                return None
+    def embed_nodes(
+            self,
+            documents: List[Optional[Document]],
+            doc_nodes: List[List[TextNode]]
+    ) -> tuple:
+        """Embeddings for all nodes (flat, in node order), reusing the stored vectors of
+        chunks whose content did not change.
 
-            doc_id = document.doc_id
+        Returns (embeddings, ids of stored points that are no longer part of the documents).
+        """
+        doc_ids = [document.doc_id for document in documents if document is not None]
+        existing = self._existing_chunk_ids(doc_ids)
+
+        node_ids = [
+            node_id
+            for document, nodes in zip(documents, doc_nodes)
+            if document is not None
+            for node_id in chunk_ids(document.doc_id, nodes)
+        ]
+        texts = [node.text for document, nodes in zip(documents, doc_nodes) if document is not None for node in nodes]
+        embeddings = self._embed_reusing(node_ids, texts, existing)
+
+        current = set(node_ids)
+        stale_ids = [point_id for node_id, point_id in existing.items() if node_id not in current]
+        return embeddings, stale_ids
+
+    def _iter_stream_nodes(self, entries: List[tuple], failed: set):
+        """(entry index, node, node_id, index, prev_id, next_id) for every chunk of every entry.
+
+        Files are extracted and chunked page by page; one node is held back until its
+        successor (the next link) is known. An entry whose extraction fails part way is
+        added to ``failed`` and the stream goes on with the next one.
+        """
+        held = None
+        for entry_idx, (document, path, _) in enumerate(entries):
+            seen: Dict[str, int] = {}
+            try:
+                for node in iter_chunks(iter_pages(path), self.node_parser):
+                    node_id = chunk_id(document.doc_id, node.text, seen)
+                    if held is not None and held[0] == entry_idx:
+                        yield (*held, node_id)
+                        held = (entry_idx, node, node_id, held[3] + 1, held[2])
+                    else:
+                        if held is not None:
+                            yield (*held, None)
+                        held = (entry_idx, node, node_id, 0, None)
+            except Exception as e:
+                print(f"Error extracting {path}: {str(e)}")
+                failed.add(entry_idx)
+                if held is not None and held[0] == entry_idx:
+                    held = None
+        if held is not None:
+            yield (*held, None)
+
+    def _restore_document(
+            self,
+            doc_id: str,
+            previous_nodes: Optional[List[tuple]],
+            written_nodes: List[tuple],
+            collection_name: str
+    ) -> None:
+        """Undo a document whose stream failed part way: drop the chunks it added and put the
+        previous node list back into the reused points and the lexical index"""
+        previous_nodes = previous_nodes or []
+        previous_ids = [node[0] for node in previous_nodes]
+        keep = set(previous_ids)
+        added = [node[0] for node in written_nodes if node[0] not in keep]
+        self.delete_points([stable_hash(node_id) for node_id in added], collection_name=collection_name)
+        self.chunk_store.delete(added)
+
+        # Reused points got the positions of the partial stream
+        rewritten = {node[0] for node in written_nodes} & keep
+        for node_idx, (node_id, start_char_idx, end_char_idx) in enumerate(previous_nodes):
+            if node_id not in rewritten:
+                continue
+            relationships = []
+            if node_idx > 0:
+                relationships.append({"type": "previous", "node_id": previous_ids[node_idx - 1]})
+            if node_idx < len(previous_ids) - 1:
+                relationships.append({"type": "next", "node_id": previous_ids[node_idx + 1]})
+            self.qdrant.set_payload(
+                collection_name=collection_name,
+                payload={
+                    "index": node_idx,
+                    "total_nodes": len(previous_ids),
+                    "relationships": relationships,
+                    "start_char_idx": start_char_idx,
+                    "end_char_idx": end_char_idx
+                },
+                key="metadata.node_info",
+                points=models.PointIdsList(points=[stable_hash(node_id)])
+            )
 
-            if doc_id not in self.document_summaries:
-                # Generate and store summary
-                self.document_summaries[doc_id] = self.generate_document_summary(document)
+        texts = self.chunk_store.get_many(previous_ids)
+        self.lexical_index.replace_documents({
+            doc_id: [(node_id, texts[node_id]) for node_id in previous_ids if node_id in texts]
+        })
 
-            summary = self.document_summaries[doc_id]
+    @traced()
+    def ingest_stream(self, entries: List[tuple], collection_name: Optional[str] = None) -> Dict[str, int]:
+        """Chunk, embed and upsert documents as a stream of EMBED_BATCH_SIZE nodes.
 
-            # Analyze and update hierarchy for the new document
-            new_hierarchy = self.analyze_single_document_hierarchy(document)
-            if new_hierarchy:
-                self.update_hierarchy_with_document(doc_id, new_hierarchy)
+        ``entries`` are (document from load_doc, file path, folder path). Memory depends on
+        the page size and batch size, not on the document size. Chunks already stored
+        keep their vectors, stored chunks that disappeared are deleted, and each
+        document's vector becomes the centroid of its chunk embeddings. Chunk texts go to
+        the chunk store before their points, the node lists once a document is complete.
 
-            # Process document nodes
-            nodes = self.node_parser.get_nodes_from_documents([document])
+        A document whose extraction fails part way keeps its previous chunks (see
+        _restore_document) and is left out of the result; the others are still indexed.
+        Returns the number of nodes per indexed doc_id.
+        """
+        collection_name = collection_name or self.collection_name
+        doc_ids = [document.doc_id for document, _, _ in entries]
+        existing = self._existing_chunk_ids(doc_ids, collection_name)
+        previous = self.chunk_store.documents(doc_ids)
+        counts = {doc_id: 0 for doc_id in doc_ids}
+        sums: Dict[str, np.ndarray] = {}
+        manifests: Dict[str, List[tuple]] = {doc_id: [] for doc_id in doc_ids}
+        written = set()
+        failed: set = set()  # entry indices whose extraction failed
+        self.lexical_index.delete_documents(doc_ids)
+
+        def flush(batch: List[tuple]) -> None:
+            batch = [item for item in batch if item[0] not in failed]
+            if not batch:
+                return
+            embeddings = self._embed_reusing(
+                [item[2] for item in batch], [item[1].text for item in batch], existing, collection_name
+            )
             points = []
+            lexical_chunks: Dict[str, List[tuple]] = {}
+            for (entry_idx, node, node_id, node_idx, prev_id, next_id), embedding in zip(batch, embeddings):
+                document, _, folder_path = entries[entry_idx]
+                doc_id = document.doc_id
+                points.append(self._build_point(
+                    document, node, node_id, node_idx, embedding,
+                    prev_id=prev_id, next_id=next_id, folder_path=folder_path
+                ))
+                vector = np.asarray(embedding, dtype=np.float32)
+                sums[doc_id] = sums[doc_id] + vector if doc_id in sums else vector
+                counts[doc_id] += 1
+                written.add(node_id)
+                manifests[doc_id].append((node_id, node.start_char_idx, node.end_char_idx))
+                lexical_chunks.setdefault(doc_id, []).append((node_id, node.text))
+
+            stored = self.chunk_store.contains_many(item[2] for item in batch)
+            self.chunk_store.put_many((item[2], item[1].text) for item in batch if item[2] not in stored)
+            self.upsert_points(points, collection_name=collection_name)
+            self.lexical_index.add_chunks(lexical_chunks)
+
+        batch = []
+        for item in self._iter_stream_nodes(entries, failed):
+            batch.append(item)
+            if len(batch) >= EMBED_BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        failed_ids = {entries[entry_idx][0].doc_id for entry_idx in failed}
+        for doc_id in failed_ids:
+            self._restore_document(doc_id, previous.get(doc_id), manifests.pop(doc_id), collection_name)
+            counts.pop(doc_id)
+
+        self.delete_points(
+            [
+                point_id for node_id, point_id in existing.items()
+                if node_id not in written and node_id.rsplit("_chunk_", 1)[0] not in failed_ids
+            ],
+            collection_name=collection_name
+        )
+        self.chunk_store.set_documents({doc_id: nodes for doc_id, nodes in manifests.items() if nodes})
+        self.chunk_store.delete(
+            node[0]
+            for doc_id, nodes in previous.items() if doc_id not in failed_ids
+            for node in nodes if node[0] not in written
+        )
 
-            for node_idx, node in enumerate(nodes):
-                embedding = self.embed_model.get_text_embedding(node.text)
-
-                # Create relationships between nodes
-                node_relationships = []
-                if node_idx > 0:
-                    node_relationships.append({
-                        "type": "previous",
-                        "node_id": f"{doc_id}_node_{node_idx - 1}"
-                    })
-                if node_idx < len(nodes) - 1:
-                    node_relationships.append({
-                        "type": "next",
-                        "node_id": f"{doc_id}_node_{node_idx + 1}"
-                    })
-
-                point = models.PointStruct(
-                    id=stable_hash(f"{doc_id}_node_{node_idx}"),
-                    vector=embedding,
+        for doc_id, count in counts.items():
+            if not count:
+                continue
+            self.doc_vectors.upsert(doc_id, sums[doc_id] / count)
+            # The node count is only known at the end of the stream
+            self.qdrant.set_payload(
+                collection_name=collection_name,
+                payload={"total_nodes": count},
+                key="metadata.node_info",
+                points=self._doc_selector([doc_id])
+            )
+        return counts
+
+    @staticmethod
+    def _doc_selector(doc_ids: List[str]) -> models.FilterSelector:
+        return models.FilterSelector(
+            filter=models.Filter(must=[models.FieldCondition(key="doc_id", match=models.MatchAny(any=doc_ids))])
+        )
+
+    @traced("qdrant.set_payload")
+    def set_folder_paths(
+            self,
+            folder_paths: Dict[str, List[int]],
+            collection_names: Optional[tuple] = None
+    ) -> None:
+        """Update ``folder_path`` of every point and summary point of the given documents (after a move)"""
+        by_path: Dict[tuple, List[str]] = {}
+        for doc_id, folder_path in folder_paths.items():
+            by_path.setdefault(tuple(folder_path), []).append(doc_id)
+
+        for folder_path, doc_ids in by_path.items():
+            for collection_name in collection_names or (self.collection_name, self.summary_collection_name):
+                self.qdrant.set_payload(
+                    collection_name=collection_name,
+                    payload={"folder_path": list(folder_path)},
+                    points=self._doc_selector(doc_ids)
+                )
+
+    def stored_folder_paths(self) -> Dict[str, List[int]]:
+        """doc_id -> folder_path as currently stored in the collection"""
+        folder_paths = {}
+        offset = None
+        while True:
+            records, offset = self.qdrant.scroll(
+                collection_name=self.collection_name,
+                limit=1000,
+                offset=offset,
+                with_payload=["doc_id", "folder_path"],
+                with_vectors=False
+            )
+            for record in records:
+                if record.payload.get("folder_path"):
+                    folder_paths[record.payload["doc_id"]] = record.payload["folder_path"]
+            if offset is None:
+                break
+        return folder_paths
+
+    @traced("qdrant.delete")
+    def delete_points(self, point_ids: List[int], collection_name: Optional[str] = None) -> None:
+        if point_ids:
+            self.qdrant.delete(
+                collection_name=collection_name or self.collection_name,
+                points_selector=models.PointIdsList(points=point_ids)
+            )
+
+    @traced("qdrant.upsert")
+    def upsert_points(self, points: List[models.PointStruct], collection_name: Optional[str] = None) -> None:
+        """Upload points to Qdrant in batches"""
+        for i in range(0, len(points), UPSERT_BATCH_SIZE):
+            self.qdrant.upsert(
+                collection_name=collection_name or self.collection_name,
+                points=points[i:i + UPSERT_BATCH_SIZE]
+            )
+
+    @traced()
+    def _index_lexical(self, documents: List[Document], doc_nodes: List[List[TextNode]]) -> None:
+        """Keep the lexical index in step with the points written to Qdrant"""
+        self.lexical_index.replace_documents({
+            document.doc_id: list(zip(chunk_ids(document.doc_id, nodes), [node.text for node in nodes]))
+            for document, nodes in zip(documents, doc_nodes)
+            if document is not None
+        })
+
+    @traced("qdrant.upsert_summaries")
+    def index_summaries(self, payloads: Dict[str, Dict[str, Any]], collection_name: Optional[str] = None) -> int:
+        """Embed the summaries of the documents into the summary collection.
+
+        ``payloads`` maps doc_id to the filter fields of the document (``metadata``,
+        ``folder_path``, ``creation_ts``), so scoped searches filter both stages the same
+        way. Documents without a summary get the centroid of their chunk vectors instead
+        (``has_summary`` is False) and are re-upserted with the summary embedding by the
+        next call once it exists; documents with neither are skipped. Returns the number
+        of points embedded from summaries.
+        """
+        summarized = [doc_id for doc_id in payloads if self.document_summaries.get(doc_id)]
+        vectors = dict(zip(summarized, self.embed_texts([self.document_summaries[doc_id] for doc_id in summarized])))
+        for doc_id in payloads:
+            if doc_id not in vectors:
+                centroid = self.doc_vectors.get(doc_id)
+                if centroid is not None:
+                    vectors[doc_id] = centroid.tolist()
+        if not vectors:
+            return 0
+
+        self.upsert_points(
+            [
+                models.PointStruct(
+                    id=stable_hash(doc_id),
+                    vector=vector,
                     payload={
-                        'doc_id': doc_id,
-                        'node_id': f"{doc_id}_node_{node_idx}",
-                        'text': node.text,
-                        'metadata': {
-                            **document.metadata,
-                            'node_info': {
-                                'index': node_idx,
-                                'total_nodes': len(nodes),
-                                'relationships': node_relationships,
-                                'start_char_idx': node.start_char_idx,
-                                'end_char_idx': node.end_char_idx
-                            }
-                        },
-                        'hierarchy': self.document_hierarchy.get(doc_id, {}),
-                        'summary': summary
+                        "doc_id": doc_id,
+                        "has_summary": bool(self.document_summaries.get(doc_id)),
+                        "metadata": payloads[doc_id].get("metadata", {}),
+                        "folder_path": payloads[doc_id].get("folder_path") or [],
+                        "creation_ts": payloads[doc_id].get("creation_ts")
                     }
                 )
-                points.append(point)
+                for doc_id, vector in vectors.items()
+            ],
+            collection_name=collection_name or self.summary_collection_name
+        )
+        return len(summarized)
+
+    @staticmethod
+    def summary_payload(document: Document, folder_path: Optional[List[int]] = None) -> Dict[str, Any]:
+        return {
+            "metadata": {key: value for key, value in document.metadata.items() if key not in DOCUMENT_STATE_FIELDS},
+            "folder_path": folder_path,
+            "creation_ts": creation_timestamp(document.metadata.get("creation_date"))
+        }
+
+    def rebuild_summary_index(self) -> int:
+        """Backfill the summary collection from the first chunk of every indexed document"""
+        payloads = {}
+        offset = None
+        while True:
+            records, offset = self.qdrant.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=models.Filter(must=[
+                    models.FieldCondition(key="metadata.node_info.index", match=models.MatchValue(value=0))
+                ]),
+                limit=UPSERT_BATCH_SIZE,
+                offset=offset,
+                with_payload=["doc_id", "metadata", "folder_path", "creation_ts"],
+                with_vectors=False
+            )
+            for record in records:
+                metadata = {
+                    key: value for key, value in record.payload["metadata"].items()
+                    if key != "node_info" and key not in DOCUMENT_STATE_FIELDS
+                }
+                payloads[record.payload["doc_id"]] = {**record.payload, "metadata": metadata}
+            if offset is None:
+                break
+
+        indexed = self.index_summaries(payloads)
+        print(f"Indexed the summaries of {indexed} of {len(payloads)} documents, the rest by their chunk centroid")
+        return indexed
+
+    @traced()
+    def _store_chunks(self, documents: List[Document], doc_nodes: List[List[TextNode]]) -> None:
+        """Write new chunk texts and the documents' node lists; chunks the documents lost are deleted"""
+        doc_ids = [document.doc_id for document in documents if document is not None]
+        previous = self.chunk_store.documents(doc_ids)
+        texts = {}
+        manifests = {}
+        for document, nodes in zip(documents, doc_nodes):
+            if document is None:
+                continue
+            node_ids = chunk_ids(document.doc_id, nodes)
+            texts.update(zip(node_ids, [node.text for node in nodes]))
+            manifests[document.doc_id] = [
+                (node_id, node.start_char_idx, node.end_char_idx) for node_id, node in zip(node_ids, nodes)
+            ]
+
+        stored = self.chunk_store.contains_many(texts)
+        self.chunk_store.put_many((node_id, text) for node_id, text in texts.items() if node_id not in stored)
+        self.chunk_store.set_documents(manifests)
+        self.chunk_store.delete(node[0] for nodes in previous.values() for node in nodes if node[0] not in texts)
+
+    def _attach_texts(self, points: List[Any]) -> List[Any]:
+        """Put each point's chunk text into its payload (points that carry one keep it).
+
+        Points whose text is not in the chunk store (e.g. ingested on another host with
+        CHUNK_TEXT_STORE=local) are dropped and counted in ``missing_chunk_texts``.
+        """
+        texts = self.chunk_store.get_many(
+            point.payload["node_id"] for point in points if "text" not in point.payload
+        )
+        attached = []
+        for point in points:
+            if "text" not in point.payload:
+                text = texts.get(point.payload.get("node_id"))
+                if text is None:
+                    continue
+                point.payload["text"] = text
+            attached.append(point)
+
+        if len(attached) < len(points):
+            self.missing_chunk_texts += len(points) - len(attached)
+            logger.warning(
+                "%d chunk texts are missing from the chunk store (%d so far)",
+                len(points) - len(attached), self.missing_chunk_texts
+            )
+        return attached
+
+    def _document_fields(self, doc_id: str, metadata: Dict[str, Any]) -> tuple:
+        """(metadata with the current summary, hierarchy entry) of a document, from the state"""
+        metadata = {key: value for key, value in metadata.items() if key not in DOCUMENT_STATE_FIELDS}
+        metadata["summary"] = self.document_summaries.get(doc_id, "")
+        return metadata, self.hierarchy.entry(doc_id.split('/')[-1])
+
+    def rebuild_lexical_index(self) -> None:
+        """Backfill the lexical index from the indexed chunks (texts from the chunk store)"""
+        chunks_by_doc: Dict[str, List[tuple]] = {}
+        offset = None
+        while True:
+            records, offset = self.qdrant.scroll(
+                collection_name=self.collection_name,
+                limit=UPSERT_BATCH_SIZE,
+                offset=offset,
+                with_payload=["doc_id", "node_id", "text"]
+            )
+            for record in self._attach_texts(records):
+                chunks_by_doc.setdefault(record.payload["doc_id"], []).append(
+                    (record.payload["node_id"], record.payload["text"])
+                )
+            if offset is None:
+                break
+
+        self.lexical_index.replace_documents(chunks_by_doc)
+        print(f"Rebuilt lexical index for {len(chunks_by_doc)} documents")
+
+    def migrate_chunk_texts(self) -> int:
+        """Move chunk texts of points written before the chunk store out of their payloads.
 
-            # Upload points
-            result = self.qdrant.upsert(
+        Page by page the texts go to the chunk store first, then ``text`` (kept with
+        CHUNK_TEXT_STORE=qdrant) and the per-document ``summary`` and ``hierarchy`` copies
+        are dropped from the payloads; the node lists of all documents are written at the
+        end. Safe to re-run; returns the number of migrated points.
+        """
+        keys = [
+            *DOCUMENT_STATE_FIELDS,
+            *(f"metadata.{field}" for field in DOCUMENT_STATE_FIELDS),
+            *(["text"] if self.chunk_texts == "local" else [])
+        ]
+        nodes_by_doc: Dict[str, Dict[int, tuple]] = {}
+        migrated = 0
+        offset = None
+        while True:
+            records, offset = self.qdrant.scroll(
                 collection_name=self.collection_name,
-                points=points
+                limit=UPSERT_BATCH_SIZE,
+                offset=offset,
+                with_payload=["doc_id", "node_id", "text", "metadata.node_info"],
+                with_vectors=False
             )
+            for record in records:
+                node_info = record.payload["metadata"]["node_info"]
+                nodes_by_doc.setdefault(record.payload["doc_id"], {})[node_info["index"]] = (
+                    record.payload["node_id"], node_info.get("start_char_idx"), node_info.get("end_char_idx")
+                )
+            with_text = [record for record in records if "text" in record.payload]
+            self.chunk_store.put_many((record.payload["node_id"], record.payload["text"]) for record in with_text)
+            if records:
+                self.qdrant.delete_payload(
+                    collection_name=self.collection_name,
+                    keys=keys,
+                    points=models.PointIdsList(points=[record.id for record in records])
+                )
+            migrated += len(with_text)
+            if offset is None:
+                break
+
+        self.chunk_store.set_documents({
+            doc_id: [nodes[idx] for idx in sorted(nodes)] for doc_id, nodes in nodes_by_doc.items()
+        })
+        print(f"Moved the text of {migrated} chunks of {len(nodes_by_doc)} documents to the chunk store")
+        return migrated
+
+    def _build_point(
+            self,
+            document: Document,
+            node: TextNode,
+            node_id: str,
+            node_idx: int,
+            embedding: List[float],
+            total_nodes: Optional[int] = None,
+            prev_id: Optional[str] = None,
+            next_id: Optional[str] = None,
+            folder_path: Optional[List[int]] = None,
+    ) -> models.PointStruct:
+        """Create the Qdrant point of one document node with its prev/next node links.
+
+        ``folder_path`` (ancestor folder ids) and ``creation_ts`` are top-level payload
+        fields with payload indexes, used by scoped searches.
+        """
+        doc_id = document.doc_id
+
+        # Create relationships between nodes
+        node_relationships = []
+        if prev_id:
+            node_relationships.append({
+                "type": "previous",
+                "node_id": prev_id
+            })
+        if next_id:
+            node_relationships.append({
+                "type": "next",
+                "node_id": next_id
+            })
+
+        node_info = {
+            'index': node_idx,
+            'total_nodes': total_nodes,
+            'relationships': node_relationships,
+            'start_char_idx': node.start_char_idx,
+            'end_char_idx': node.end_char_idx
+        }
+        if "page_start" in node.metadata:
+            node_info['page_start'] = node.metadata["page_start"]
+            node_info['page_end'] = node.metadata["page_end"]
+
+        # Summary and hierarchy are per document and live in the state (see _document_fields)
+        payload = {
+            'doc_id': doc_id,
+            'node_id': node_id,
+            'metadata': {
+                **{key: value for key, value in document.metadata.items() if key not in DOCUMENT_STATE_FIELDS},
+                'node_info': node_info
+            },
+            'folder_path': folder_path or [],
+            'creation_ts': creation_timestamp(document.metadata.get("creation_date"))
+        }
+        if self.chunk_texts == "qdrant":
+            payload['text'] = node.text
+
+        return models.PointStruct(id=stable_hash(node_id), vector=embedding, payload=payload)
+
+    def _build_points(
+            self,
+            document: Document,
+            nodes: List[TextNode],
+            embeddings: List[List[float]],
+            folder_path: Optional[List[int]] = None,
+    ) -> List[models.PointStruct]:
+        """Create Qdrant points for all nodes of a document"""
+        node_ids = chunk_ids(document.doc_id, nodes)
+        return [
+            self._build_point(
+                document,
+                node,
+                node_ids[node_idx],
+                node_idx,
+                embedding,
+                total_nodes=len(nodes),
+                prev_id=node_ids[node_idx - 1] if node_idx > 0 else None,
+                next_id=node_ids[node_idx + 1] if node_idx < len(nodes) - 1 else None,
+                folder_path=folder_path
+            )
+            for node_idx, (node, embedding) in enumerate(zip(nodes, embeddings))
+        ]
+
+    def add_document(self, doc_path: str, folder_path: Optional[List[int]] = None) -> Optional[Document]:
+        """Add a single document to the system"""
+        return self.add_documents([doc_path], [folder_path])[0]
+
+    @traced()
+    def add_documents(
+            self,
+            doc_paths: List[str],
+            folder_paths: Optional[List[Optional[List[int]]]] = None
+    ) -> List[Optional[Document]]:
+        """Add several documents, sharing embedding batches and Qdrant upserts.
 
-            print(result)
+        ``folder_paths`` are the ancestor folder ids of each document. Returns a list
+        aligned with ``doc_paths``; failed documents are ``None``.
+        """
+        # Uploads run in the threadpool; ingests of one worker still go one at a time
+        with self._ingest_lock:
+            return self._add_documents(doc_paths, folder_paths)
+
+    def _add_documents(
+            self,
+            doc_paths: List[str],
+            folder_paths: Optional[List[Optional[List[int]]]]
+    ) -> List[Optional[Document]]:
+        folder_paths = folder_paths or [None] * len(doc_paths)
+
+        # Analyse against the latest state of all workers
+        self.refresh_state()
+
+        loaded: List[Optional[Document]] = []
+        entries = []  # (document, path, folder path) of the loaded documents
+
+        for doc_path, folder_path in zip(doc_paths, folder_paths):
+            try:
+                # Load document
+                document = self.load_doc(doc_path)
+                if not document:
+                    loaded.append(None)
+                    continue
+
+                doc_id = document.doc_id
+
+                if not self.document_summaries.get(doc_id):
+                    # Generate and store summary (an empty one is retried on the next upload)
+                    self.document_summaries[doc_id] = self.generate_document_summary(document)
+
+                # Analyze and update hierarchy for the new document
+                new_hierarchy = self.analyze_single_document_hierarchy(document)
+                if new_hierarchy:
+                    self.update_hierarchy_with_document(doc_id, new_hierarchy)
+
+                loaded.append(document)
+                entries.append((document, Path(doc_path), folder_path))
+
+            except Exception as e:
+                print(f"Error adding document {doc_path}: {str(e)}")
+                print(traceback.format_exc())
+                loaded.append(None)
+
+        try:
+            # Stream the full text page by page into Qdrant and the lexical index
+            counts = self.ingest_stream(entries)
+
+            # Files that broke while streaming keep their previous index; only they fail
+            loaded = [document if document is None or document.doc_id in counts else None for document in loaded]
+            entries = [entry for entry in entries if entry[0].doc_id in counts]
+
+            # Document vectors are known now: relink
+            doc_ids = [document.doc_id for document, _, _ in entries]
+            self.link_documents(doc_ids)
+            self.index_summaries({
+                document.doc_id: self.summary_payload(document, folder_path) for document, _, folder_path in entries
+            })
 
             # Save updated state
             self.save_state()
 
-            print(f"Successfully added document: {doc_id}")
-            return document
-
         except Exception as e:
-            print(f"Error adding document: {str(e)}")
+            print(f"Error indexing documents: {str(e)}")
             print(traceback.format_exc())
-            return None
-
-    def _validate_and_fix_relationships(self, hierarchy: Dict[str, Any]) -> None:
-        """Validate and fix hierarchical relationships"""
-        for doc_id, info in hierarchy.items():
-            parent_id = info.get("parent_id")
-            if parent_id:
-                if parent_id in hierarchy:
-                    parent = hierarchy[parent_id]
-                    if doc_id not in parent["children"]:
-                        parent["children"].append(doc_id)
-                    info["level"] = parent["level"] + 1
-                else:
-                    info["parent_id"] = None
-                    info["level"] = 0
-
-        for doc_id, info in hierarchy.items():
-            relationships = info.get("relationships", [])
-            valid_relationships = []
-            for rel_id in relationships:
-                if rel_id in hierarchy and rel_id != doc_id:
-                    valid_relationships.append(rel_id)
-                    rel_info = hierarchy[rel_id]
-                    if doc_id not in rel_info.get("relationships", []):
-                        rel_info.setdefault("relationships", []).append(doc_id)
-            info["relationships"] = valid_relationships
-
+            return [None] * len(doc_paths)
+
+        for document in loaded:
+            if document is not None:
+                print(f"Successfully added document: {document.doc_id}")
+
+        return loaded
+
+    def prune_state(self, doc_ids: List[str]) -> None:
+        """Drop summaries and hierarchy entries of removed documents and every edge to them"""
+        for doc_id in doc_ids:
+            self.document_summaries.pop(doc_id, None)
+        self.hierarchy.remove(doc_ids)
+
+    @traced()
+    def delete_documents(self, doc_ids: List[str]) -> None:
+        """Remove documents everywhere: Qdrant chunk and summary points (one filtered delete
+        each), lexical index, chunk store, document vectors, summaries and hierarchy edges"""
+        if not doc_ids:
+            return
+
+        # An ingest of the same doc_id running in another thread would upsert after the delete
+        with self._ingest_lock:
+            self._delete_documents(doc_ids)
+
+    def _delete_documents(self, doc_ids: List[str]) -> None:
+        for collection_name in (self.collection_name, self.summary_collection_name):
+            self.qdrant.delete(collection_name=collection_name, points_selector=self._doc_selector(list(doc_ids)))
+        self.lexical_index.delete_documents(doc_ids)
+        self.chunk_store.delete_documents(doc_ids)
+        self.doc_vectors.remove(doc_ids)
+        self.prune_state(doc_ids)
+        self.save_state()
+        print(f"Deleted {len(doc_ids)} documents from the index")
+
+    @traced()
+    def indexed_doc_ids(self) -> set:
+        """Doc ids known to Qdrant (chunks or summary points), the lexical index, the document vectors or the state"""
+        doc_ids = set(self.document_summaries) | set(self.hierarchy) | set(self.doc_vectors.ids)
+        doc_ids |= self.lexical_index.doc_ids()
+
+        for collection_name in (self.collection_name, self.summary_collection_name):
+            offset = None
+            while True:
+                records, offset = self.qdrant.scroll(
+                    collection_name=collection_name,
+                    limit=1000,
+                    offset=offset,
+                    with_payload=["doc_id"],
+                    with_vectors=False
+                )
+                doc_ids.update(record.payload["doc_id"] for record in records if record.payload.get("doc_id"))
+                if offset is None:
+                    break
+        return doc_ids
+
+    @traced()
+    def collect_garbage(self, live_doc_ids: set) -> List[str]:
+        """Delete every indexed document that is not in ``live_doc_ids``; returns the removed ids"""
+        with self._ingest_lock:
+            orphans = sorted(self.indexed_doc_ids() - set(live_doc_ids))
+            if orphans:
+                self._delete_documents(orphans)
+            if self.chunk_store.stats()["garbage_ratio"] > CHUNK_STORE_COMPACT_RATIO:
+                print(f"Compacted the chunk store, {self.chunk_store.compact()} bytes reclaimed")
+        return orphans
+
+    @traced()
     def process_documents(self, documents: List[Document]) -> None:
         """Process documents and create node vectors in Qdrant"""
         try:
             print("Analyzing document hierarchies...")
-            self.document_hierarchy = self.analyze_hierarchy(documents)
+            # from_dict drops unknown parents and cycles and makes the links symmetric
+            self.hierarchy = HierarchyGraph.from_dict(self.analyze_hierarchy(documents))
 
             print("Creating document nodes and vectors...")
             points = []
+            doc_nodes = []
 
+            doc_embeddings = []
+            stale_ids = []
             for doc in documents:
-                # Parse document into nodes
+                # Parse document into nodes; unchanged chunks keep their stored vectors
                 nodes = self.node_parser.get_nodes_from_documents([doc])
-
-                for node_idx, node in enumerate(nodes):
-                    # Generate embedding for node
-                    embedding = self.embed_model.get_text_embedding(node.text)
-
-                    # Create relationships between nodes
-                    node_relationships = []
-                    if node_idx > 0:
-                        node_relationships.append({
-                            "type": "previous",
-                            "node_id": f"{doc.doc_id}_node_{node_idx - 1}"
-                        })
-                    if node_idx < len(nodes) - 1:
-                        node_relationships.append({
-                            "type": "next",
-                            "node_id": f"{doc.doc_id}_node_{node_idx + 1}"
-                        })
-
-                    # Create point for Qdrant
-                    point = models.PointStruct(
-                        id=stable_hash(f"{doc.doc_id}_node_{node_idx}"),
-                        vector=embedding,
-                        payload={
-                            'doc_id': doc.doc_id,
-                            'node_id': f"{doc.doc_id}_node_{node_idx}",
-                            'text': node.text,
-                            'metadata': {
-                                **doc.metadata,
-                                'node_info': {
-                                    'index': node_idx,
-                                    'total_nodes': len(nodes),
-                                    'relationships': node_relationships,
-                                    'start_char_idx': node.start_char_idx,
-                                    'end_char_idx': node.end_char_idx
-                                }
-                            },
-                            'hierarchy': self.document_hierarchy.get(doc.doc_id.split('/')[-1], {}),
-                            'summary': self.document_summaries.get(doc.doc_id, '')
-                        }
-                    )
-                    points.append(point)
-
-            # Upload in batches
-            BATCH_SIZE = 100
-            for i in range(0, len(points), BATCH_SIZE):
-                batch = points[i:i + BATCH_SIZE]
-                self.qdrant.upsert(
-                    collection_name=self.collection_name,
-                    points=batch
-                )
+                embeddings, doc_stale_ids = self.embed_nodes([doc], [nodes])
+                self.update_document_vectors([doc], [nodes], embeddings)
+                doc_nodes.append(nodes)
+                doc_embeddings.append(embeddings)
+                stale_ids.extend(doc_stale_ids)
+
+            self.link_documents([doc.doc_id for doc in documents])
+            for doc, nodes, embeddings in zip(documents, doc_nodes, doc_embeddings):
+                points.extend(self._build_points(doc, nodes, embeddings))
+
+            # Texts first, so that no point is searchable without its text
+            self._store_chunks(documents, doc_nodes)
+            self.upsert_points(points)
+            self.delete_points(stale_ids)
+            self._index_lexical(documents, doc_nodes)
+            self.index_summaries({doc.doc_id: self.summary_payload(doc) for doc in documents})
 
             print(f"Uploaded {len(points)} nodes to Qdrant")
 
@@ -692,90 +1400,397 @@ class DocumentProcessor:
             print(f"Error processing documents: {str(e)}")
             raise
 
-    def query(
+    @traced()
+    def _lexical_search(
+            self,
+            query_text: str,
+            limit: int,
+            phrase: bool = False,
+            query_filter: Optional[models.Filter] = None
+    ) -> List[models.ScoredPoint]:
+        """BM25 search over chunk text, resolved to Qdrant payloads without an embedding call.
+
+        The lexical index knows nothing about payloads, so with ``query_filter`` it is
+        over-fetched and its hits are checked against the filter in Qdrant.
+        """
+        fetch = limit * LEXICAL_FILTER_OVERFETCH if query_filter else limit
+        hits = self.lexical_index.search(query_text, limit=fetch, phrase=phrase)
+        if not hits:
+            return []
+
+        scores = {stable_hash(node_id): score for node_id, _, score in hits}
+        if query_filter:
+            records, _ = self.qdrant.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=models.Filter(
+                    must=[models.HasIdCondition(has_id=list(scores.keys())), *(query_filter.must or [])]
+                ),
+                limit=len(scores),
+                with_vectors=False
+            )
+        else:
+            records = self.qdrant.retrieve(
+                collection_name=self.collection_name,
+                ids=list(scores.keys())
+            )
+
+        # BM25 scores are not comparable with cosine similarity
+        results = [
+            models.ScoredPoint(
+                id=record.id, version=0, score=scores[record.id], payload={**record.payload, "similarity": None}
+            )
+            for record in records
+        ]
+        results.sort(key=lambda point: point.score, reverse=True)
+        return results[:limit]
+
+    @traced()
+    def search(
             self,
             query_text: str,
             similarity_threshold: float = 0.0,
-            include_hierarchy: bool = True,
             limit: int = 10,
-            context_window: int = 1  # Количество соседних нодов для контекста
-    ) -> Dict[str, Any]:
-        """Query using Qdrant vector search with node context"""
-        try:
-            logger.error(query_text)
-            query_embedding = self.embed_model.get_text_embedding(query_text)
+            mode: str = "hybrid",
+            rrf_k: int = 60,
+            query_filter: Optional[models.Filter] = None,
+            strategy: Optional[str] = None,
+    ) -> List[models.ScoredPoint]:
+        """Find the best matching nodes.
+
+        mode: "dense" (vector search), "lexical" (BM25) or "hybrid" (both fused with RRF,
+        hybrid hits are ranked by their RRF score, their payloads carry the cosine score as
+        ``similarity`` and the fused one as ``rrf_score``). Identifier-like queries are answered
+        from the lexical index alone when it has matches. ``query_filter`` (see
+        collections.search_filter) restricts every mode to matching points. The hits'
+        payloads get their chunk text from the chunk store.
+
+        strategy (default SEARCH_STRATEGY): "flat" searches all chunks, "two_stage" first
+        picks the TWO_STAGE_TOP_DOCUMENTS documents whose summaries match best and only
+        searches their chunks (dense and hybrid modes).
+        """
+        return self._attach_texts(
+            self._search_points(
+                query_text, similarity_threshold, limit, mode, rrf_k, query_filter,
+                strategy or settings.SEARCH_STRATEGY
+            )
+        )
+
+    @traced("qdrant.search_summaries")
+    def _restrict_to_documents(
+            self,
+            query_embedding: List[float],
+            query_filter: Optional[models.Filter]
+    ) -> Optional[models.Filter]:
+        """First stage of a two-stage search: add the best matching documents to the filter.
+
+        The summary points carry the same filter fields as the chunks, so a scoped search
+        picks its documents within the scope. Without summary hits (the summary collection
+        is not filled yet) the filter is returned unchanged, i.e. the search stays flat.
+        """
+        hits = self.qdrant.search(
+            collection_name=self.summary_collection_name,
+            query_vector=query_embedding,
+            limit=settings.TWO_STAGE_TOP_DOCUMENTS,
+            query_filter=query_filter,
+            with_payload=["doc_id"],
+            search_params=search_params()
+        )
+        if not hits:
+            return query_filter
 
-            # Search in Qdrant
-            search_results = self.qdrant.search(
+        doc_ids = [hit.payload["doc_id"] for hit in hits]
+        return models.Filter(must=[
+            *((query_filter.must or []) if query_filter else []),
+            models.FieldCondition(key="doc_id", match=models.MatchAny(any=doc_ids))
+        ])
+
+    def _search_points(
+            self,
+            query_text: str,
+            similarity_threshold: float,
+            limit: int,
+            mode: str,
+            rrf_k: int,
+            query_filter: Optional[models.Filter],
+            strategy: str = "flat"
+    ) -> List[models.ScoredPoint]:
+        if mode != "dense" and is_exact_match_query(query_text):
+            exact_hits = self._lexical_search(query_text.strip('" '), limit, phrase=True, query_filter=query_filter)
+            if exact_hits:
+                return exact_hits
+
+        if mode == "lexical":
+            return self._lexical_search(query_text, limit, query_filter=query_filter)
+
+        query_embedding = self.embed_query(query_text)
+        if strategy == "two_stage":
+            query_filter = self._restrict_to_documents(query_embedding, query_filter)
+        candidates = limit if mode == "dense" else limit * 2
+
+        with span("qdrant.search", limit=candidates):
+            dense_hits = self.qdrant.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
-                limit=limit,
-                score_threshold=similarity_threshold
+                limit=candidates,
+                score_threshold=similarity_threshold,
+                query_filter=query_filter,
+                search_params=search_params()
+            )
+        if mode == "dense":
+            return dense_hits
+
+        payloads = {hit.id: hit.payload for hit in dense_hits}
+        similarities = {hit.id: hit.score for hit in dense_hits}
+        with span("lexical.search", limit=candidates):
+            if query_filter:
+                lexical_points = self._lexical_search(query_text, candidates, query_filter=query_filter)
+                payloads.update({point.id: point.payload for point in lexical_points})
+                lexical_ids = [point.id for point in lexical_points]
+            else:
+                lexical_hits = self.lexical_index.search(query_text, limit=candidates)
+                lexical_ids = [stable_hash(node_id) for node_id, _, _ in lexical_hits]
+
+        fused = reciprocal_rank_fusion([[hit.id for hit in dense_hits], lexical_ids], k=rrf_k)
+        top_ids = sorted(fused, key=fused.get, reverse=True)[:limit]
+
+        missing = [point_id for point_id in top_ids if point_id not in payloads]
+        if missing:
+            for record in self.qdrant.retrieve(collection_name=self.collection_name, ids=missing):
+                payloads[record.id] = record.payload
+
+        # Ranked by the RRF score; the cosine score stays in "similarity" (None for lexical-only hits)
+        return [
+            models.ScoredPoint(
+                id=point_id,
+                version=0,
+                score=fused[point_id],
+                payload={**payloads[point_id], "similarity": similarities.get(point_id), "rrf_score": fused[point_id]}
             )
+            for point_id in top_ids
+            if point_id in payloads
+        ]
 
-            # Process results and get context
-            results = []
-            context_texts = []
+    @traced("chunk_store.neighbors")
+    def _fetch_nodes(
+            self,
+            keys: List[tuple],
+            known: Dict[tuple, Dict[str, Any]]
+    ) -> Dict[tuple, Dict[str, Any]]:
+        """Fetch (doc_id, node_idx) nodes missing from ``known``.
+
+        Node ids come from the documents' node lists in the chunk store and texts are read
+        from it in one batch; documents without a node list (still streaming, or indexed
+        before the chunk store) take one Qdrant call.
+        """
+        nodes = dict(known)
+        missing: Dict[str, List[int]] = {}
+        for doc_id, idx in keys:
+            if (doc_id, idx) not in nodes:
+                missing.setdefault(doc_id, []).append(idx)
+        if not missing:
+            return nodes
+
+        # Node lists of this host's chunk store may be stale when several hosts share the index
+        manifests = self.chunk_store.documents(missing) if self.chunk_texts == "local" else {}
+        wanted = {}
+        for doc_id, manifest in manifests.items():
+            for idx in missing[doc_id]:
+                if idx < len(manifest):
+                    wanted[(doc_id, idx)] = manifest[idx]
+        texts = self.chunk_store.get_many(node_id for node_id, _, _ in wanted.values())
+        for key, (node_id, start_char_idx, end_char_idx) in wanted.items():
+            if node_id in texts:
+                nodes[key] = {"text": texts[node_id], "start_char_idx": start_char_idx, "end_char_idx": end_char_idx}
+
+        missing = {doc_id: indexes for doc_id, indexes in missing.items() if doc_id not in manifests}
+        if not missing:
+            return nodes
+
+        records, _ = self.qdrant.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=models.Filter(should=[
+                models.Filter(must=[
+                    models.FieldCondition(key="doc_id", match=models.MatchValue(value=doc_id)),
+                    models.FieldCondition(key="metadata.node_info.index", match=models.MatchAny(any=indexes))
+                ])
+                for doc_id, indexes in missing.items()
+            ]),
+            limit=sum(len(indexes) for indexes in missing.values()),
+            with_payload=["doc_id", "node_id", "text", "metadata.node_info"],
+            with_vectors=False
+        )
+        for record in self._attach_texts(records):
+            node_info = record.payload["metadata"]["node_info"]
+            nodes[(record.payload["doc_id"], node_info["index"])] = {
+                "text": record.payload["text"],
+                "start_char_idx": node_info.get("start_char_idx"),
+                "end_char_idx": node_info.get("end_char_idx")
+            }
+        return nodes
 
-            for result in search_results:
-                node_info = result.payload["metadata"]["node_info"]
-                doc_id = result.payload["doc_id"]
-                node_idx = node_info["index"]
+    @traced()
+    def assemble_context(
+            self,
+            search_results: List[models.ScoredPoint],
+            context_window: int = 1,
+            token_budget: int = 4000,
+            include_hierarchy: bool = True
+    ) -> tuple:
+        """Build per-hit results and a deduplicated, token-budgeted context.
+
+        Node windows of hits from the same document are merged into contiguous spans so
+        shared neighbours appear once; spans are packed by score under ``token_budget``.
+        Returns (results, packed spans, stats).
+        """
+        hits = []
+        known = {}
+        for result in search_results:
+            node_info = result.payload["metadata"]["node_info"]
+            doc_id = result.payload["doc_id"]
+            known[(doc_id, node_info["index"])] = {
+                "text": result.payload["text"],
+                "start_char_idx": node_info.get("start_char_idx"),
+                "end_char_idx": node_info.get("end_char_idx")
+            }
+            hits.append({
+                "doc_id": doc_id,
+                "index": node_info["index"],
+                # Unknown while the document is still being streamed in
+                "total_nodes": node_info.get("total_nodes") or node_info["index"] + context_window + 1,
+                "score": result.score
+            })
+
+        spans = merge_windows(hits, context_window)
+        nodes = self._fetch_nodes(
+            [
+                (context_span["doc_id"], idx)
+                for context_span in spans
+                for idx in range(context_span["start"], context_span["end"] + 1)
+            ],
+            known
+        )
 
-                # Get surrounding context nodes
-                context_nodes = [result.payload["text"]]  # Start with current node
+        def window_text(doc_id: str, start: int, end: int) -> str:
+            return join_nodes([nodes[(doc_id, idx)] for idx in range(start, end + 1) if (doc_id, idx) in nodes])
 
-                # Get previous nodes
-                for i in range(max(0, node_idx - context_window), node_idx):
-                    prev_id = stable_hash(f"{doc_id}_node_{i}")
-                    prev_nodes = self.qdrant.retrieve(
-                        collection_name=self.collection_name,
-                        ids=[prev_id]
-                    )
-                    if prev_nodes:
-                        context_nodes.insert(0, prev_nodes[0].payload["text"])
-
-                # Get next nodes
-                total_nodes = node_info["total_nodes"]
-                for i in range(node_idx + 1, min(total_nodes, node_idx + context_window + 1)):
-                    next_id = stable_hash(f"{doc_id}_node_{i}")
-                    next_nodes = self.qdrant.retrieve(
-                        collection_name=self.collection_name,
-                        ids=[next_id]
-                    )
-                    if next_nodes:
-                        context_nodes.append(next_nodes[0].payload["text"])
+        for context_span in spans:
+            doc_id = context_span["doc_id"]
+            indices = [
+                idx for idx in range(context_span["start"], context_span["end"] + 1) if (doc_id, idx) in nodes
+            ]
+            context_span["text"], offsets = join_nodes_with_offsets([nodes[(doc_id, idx)] for idx in indices])
+            # Character range of the best hit, pack_spans trims around it when the span is too long
+            if context_span["hit"] in indices:
+                context_span["hit_chars"] = offsets[indices.index(context_span["hit"])]
+
+        results = []
+        for result, hit in zip(search_results, hits):
+            metadata, hierarchy = self._document_fields(hit["doc_id"], result.payload["metadata"])
+            result_dict = {
+                "text": result.payload["text"],
+                "context": window_text(
+                    hit["doc_id"],
+                    max(0, hit["index"] - context_window),
+                    min(hit["total_nodes"] - 1, hit["index"] + context_window)
+                ),
+                # Cosine similarity of the dense hit, None for lexical-only hits
+                "similarity": result.payload.get("similarity", result.score),
+                "metadata": metadata,
+                "node_info": result.payload["metadata"]["node_info"]
+            }
 
-                context = "\n".join(context_nodes)
+            if "rrf_score" in result.payload:
+                result_dict["rrf_score"] = result.payload["rrf_score"]
 
-                result_dict = {
-                    "text": result.payload["text"],
-                    "context": context,
-                    "similarity": result.score,
-                    "metadata": result.payload["metadata"],
-                    "node_info": node_info
-                }
+            if include_hierarchy:
+                result_dict["hierarchy_info"] = hierarchy
+
+            results.append(result_dict)
+
+        packed, stats = pack_spans(spans, token_budget)
+        return results, packed, stats
+
+    @traced()
+    def query(
+            self,
+            query_text: str,
+            similarity_threshold: float = 0.0,
+            include_hierarchy: bool = True,
+            limit: int = 10,
+            context_window: int = 1,  # Количество соседних нодов для контекста
+            retrieval_mode: str = "hybrid",
+            token_budget: Optional[int] = None,
+            query_filter: Optional[models.Filter] = None,
+            search_strategy: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Query using hybrid lexical + vector search with node context.
 
-                if include_hierarchy:
-                    result_dict["hierarchy_info"] = result.payload["hierarchy"]
+        ``search_strategy`` is "flat" or "two_stage" (see search), SEARCH_STRATEGY by default.
+        Identical concurrent queries are answered by one search and one LLM call.
+        Raises UpstreamUnavailable when Claude, TEI or Qdrant keep failing.
+        """
+        search_strategy = search_strategy or settings.SEARCH_STRATEGY
+        key = (
+            query_text, similarity_threshold, include_hierarchy, limit, context_window,
+            retrieval_mode, token_budget, repr(query_filter), search_strategy
+        )
+        return self._query_flights.do(
+            key,
+            lambda: self._query(
+                query_text, similarity_threshold, include_hierarchy, limit, context_window,
+                retrieval_mode, token_budget, query_filter, search_strategy
+            ),
+            on_shared=upstream_limiter("llm").record_coalesced
+        )
 
-                results.append(result_dict)
-                context_texts.append(context)
+    def _query(
+            self,
+            query_text: str,
+            similarity_threshold: float,
+            include_hierarchy: bool,
+            limit: int,
+            context_window: int,
+            retrieval_mode: str,
+            token_budget: Optional[int],
+            query_filter: Optional[models.Filter],
+            search_strategy: str
+    ) -> Dict[str, Any]:
+        try:
+            logger.error(query_text)
+            search_results = self.search(
+                query_text,
+                similarity_threshold=similarity_threshold,
+                limit=limit,
+                mode=retrieval_mode,
+                query_filter=query_filter,
+                strategy=search_strategy
+            )
+
+            results, context_spans, context_stats = self.assemble_context(
+                search_results,
+                context_window=context_window,
+                token_budget=token_budget if token_budget is not None else settings.CONTEXT_TOKEN_BUDGET,
+                include_hierarchy=include_hierarchy
+            )
 
             # Generate response using context from nodes
+            context_text = "\n\n".join(context_span["text"] for context_span in context_spans)
             prompt = f"""Based on the following context, answer the question: {query_text}
 
             Context:
-            {' '.join(context_texts)}
+            {context_text}
             """
-            response = self.llm.complete(prompt)
+            response_text = self.llm_gateway.complete(prompt, call_site="query")
 
             return {
-                "response": str(response.text),
+                "response": response_text,
                 "sources": results,
-                "total_sources": len(results)
+                "total_sources": len(results),
+                "context_stats": context_stats
             }
 
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             logger.exception(e)
             print(f"Error in query processing: {str(e)}")
@@ -785,6 +1800,105 @@ class DocumentProcessor:
                 "total_sources": 0
             }
 
+    def _mmr(
+            self,
+            documents: List[Dict[str, Any]],
+            vectors: Dict[Any, List[float]],
+            diversity: float,
+            limit: int
+    ) -> List[Dict[str, Any]]:
+        """Maximal marginal relevance re-ranking over the best-hit vector of each document"""
+        candidates = [doc for doc in documents if doc["point_id"] in vectors]
+        if not candidates:
+            return documents[:limit]
+
+        matrix = np.array([vectors[doc["point_id"]] for doc in candidates], dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+        similarity = matrix @ matrix.T
+
+        relevance = np.array([doc["score"] for doc in candidates], dtype=np.float32)
+        relevance /= relevance.max() or 1.0
+
+        selected: List[int] = []
+        remaining = list(range(len(candidates)))
+        while remaining and len(selected) < limit:
+            if selected:
+                redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining), dtype=np.float32)
+            mmr_scores = (1 - diversity) * relevance[remaining] - diversity * redundancy
+            best = remaining[int(np.argmax(mmr_scores))]
+            selected.append(best)
+            remaining.remove(best)
+
+        return [candidates[i] for i in selected]
+
+    @traced()
+    def retrieve_documents(
+            self,
+            query_text: str,
+            limit: int = 10,
+            similarity_threshold: float = 0.0,
+            retrieval_mode: str = "hybrid",
+            aggregate: str = "max",
+            diversity: Optional[float] = None,
+            candidates_per_document: int = 3,
+            query_filter: Optional[models.Filter] = None,
+            search_strategy: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Retrieval only: rank documents (not chunks) without calling the LLM.
+
+        Chunk hits are grouped by doc_id and scored by the best ("max") or summed ("sum")
+        chunk score. With ``diversity`` in (0, 1] an MMR pass trades relevance for documents
+        that are less similar to the ones already selected.
+        """
+        hits = self.search(
+            query_text,
+            similarity_threshold=similarity_threshold,
+            limit=limit * candidates_per_document,
+            mode=retrieval_mode,
+            query_filter=query_filter,
+            strategy=search_strategy
+        )
+
+        documents: Dict[str, Dict[str, Any]] = {}
+        for hit in hits:
+            doc_id = hit.payload["doc_id"]
+            doc = documents.get(doc_id)
+            if doc is None:
+                metadata, hierarchy = self._document_fields(doc_id, hit.payload["metadata"])
+                documents[doc_id] = {
+                    "doc_id": doc_id,
+                    "file_name": hit.payload["metadata"].get("file_name", ""),
+                    "score": hit.score,
+                    "best_score": hit.score,
+                    "snippet": hit.payload["text"][:SNIPPET_CHARS],
+                    "point_id": hit.id,
+                    "metadata": metadata,
+                    "hierarchy_info": hierarchy
+                }
+                continue
+
+            doc["score"] = doc["score"] + hit.score if aggregate == "sum" else max(doc["score"], hit.score)
+            if hit.score > doc["best_score"]:
+                doc.update(best_score=hit.score, snippet=hit.payload["text"][:SNIPPET_CHARS], point_id=hit.id)
+
+        ranked = sorted(documents.values(), key=lambda doc: doc["score"], reverse=True)
+
+        if diversity:
+            records = self.qdrant.retrieve(
+                collection_name=self.collection_name,
+                ids=[doc["point_id"] for doc in ranked],
+                with_payload=False,
+                with_vectors=True
+            )
+            ranked = self._mmr(ranked, {record.id: record.vector for record in records}, diversity, limit)
+
+        return [
+            {key: doc[key] for key in ("doc_id", "file_name", "score", "snippet", "metadata", "hierarchy_info")}
+            for doc in ranked[:limit]
+        ]
+
     def process_directory(self, directory_path: str) -> None:
         """Process all documents in a directory"""
         documents = self.load_documents(directory_path)
@@ -794,8 +1908,117 @@ class DocumentProcessor:
         else:
             print("No documents were loaded")
 
+    @traced()
+    def reindex(self, source_dir: Path = settings.UPLOAD_DIR, keep_old: bool = False) -> str:
+        """Rebuild all vectors into a new versioned collection and switch the alias to it.
+
+        The API keeps serving from the current collection while the new one is built;
+        summaries and hierarchy are reused from state, so no LLM calls are needed for
+        documents that are already known. The summary collection is rebuilt the same way.
+
+        Uploads, deletes and moves that reach the old collection during the rebuild (from
+        any worker) are replayed before the switch: with this worker's ingests paused,
+        files written since the start are ingested again, files that disappeared are
+        deleted and changed folder paths are copied. Returns the new collection name.
+        """
+        new_collection = versioned_collection_name(self.collection_name)
+        new_summary_collection = versioned_collection_name(self.summary_collection_name)
+        create_collection(self.qdrant, new_collection)
+        create_collection(self.qdrant, new_summary_collection)
+        print(f"Reindexing {source_dir} into {new_collection}")
+
+        started = time.time()
+        doc_paths = sorted(path for path in Path(source_dir).iterdir() if path.is_file())
+        folder_paths = self.stored_folder_paths()
+
+        try:
+            total_points = self._reindex_into(new_collection, doc_paths, folder_paths, new_summary_collection)
+            with self._ingest_lock:
+                total_points += self._replay_changes(
+                    Path(source_dir), started, doc_paths, folder_paths, new_collection, new_summary_collection
+                )
+                for alias, collection_name in (
+                        (self.collection_name, new_collection),
+                        (self.summary_collection_name, new_summary_collection)
+                ):
+                    previous = switch_alias(self.qdrant, alias, collection_name)
+                    if previous and not keep_old:
+                        self.qdrant.delete_collection(collection_name=previous)
+        except Exception:
+            self.qdrant.delete_collection(collection_name=new_collection)
+            self.qdrant.delete_collection(collection_name=new_summary_collection)
+            raise
+
+        # Centroids were recomputed from the new vectors
+        self.link_documents(list(self.doc_vectors.ids))
+        self.save_state()
+        print(f"Reindexed {len(doc_paths)} files ({total_points} nodes), alias {self.collection_name} -> {new_collection}")
+        return new_collection
+
+    def _replay_changes(
+            self,
+            source_dir: Path,
+            started: float,
+            doc_paths: List[Path],
+            folder_paths: Dict[str, List[int]],
+            collection_name: str,
+            summary_collection_name: str
+    ) -> int:
+        """Bring a collection built by reindex up to date with what the old one got meanwhile"""
+        changed = sorted(
+            path for path in source_dir.iterdir() if path.is_file() and path.stat().st_mtime >= started
+        )
+        total_points = self._reindex_into(
+            collection_name, changed, self.stored_folder_paths(), summary_collection_name
+        ) if changed else 0
+
+        removed = [path.stem for path in doc_paths if not path.exists()]
+        if removed:
+            for name in (collection_name, summary_collection_name):
+                self.qdrant.delete(collection_name=name, points_selector=self._doc_selector(removed))
+
+        moved = {
+            doc_id: folder_path
+            for doc_id, folder_path in self.stored_folder_paths().items()
+            if folder_paths.get(doc_id) != folder_path
+        }
+        self.set_folder_paths(moved, collection_names=(collection_name, summary_collection_name))
+
+        print(f"Replayed {len(changed)} changed, {len(removed)} deleted and {len(moved)} moved files")
+        return total_points
+
+    def _reindex_into(
+            self,
+            collection_name: str,
+            doc_paths: List[Path],
+            folder_paths: Optional[Dict[str, List[int]]] = None,
+            summary_collection_name: Optional[str] = None
+    ) -> int:
+        folder_paths = folder_paths or {}
+        total_points = 0
+        for i in range(0, len(doc_paths), EMBED_BATCH_SIZE):
+            entries = []
+            for doc_path in doc_paths[i:i + EMBED_BATCH_SIZE]:
+                try:
+                    document = self.load_doc(str(doc_path))
+                except Exception as e:
+                    print(f"Skipping {doc_path}: {str(e)}")
+                    continue
+                entries.append((document, doc_path, folder_paths.get(document.doc_id)))
+
+            counts = self.ingest_stream(entries, collection_name=collection_name)
+            total_points += sum(counts.values())
+            if summary_collection_name:
+                self.index_summaries(
+                    {document.doc_id: self.summary_payload(document, folder_path) for document, _, folder_path in entries},
+                    collection_name=summary_collection_name
+                )
+
+        return total_points
+
     def get_hierarchy_json(self) -> str:
         """Get the document hierarchy as JSON string"""
+        self.refresh_state()
         return json.dumps({
             "hierarchy": self.document_hierarchy,
             "summaries": self.document_summaries
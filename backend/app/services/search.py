@@ -1,26 +1,120 @@
-from typing import Dict, List
+from datetime import date
+from typing import TYPE_CHECKING, Dict, List, Optional
+from app.core.tracing import run_in_thread, traced
 from app.repositories.document import DocumentRepository
-from app.services.rag import DocumentProcessor
 from app.models.document import Document
 
+if TYPE_CHECKING:
+    from app.services.rag import DocumentProcessor
+
 
 class SearchService:
-    def __init__(self, document_processor: DocumentProcessor):
+    def __init__(self, document_processor: "DocumentProcessor", repository: Optional[DocumentRepository] = None):
         self.processor = document_processor
+        self.repository = repository
+
+    @traced()
+    async def _rows_by_file_name(self, file_names: List[str]) -> Dict[str, Document]:
+        """Map RAG file names (stored as download_url) back to document rows"""
+        if self.repository is None:
+            return {}
+        rows = await self.repository.get_by_download_urls(list(set(file_names)))
+        return {row.download_url: row for row in rows}
+
+    @traced()
+    async def search_documents(
+            self,
+            query: str,
+            retrieval: str = "hybrid",
+            mode: str = "answer",
+            aggregate: str = "max",
+            diversity: Optional[float] = None,
+            limit: int = 10,
+            folder_id: Optional[int] = None,
+            file_types: Optional[List[str]] = None,
+            date_from: Optional[date] = None,
+            date_to: Optional[date] = None,
+            include_metadata: bool = False,
+            strategy: Optional[str] = None
+    ) -> Dict:
+        from app.services.collections import search_filter
+
+        query_filter = search_filter(folder_id, file_types, date_from, date_to)
+        if mode == "retrieve":
+            return await self.retrieve_documents(
+                query, retrieval, aggregate, diversity, limit, query_filter, include_metadata, strategy
+            )
+
+        # The processor blocks on Claude/TEI/Qdrant; keep the event loop free while it waits
+        res = await run_in_thread(
+            self.processor.query,
+            query,
+            retrieval_mode=retrieval,
+            limit=limit,
+            query_filter=query_filter,
+            include_hierarchy=include_metadata,
+            search_strategy=strategy
+        )
+        rows = await self._rows_by_file_name([doc["metadata"].get("file_name", "") for doc in res["sources"]])
 
-    async def search_documents(self, query: str) -> Dict:
-        # Here you would implement your semantic search logic
-        # This is a basic implementation
-        res = self.processor.query(query)
+        documents = []
+        for doc in res["sources"]:
+            row = rows.get(doc["metadata"].get("file_name", ""))
+            document = {
+                "id": row.id if row else None,
+                "parent": row.parent_id if row else None,
+                "doc_id": doc["metadata"]["doc_id"],
+                "subcontent": doc["metadata"]["summary"]
+            }
+            if include_metadata:
+                document.update(metadata=doc["metadata"], hierarchy_info=doc.get("hierarchy_info", {}))
+            documents.append(document)
 
-        print(res["sources"][0])
         return {
             "answer": res["response"],
-            "documents": [
-                {
-                    "id": doc["text"],
-                    "subcontent": doc["metadata"]["summary"]
-                }
-                for doc in res["sources"]
-            ]
+            "documents": documents
+        }
+
+    @traced()
+    async def retrieve_documents(
+            self,
+            query: str,
+            retrieval: str = "hybrid",
+            aggregate: str = "max",
+            diversity: Optional[float] = None,
+            limit: int = 10,
+            query_filter=None,
+            include_metadata: bool = False,
+            strategy: Optional[str] = None
+    ) -> Dict:
+        """Ranked matching documents without answer generation"""
+        hits = await run_in_thread(
+            self.processor.retrieve_documents,
+            query,
+            limit=limit,
+            retrieval_mode=retrieval,
+            aggregate=aggregate,
+            diversity=diversity,
+            query_filter=query_filter,
+            search_strategy=strategy
+        )
+        rows = await self._rows_by_file_name([hit["file_name"] for hit in hits])
+
+        documents = []
+        for hit in hits:
+            row = rows.get(hit["file_name"])
+            document = {
+                "id": row.id if row else None,
+                "parent": row.parent_id if row else None,
+                "doc_id": hit["doc_id"],
+                "score": hit["score"],
+                "subcontent": hit["snippet"]
+            }
+            if include_metadata:
+                document.update(metadata=hit["metadata"], hierarchy_info=hit["hierarchy_info"])
+            documents.append(document)
+
+        return {
+            "answer": None,
+            "documents": documents
         }
@@ -0,0 +1,282 @@
+import fcntl
+import logging
+import os
+import select
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.core.serialization import dumps, loads
+
+
+logger = logging.getLogger(__name__)
+
+# doc_id -> (summary, hierarchy entry); either may be None
+Entries = Dict[str, Tuple[Optional[str], Optional[Dict[str, Any]]]]
+
+
+def _merge_list(base: List[Any], ours: List[Any], theirs: List[Any]) -> List[Any]:
+    removed = [item for item in base if item not in ours]
+    added = [item for item in ours if item not in base]
+    return [item for item in theirs if item not in removed] + [item for item in added if item not in theirs]
+
+
+def _merge_dict(base: Dict[str, Any], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    merged = {key: value for key, value in theirs.items() if key in ours or key not in base}
+    merged.update({key: value for key, value in ours.items() if base.get(key) != value})
+    return merged
+
+
+def merge_entry(base: Optional[Dict[str, Any]], ours: Dict[str, Any], theirs: Dict[str, Any]) -> Dict[str, Any]:
+    """Three-way merge of a hierarchy entry: our field changes applied on top of theirs.
+
+    List and dict fields (children, relationships, similarity_scores) merge by element,
+    so two workers adding links to the same document both keep theirs.
+    """
+    if base is None:
+        return ours
+    merged = dict(theirs)
+    for key, value in ours.items():
+        base_value = base.get(key)
+        if value == base_value:
+            continue
+        their_value = theirs.get(key)
+        if isinstance(value, list) and isinstance(base_value, list) and isinstance(their_value, list):
+            merged[key] = _merge_list(base_value, value, their_value)
+        elif isinstance(value, dict) and isinstance(base_value, dict) and isinstance(their_value, dict):
+            merged[key] = _merge_dict(base_value, value, their_value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def merge_states(
+        base: Dict[str, Any],
+        ours: Dict[str, Any],
+        theirs: Dict[str, Any],
+        merge_value: Callable[[Any, Any, Any], Any]
+) -> Dict[str, Any]:
+    """Apply our changes since ``base`` to ``theirs``; a remote delete wins over a local edit"""
+    result = dict(theirs)
+    for key in set(base) | set(ours):
+        base_value = base.get(key)
+        our_value = ours.get(key)
+        if our_value == base_value:
+            continue
+        if our_value is None:
+            result.pop(key, None)
+        elif key in theirs:
+            result[key] = merge_value(base_value, our_value, theirs[key])
+        elif base_value is None:
+            result[key] = our_value
+    return result
+
+
+class FileStateStore:
+    """State in one JSON file (the original layout plus a version counter).
+
+    A lock file serializes writers, so several workers on one host are safe; other
+    hosts need the Postgres store.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._cached_mtime = None
+        self._cached_version = 0
+
+    def _read(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {}
+        with open(self.path, 'rb') as f:
+            return loads(f.read())
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def version(self) -> int:
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        if mtime != self._cached_mtime:
+            self._cached_version = self._read().get("version", 0)
+            self._cached_mtime = mtime
+        return self._cached_version
+
+    def load(self, since_version: int) -> Optional[Tuple[int, Entries, Set[str]]]:
+        """(version, changed entries, all doc ids), or None if nothing changed since ``since_version``"""
+        state = self._read()
+        version = state.get("version", 0)
+        if state and version <= since_version:
+            return None
+        summaries = state.get("summaries", {})
+        hierarchy = state.get("hierarchy", {})
+        doc_ids = set(summaries) | set(hierarchy)
+        return version, {doc_id: (summaries.get(doc_id), hierarchy.get(doc_id)) for doc_id in doc_ids}, doc_ids
+
+    def write(
+            self,
+            summaries: Dict[str, str],
+            hierarchy: Dict[str, Any],
+            upserts: Entries,
+            deletes: List[str]
+    ) -> int:
+        version = self._read().get("version", 0) + 1
+        state = {
+            'summaries': summaries,
+            'hierarchy': hierarchy,
+            'last_updated': datetime.now().isoformat(),
+            'version': version
+        }
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(dumps(state))
+        os.replace(tmp_path, self.path)
+        return version
+
+    def close(self) -> None:
+        pass
+
+
+def _sync_dsn(database_url: str) -> str:
+    """psycopg2 DSN from the async SQLAlchemy URL"""
+    return database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+class PostgresStateStore:
+    """State as one row per document in Postgres (tables from the rag_state migration).
+
+    Writers serialize on an advisory transaction lock and bump a global version; rows
+    carry the version that last wrote them, so readers fetch only what changed. Every
+    commit sends NOTIFY rag_state, which a listener thread turns into the known remote
+    version so readers can skip the version query.
+    """
+
+    LOCK_KEY = 0x5241475354415445  # "RAGSTATE"
+    CHANNEL = "rag_state"
+
+    def __init__(self, dsn: str):
+        import psycopg2
+
+        self._psycopg2 = psycopg2
+        self.dsn = dsn
+        self.conn = psycopg2.connect(dsn)
+        self._notified_version: Optional[int] = None
+        self._closed = threading.Event()
+        self._listener = threading.Thread(target=self._listen, name="rag-state-listener", daemon=True)
+        self._listener.start()
+
+    def _listen(self) -> None:
+        while not self._closed.is_set():
+            try:
+                conn = self._psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.CHANNEL}")
+                    cur.execute("SELECT version FROM rag_state WHERE id = 1")
+                    row = cur.fetchone()
+                    self._notified_version = row[0] if row else 0
+                while not self._closed.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._notified_version = max(self._notified_version or 0, int(notify.payload))
+                conn.close()
+            except Exception as e:
+                logger.warning("State listener disconnected: %s", e)
+                self._notified_version = None
+                time.sleep(5)
+
+    @contextmanager
+    def lock(self) -> Iterator[None]:
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (self.LOCK_KEY,))
+            yield
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def version(self) -> int:
+        if self._notified_version is not None:
+            return self._notified_version
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT version FROM rag_state WHERE id = 1")
+            row = cur.fetchone()
+        self.conn.commit()
+        return row[0] if row else 0
+
+    def load(self, since_version: int) -> Optional[Tuple[int, Entries, Set[str]]]:
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT version FROM rag_state WHERE id = 1")
+            row = cur.fetchone()
+            version = row[0] if row else 0
+            if version <= since_version:
+                return None
+            cur.execute(
+                "SELECT doc_id, summary, hierarchy FROM rag_documents WHERE version > %s",
+                (since_version,)
+            )
+            entries = {
+                doc_id: (summary, loads(hierarchy) if isinstance(hierarchy, str) else hierarchy)
+                for doc_id, summary, hierarchy in cur.fetchall()
+            }
+            cur.execute("SELECT doc_id FROM rag_documents")
+            doc_ids = {row[0] for row in cur.fetchall()}
+        return version, entries, doc_ids
+
+    def write(
+            self,
+            summaries: Dict[str, str],
+            hierarchy: Dict[str, Any],
+            upserts: Entries,
+            deletes: List[str]
+    ) -> int:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "INSERT INTO rag_state (id, version) VALUES (1, 1) "
+                "ON CONFLICT (id) DO UPDATE SET version = rag_state.version + 1 RETURNING version"
+            )
+            version = cur.fetchone()[0]
+            if upserts:
+                cur.executemany(
+                    "INSERT INTO rag_documents (doc_id, summary, hierarchy, version, updated_at) "
+                    "VALUES (%s, %s, %s, %s, now()) "
+                    "ON CONFLICT (doc_id) DO UPDATE SET summary = EXCLUDED.summary, "
+                    "hierarchy = EXCLUDED.hierarchy, version = EXCLUDED.version, updated_at = now()",
+                    [
+                        (doc_id, summary, dumps(entry).decode() if entry is not None else None, version)
+                        for doc_id, (summary, entry) in upserts.items()
+                    ]
+                )
+            if deletes:
+                cur.execute("DELETE FROM rag_documents WHERE doc_id = ANY(%s)", (list(deletes),))
+            # Delivered to listeners when the transaction commits
+            cur.execute("SELECT pg_notify(%s, %s)", (self.CHANNEL, str(version)))
+        return version
+
+    def close(self) -> None:
+        self._closed.set()
+        self.conn.close()
+
+
+def build_state_store(state_file: Path):
+    if settings.STATE_BACKEND == "postgres":
+        return PostgresStateStore(_sync_dsn(settings.DATABASE_URL))
+    if settings.STATE_BACKEND != "file":
+        raise ValueError(f"Unsupported STATE_BACKEND: {settings.STATE_BACKEND}")
+    return FileStateStore(state_file)
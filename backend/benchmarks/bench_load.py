@@ -0,0 +1,349 @@
+"""Load test of one backend instance over the real HTTP stack.
+
+Starts the stand-ins for TEI and Anthropic (benchmarks.upstream_stubs), runs the app
+under uvicorn against them with embedded Qdrant and SQLite in a scratch directory,
+seeds a few folders and documents, then sweeps the number of concurrent clients.
+Every client loops over a weighted mix of uploads, folder listings, searches and
+graph fetches for ``--duration`` seconds per level:
+
+    python -m benchmarks.bench_load --concurrency 1 2 4 8 16 32 --duration 30
+    python -m benchmarks.bench_load --mix search=6 list_folder=3 graph=1 --llm-latency-ms 800
+    python -m benchmarks.bench_load --url http://localhost:8000   # an already running instance
+
+Throughput, p50/p95/p99 latency and the error rate per endpoint and level are written to
+benchmarks/results/load_<timestamp>_<commit>.json and .csv. The saturation point is the
+last level before throughput stops growing by at least ``--min-gain`` or errors appear.
+SQLite serializes writes, so use ``--database-url`` (a migrated Postgres) and
+``--qdrant-url`` for numbers comparable with production; several ``--workers`` need both.
+Needs httpx and aiosqlite.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from benchmarks.bench_rag import RESULTS_DIR, git_commit
+from benchmarks.corpus import VOCABULARY, make_text
+from benchmarks.upstream_stubs import start_stubs
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+DEFAULT_MIX = {"upload": 1, "list_folder": 3, "search": 4, "search_answer": 1, "graph": 1}
+
+
+class Workload:
+    """Requests of the mix; shared by all clients of a run"""
+
+    def __init__(self, client, folder_ids: List[int], rng: random.Random, words_per_doc: int):
+        self.client = client
+        self.folder_ids = folder_ids
+        self.rng = rng
+        self.words_per_doc = words_per_doc
+        self.uploads = 0
+
+    def query(self) -> str:
+        return " ".join(self.rng.sample(VOCABULARY, 3))
+
+    async def upload(self):
+        self.uploads += 1
+        name = f"load_{os.getpid()}_{self.uploads:06d}.txt"
+        return await self.client.post(
+            "/v1/documents/",
+            params={"parent_id": self.rng.choice(self.folder_ids)},
+            files={"file": (name, make_text(self.rng, self.words_per_doc).encode("utf-8"), "text/plain")},
+        )
+
+    async def list_folder(self):
+        return await self.client.get(f"/v1/documents/{self.rng.choice(self.folder_ids + ['root'])}")
+
+    async def search(self):
+        return await self.client.get("/v1/search/", params={"query": self.query(), "mode": "retrieve"})
+
+    async def search_answer(self):
+        return await self.client.get("/v1/search/", params={"query": self.query(), "mode": "answer", "limit": 5})
+
+    async def graph(self):
+        return await self.client.get("/v1/graph/")
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted ``values``"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def summarize(samples: List[tuple], elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = Counter(status for _, status in samples)
+    errors = sum(count for status, count in statuses.items() if status == "error" or int(status) >= 400)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "throughput_rps": len(samples) / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.mean(latencies) if latencies else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1] if latencies else 0.0,
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+async def run_level(
+        workload: Workload,
+        mix: Dict[str, float],
+        concurrency: int,
+        duration: float
+) -> Dict[str, Any]:
+    """``concurrency`` closed-loop clients for ``duration`` seconds"""
+    samples: Dict[str, List[tuple]] = defaultdict(list)
+    operations, weights = list(mix), list(mix.values())
+    deadline = time.perf_counter() + duration
+
+    async def client_loop() -> None:
+        while time.perf_counter() < deadline:
+            operation = workload.rng.choices(operations, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(workload, operation)()
+                status = response.status_code
+            except Exception:
+                status = "error"
+            samples[operation].append(((time.perf_counter() - start) * 1000, status))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    endpoints = {operation: summarize(samples[operation], elapsed) for operation in operations if samples[operation]}
+    endpoints["all"] = summarize([sample for values in samples.values() for sample in values], elapsed)
+    return {"concurrency": concurrency, "elapsed_s": elapsed, "endpoints": endpoints}
+
+
+def find_saturation(levels: List[Dict[str, Any]], min_gain: float, max_error_rate: float) -> Optional[int]:
+    """Last concurrency before throughput gains fall below ``min_gain`` or errors exceed the limit"""
+    previous = None
+    for level in levels:
+        overall = level["endpoints"]["all"]
+        if overall["error_rate"] > max_error_rate:
+            return previous["concurrency"] if previous else level["concurrency"]
+        if previous and overall["throughput_rps"] < previous["endpoints"]["all"]["throughput_rps"] * (1 + min_gain):
+            return previous["concurrency"]
+        previous = level
+    return None
+
+
+async def seed(workload: Workload, folders: int, documents: int) -> None:
+    for idx in range(folders):
+        response = await workload.client.post("/v1/documents/create_folder/", json={"name": f"load folder {idx}"})
+        response.raise_for_status()
+        workload.folder_ids.append(response.json()["id"])
+    for _ in range(documents):
+        (await workload.upload()).raise_for_status()
+
+
+async def run(args, base_url: str) -> List[Dict[str, Any]]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=max(args.concurrency) + 8, max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        workload = Workload(client, [], random.Random(args.seed), args.words_per_doc)
+        print(f"Seeding {args.folders} folders and {args.seed_documents} documents...")
+        await seed(workload, args.folders, args.seed_documents)
+
+        levels = []
+        for concurrency in args.concurrency:
+            if args.warmup:
+                await run_level(workload, args.mix, concurrency, args.warmup)
+            level = await run_level(workload, args.mix, concurrency, args.duration)
+            overall = level["endpoints"]["all"]
+            print(
+                f"c={concurrency:<4d} {overall['throughput_rps']:8.1f} req/s  p50 {overall['p50_ms']:8.1f} ms  "
+                f"p95 {overall['p95_ms']:8.1f} ms  p99 {overall['p99_ms']:8.1f} ms  errors {overall['error_rate']:.1%}"
+            )
+            levels.append(level)
+        return levels
+
+
+def prepare_database(database_url: str) -> None:
+    """Create the tables in a scratch SQLite database; other databases are expected to be migrated"""
+    if not database_url.startswith("sqlite"):
+        return
+
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from app.models.document import Base
+
+    async def create() -> None:
+        engine = create_async_engine(database_url)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await engine.dispose()
+
+    asyncio.run(create())
+
+
+def start_server(args, workdir: Path, log_file) -> tuple:
+    """uvicorn with the app configured against the stand-ins; returns (process, base_url, stubs)"""
+    tei, anthropic = start_stubs(
+        dim=args.vector_size, tei_latency_ms=args.tei_latency_ms, llm_latency_ms=args.llm_latency_ms
+    )
+    database_url = args.database_url or f"sqlite+aiosqlite:///{workdir / 'load.db'}"
+    prepare_database(database_url)
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(BACKEND_DIR), os.environ.get("PYTHONPATH")])),
+        "DATABASE_URL": database_url,
+        "LLM_BACKEND": "anthropic",
+        "ANTHROPIC_API_KEY": "loadtest",
+        "ANTHROPIC_BASE_URL": anthropic.url,
+        "EMBEDDING_BACKEND": "tei",
+        "TEI_BASE_URL": tei.url,
+        "QDRANT_VECTOR_SIZE": str(args.vector_size),
+        "QDRANT_COLLECTION": f"load_{int(time.time())}",
+        # Every request should reach the upstream stand-ins
+        "LLM_CACHE_ENABLED": "false",
+        "TRACE_EXPORTER": "none",
+        "GC_INTERVAL_SECONDS": "0",
+    }
+    if args.qdrant_url:
+        env["QDRANT_URL"] = args.qdrant_url
+    else:
+        env["QDRANT_PATH"] = str(workdir / "qdrant")
+
+    port = args.port
+    # The app keeps uploads and its storage relative to the working directory
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--no-access-log"],
+        cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_ready(process, base_url)
+    return process, base_url, (tei, anthropic)
+
+
+def wait_ready(process: subprocess.Popen, base_url: str, timeout: float = 120) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {process.returncode}, see the server log")
+        try:
+            if httpx.get(f"{base_url}/v1/upstream/stats/", timeout=2).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{base_url} did not become ready in {timeout:.0f} s")
+
+
+def parse_mix(items: Optional[List[str]]) -> Dict[str, float]:
+    if not items:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in items:
+        operation, _, weight = item.partition("=")
+        if operation not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {operation!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+def write_results(report: Dict[str, Any], output: Path) -> None:
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.with_suffix(".json").write_text(json.dumps(report, indent=2))
+
+    columns = ["concurrency", "endpoint", "requests", "errors", "error_rate", "throughput_rps",
+               "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+    with output.with_suffix(".csv").open("w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        for level in report["levels"]:
+            for endpoint, values in level["endpoints"].items():
+                writer.writerow({"concurrency": level["concurrency"], "endpoint": endpoint, **values})
+    print(f"Results written to {output.with_suffix('.json')} and {output.with_suffix('.csv')}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=20, help="Seconds measured per concurrency level")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before each level")
+    parser.add_argument("--mix", nargs="+", metavar="OPERATION=WEIGHT",
+                        help=f"Workload weights, default {' '.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())}")
+    parser.add_argument("--folders", type=int, default=5)
+    parser.add_argument("--seed-documents", type=int, default=20)
+    parser.add_argument("--words-per-doc", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--min-gain", type=float, default=0.1, help="Throughput growth that still counts as scaling")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--url", help="Load an already running instance instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--database-url", help="Migrated database (default: scratch SQLite)")
+    parser.add_argument("--qdrant-url", help="Qdrant server (default: embedded Qdrant in the scratch directory)")
+    parser.add_argument("--vector-size", type=int, default=384)
+    parser.add_argument("--tei-latency-ms", type=float, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--output", type=Path, help="Result path without extension")
+    args = parser.parse_args()
+    try:
+        args.mix = parse_mix(args.mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args.workers > 1 and not args.url and not (args.qdrant_url and args.database_url):
+        parser.error("--workers > 1 needs --qdrant-url and --database-url (embedded Qdrant and SQLite are per process)")
+
+    process = None
+    with tempfile.TemporaryDirectory(prefix="bench_load_") as workdir:
+        log_path = Path(workdir) / "server.log"
+        with log_path.open("w") as log_file:
+            try:
+                if args.url:
+                    base_url = args.url.rstrip("/")
+                else:
+                    process, base_url, _ = start_server(args, Path(workdir), log_file)
+                levels = asyncio.run(run(args, base_url))
+            except Exception:
+                log_file.flush()
+                print("Server log tail:\n" + "".join(log_path.read_text().splitlines(keepends=True)[-30:]))
+                raise
+            finally:
+                if process is not None:
+                    process.terminate()
+                    process.wait(timeout=30)
+
+    saturation = find_saturation(levels, args.min_gain, args.max_error_rate)
+    print(f"Saturation point: {saturation if saturation is not None else 'not reached'} concurrent clients")
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "saturation_concurrency": saturation,
+        "levels": levels,
+    }
+    write_results(report, args.output or RESULTS_DIR / f"load_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Micro-benchmarks for the RAG hot paths.
+
+Runs fully offline (stub LLM, hashing embedder, in-memory Qdrant) on synthetic corpora:
+
+    python -m benchmarks.bench_rag --sizes 10 1000 10000
+    python -m benchmarks.bench_rag --compare benchmarks/results/<older>.json
+
+Results are written to benchmarks/results/<timestamp>_<commit>.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("EMBEDDING_BACKEND", "hashing")
+os.environ.setdefault("QDRANT_URL", ":memory:")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="bench_upload_"))
+
+from benchmarks.corpus import make_corpus, make_hierarchy  # noqa: E402
+
+RESULTS_DIR = Path(__file__).parent / "results"
+QUERY_LIMITS = [5, 10, 20]
+CONTEXT_WINDOWS = [0, 1, 2]
+SEARCH_STRATEGIES = ["flat", "two_stage"]
+BENCH_QUERY = "attention translation supplier contract"
+
+
+def timed(fn: Callable[[], Any], repeat: int = 5) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": statistics.mean(samples),
+        "min_ms": min(samples),
+        "max_ms": max(samples),
+    }
+
+
+def random_vectors(count: int, dim: int, seed: int = 7) -> List[List[float]]:
+    rng = random.Random(seed)
+    vectors = []
+    for _ in range(count):
+        vector = [rng.gauss(0, 1) for _ in range(dim)]
+        norm = sum(value * value for value in vector) ** 0.5
+        vectors.append([value / norm for value in vector])
+    return vectors
+
+
+def make_processor(persist_dir: str):
+    from app.services.rag import DocumentProcessor
+
+    return DocumentProcessor(persist_dir=persist_dir, collection_name=f"bench_{time.time_ns()}")
+
+
+def make_documents(size: int):
+    from llama_index.core import Document
+
+    return [
+        Document(
+            text=item["text"],
+            doc_id=item["doc_id"],
+            metadata={"doc_id": item["doc_id"], "file_name": f"{item['doc_id']}.txt", "file_type": "text/plain"}
+        )
+        for item in make_corpus(size)
+    ]
+
+
+def bench_chunking(processor, documents) -> Dict[str, Any]:
+    total_chars = sum(len(doc.text) for doc in documents)
+    timing = timed(lambda: processor.node_parser.get_nodes_from_documents(documents), repeat=3)
+    timing["docs_per_s"] = len(documents) / (timing["mean_ms"] / 1000)
+    timing["mb_per_s"] = total_chars / 1e6 / (timing["mean_ms"] / 1000)
+    return timing
+
+
+def bench_point_construction(processor, documents, doc_nodes, embeddings) -> Dict[str, Any]:
+    def build():
+        offset = 0
+        for document, nodes in zip(documents, doc_nodes):
+            processor._build_points(document, nodes, embeddings[offset:offset + len(nodes)])
+            offset += len(nodes)
+
+    timing = timed(build, repeat=3)
+    timing["points_per_s"] = len(embeddings) / (timing["mean_ms"] / 1000)
+    return timing
+
+
+def bench_hierarchy(processor, doc_ids: List[str]) -> Dict[str, Any]:
+    from app.services.hierarchy_graph import HierarchyGraph
+
+    rng = random.Random(3)
+    hierarchy = make_hierarchy(doc_ids)
+    new_ids = [f"new_{idx}" for idx in range(min(100, len(doc_ids)))]
+
+    def update():
+        processor.document_hierarchy = json.loads(json.dumps(hierarchy))
+        for new_id in new_ids:
+            related = rng.sample(doc_ids, min(5, len(doc_ids)))
+            processor.update_hierarchy_with_document(new_id, {new_id: {
+                "title": new_id,
+                "summary": "",
+                "parent_id": rng.choice(doc_ids),
+                "children": rng.sample(doc_ids, min(3, len(doc_ids))),
+                "level": 0,
+                "relationships": [],
+                "relationship_type": "related",
+                "key_concepts": [],
+                "similarity_scores": {rel_id: rng.random() for rel_id in related}
+            }})
+
+    def validate():
+        # Validation (dangling edges, cycles, symmetric links) happens while building the graph
+        HierarchyGraph.from_dict(hierarchy)
+
+    return {
+        "update_hierarchy_with_document": {**timed(update, repeat=3), "updates": len(new_ids)},
+        "validate_and_fix_relationships": timed(validate, repeat=3),
+    }
+
+
+def bench_state(processor, doc_ids: List[str]) -> Dict[str, Any]:
+    processor.document_hierarchy = make_hierarchy(doc_ids)
+    processor.document_summaries = {doc_id: "synthetic summary " * 20 for doc_id in doc_ids}
+    save = timed(processor.save_state, repeat=3)
+    save["bytes"] = processor.state_file.stat().st_size
+    return {"save_state": save, "load_state": timed(processor.load_state, repeat=3)}
+
+
+def bench_query(processor, documents, doc_nodes, embeddings) -> Dict[str, Any]:
+    points = []
+    offset = 0
+    for document, nodes in zip(documents, doc_nodes):
+        points.extend(processor._build_points(document, nodes, embeddings[offset:offset + len(nodes)]))
+        offset += len(nodes)
+    processor._store_chunks(documents, doc_nodes)
+    processor.upsert_points(points)
+    processor._index_lexical(documents, doc_nodes)
+
+    results = {}
+    for limit in QUERY_LIMITS:
+        for context_window in CONTEXT_WINDOWS:
+            key = f"limit={limit},context_window={context_window}"
+            results[key] = timed(
+                lambda: processor.query(
+                    BENCH_QUERY,
+                    limit=limit,
+                    context_window=context_window
+                ),
+                repeat=5
+            )
+    return results
+
+
+def bench_search_strategies(processor, documents) -> Dict[str, Any]:
+    """Flat against two-stage search over the points stored by bench_query.
+
+    Summaries are the first characters of each document. Besides the latency, reports
+    how many distinct documents fill the top 10 and how many hits both strategies share.
+    """
+    from app.services.rag import SNIPPET_CHARS
+
+    processor.document_summaries = {document.doc_id: document.text[:SNIPPET_CHARS] for document in documents}
+    processor.index_summaries({document.doc_id: processor.summary_payload(document) for document in documents})
+
+    results: Dict[str, Any] = {}
+    for mode in ("dense", "hybrid"):
+        hits = {}
+        for strategy in SEARCH_STRATEGIES:
+            search = timed(
+                lambda: processor.search(BENCH_QUERY, limit=10, mode=mode, strategy=strategy), repeat=5
+            )
+            hits[strategy] = processor.search(BENCH_QUERY, limit=10, mode=mode, strategy=strategy)
+            search["distinct_documents"] = len({hit.payload["doc_id"] for hit in hits[strategy]})
+            results[f"{mode},{strategy}"] = {
+                "search": search,
+                "query": timed(
+                    lambda: processor.query(BENCH_QUERY, limit=10, retrieval_mode=mode, search_strategy=strategy),
+                    repeat=3
+                ),
+            }
+        shared = {hit.id for hit in hits["flat"]} & {hit.id for hit in hits["two_stage"]}
+        results[f"{mode},two_stage"]["search"]["shared_with_flat"] = len(shared)
+    return results
+
+
+def bench_chunk_store(processor, documents, doc_nodes) -> Dict[str, Any]:
+    """Chunk store size against the raw text, and batched reads of neighbour-sized runs"""
+    from app.services.rag import chunk_ids
+
+    rng = random.Random(5)
+    node_ids = [chunk_ids(document.doc_id, nodes) for document, nodes in zip(documents, doc_nodes)]
+    raw_bytes = sum(len(node.text.encode("utf-8")) for nodes in doc_nodes for node in nodes)
+    stats = processor.chunk_store.stats()
+
+    def read_windows():
+        for _ in range(10):
+            ids = rng.choice(node_ids)
+            start = rng.randrange(len(ids))
+            processor.chunk_store.get_many(ids[start:start + 3])
+
+    return {
+        "raw_text_bytes": raw_bytes,
+        "segment_bytes": stats["segment_bytes"],
+        "index_bytes": stats["index_bytes"],
+        "bytes_per_chunk": (stats["segment_bytes"] + stats["index_bytes"]) / max(1, stats["records"]),
+        "compression_ratio": raw_bytes / max(1, stats["live_bytes"]),
+        "read_10_windows": timed(read_windows, repeat=5),
+    }
+
+
+def bench_get_by_parent(size: int) -> Dict[str, Any]:
+    try:
+        from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+        from sqlalchemy.orm import sessionmaker
+        import aiosqlite  # noqa: F401
+    except ImportError:
+        return {"skipped": "aiosqlite is not installed"}
+
+    from app.models.document import Base, Document
+    from app.repositories.document import DocumentRepository
+
+    async def run() -> Dict[str, Any]:
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        session_factory = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+        async with session_factory() as session:
+            repository = DocumentRepository(session)
+            folder = await repository.create(Document(content="folder", doc_metadata={"type": "folder"}))
+            await repository.create_many([
+                Document(
+                    content=f"doc {idx}",
+                    doc_metadata={"type": "file"},
+                    parent_id=folder.id if idx % 2 else None,
+                    download_url=f"{idx}.txt"
+                )
+                for idx in range(size)
+            ])
+
+            results = {}
+            for name, parent_id in (("root", None), ("folder", folder.id)):
+                samples = []
+                for _ in range(5):
+                    start = time.perf_counter()
+                    await repository.get_by_parent(parent_id)
+                    samples.append((time.perf_counter() - start) * 1000)
+                results[name] = {"mean_ms": statistics.mean(samples), "min_ms": min(samples)}
+
+        await engine.dispose()
+        return results
+
+    return asyncio.run(run())
+
+
+def run_size(size: int) -> Dict[str, Any]:
+    from app.core.config import settings
+
+    print(f"== {size} documents")
+    with tempfile.TemporaryDirectory(prefix="bench_state_") as persist_dir:
+        processor = make_processor(persist_dir)
+        documents = make_documents(size)
+        doc_ids = [document.doc_id for document in documents]
+
+        doc_nodes = [processor.node_parser.get_nodes_from_documents([document]) for document in documents]
+        embeddings = random_vectors(sum(len(nodes) for nodes in doc_nodes), settings.QDRANT_VECTOR_SIZE)
+
+        results = {
+            "nodes": len(embeddings),
+            "chunking": bench_chunking(processor, documents),
+            "point_construction": bench_point_construction(processor, documents, doc_nodes, embeddings),
+            "hierarchy": bench_hierarchy(processor, doc_ids),
+            "state": bench_state(processor, doc_ids),
+            "query": bench_query(processor, documents, doc_nodes, embeddings),
+            "search_strategies": bench_search_strategies(processor, documents),
+            "chunk_store": bench_chunk_store(processor, documents, doc_nodes),
+            "get_by_parent": bench_get_by_parent(size),
+        }
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(current: Dict[str, Any], baseline_path: Path) -> None:
+    baseline = flatten(json.loads(baseline_path.read_text())["results"])
+    print(f"\nCompared with {baseline_path.name} (ratio = current / baseline)")
+    for name, value in flatten(current).items():
+        if name.endswith("mean_ms") and baseline.get(name):
+            print(f"{value / baseline[name]:6.2f}x  {name}  {baseline[name]:.2f} -> {value:.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--compare", type=Path, help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    results = {str(size): run_size(size) for size in args.sizes}
+
+    commit = git_commit()
+    output = args.output or RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "commit": commit,
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Payload size and encode time of the large API responses and the state file.
+
+Compares the previous encoding (jsonable_encoder + json, indented state file) with
+orjson, and the raw size with gzip and brotli (when installed):
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000
+
+Results are written to benchmarks/results/serialization_<timestamp>_<commit>.json.
+"""
+import argparse
+import gzip
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+from benchmarks.bench_rag import RESULTS_DIR, git_commit, timed
+from benchmarks.corpus import make_corpus, make_hierarchy
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_state(size: int) -> Dict[str, Any]:
+    doc_ids = [item["doc_id"] for item in make_corpus(size, words_per_doc=10)]
+    return {
+        "summaries": {doc_id: "synthetic summary of the document " * 8 for doc_id in doc_ids},
+        "hierarchy": make_hierarchy(doc_ids),
+        "last_updated": datetime.now().isoformat(),
+        "version": 1
+    }
+
+
+def make_search_response(limit: int, include_metadata: bool) -> Dict[str, Any]:
+    corpus = make_corpus(limit, words_per_doc=60)
+    hierarchy = make_hierarchy([item["doc_id"] for item in corpus])
+    documents = []
+    for idx, item in enumerate(corpus):
+        document = {"id": idx, "parent": None, "doc_id": item["doc_id"], "subcontent": item["text"][:300]}
+        if include_metadata:
+            document["metadata"] = {
+                "file_name": f"{item['doc_id']}.pdf",
+                "file_type": "application/pdf",
+                "creation_date": "2024-11-02",
+                "doc_id": item["doc_id"],
+                "summary": item["text"][:400],
+                "node_info": {"index": 3, "total_nodes": 12, "relationships": [], "start_char_idx": 0}
+            }
+            document["hierarchy_info"] = hierarchy[item["doc_id"]]
+        documents.append(document)
+    return {"answer": "synthetic answer " * 40, "documents": documents}
+
+
+def make_document_list(size: int) -> list:
+    return [
+        {
+            "id": idx,
+            "parent_id": idx // 10 or None,
+            "content": f"document {idx} " * 30,
+            "doc_metadata": {"type": "file", "mime_type": "application/pdf"},
+            "download_url": f"{idx:08d}_report.pdf",
+            "created_at": datetime(2024, 11, 2).isoformat(),
+        }
+        for idx in range(size)
+    ]
+
+
+def encoders(kind: str) -> Dict[str, Callable[[Any], bytes]]:
+    import orjson
+
+    try:
+        from fastapi.encoders import jsonable_encoder
+    except ImportError:
+        def jsonable_encoder(obj):
+            return obj
+
+    def default_response(obj: Any) -> bytes:
+        # starlette JSONResponse after FastAPI's jsonable_encoder
+        return json.dumps(
+            jsonable_encoder(obj), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+    if kind == "state":
+        before = lambda obj: json.dumps(obj, indent=2).encode("utf-8")  # noqa: E731
+    else:
+        before = default_response
+    return {"before": before, "orjson": lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)}
+
+
+def bench_payload(name: str, kind: str, payload: Any) -> Dict[str, Any]:
+    results = {}
+    for label, encode in encoders(kind).items():
+        body = encode(payload)
+        result = {**timed(lambda: encode(payload), repeat=5), "bytes": len(body)}
+        result["gzip_bytes"] = len(gzip.compress(body, compresslevel=6))
+        result["gzip_ms"] = timed(lambda: gzip.compress(body, compresslevel=6), repeat=3)["mean_ms"]
+        if brotli is not None:
+            result["br_bytes"] = len(brotli.compress(body, quality=5))
+            result["br_ms"] = timed(lambda: brotli.compress(body, quality=5), repeat=3)["mean_ms"]
+        results[label] = result
+
+    before, after = results["before"], results["orjson"]
+    print(
+        f"{name:32s} {before['bytes'] / 1024:9.1f} KiB {before['mean_ms']:8.2f} ms  ->  "
+        f"{after['bytes'] / 1024:9.1f} KiB {after['mean_ms']:8.2f} ms, gzip {after['gzip_bytes'] / 1024:8.1f} KiB"
+        + (f", br {after['br_bytes'] / 1024:8.1f} KiB" if "br_bytes" in after else "")
+    )
+    return results
+
+
+def run_size(size: int) -> Dict[str, Any]:
+    print(f"== {size} documents")
+    return {
+        name: bench_payload(name, kind, payload)
+        for name, kind, payload in (
+            ("graph_state", "state", make_state(size)),
+            ("documents_list", "response", make_document_list(size)),
+            ("search_limit100_metadata", "response", make_search_response(100, include_metadata=True)),
+            ("search_limit100", "response", make_search_response(100, include_metadata=False)),
+        )
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    results = {str(size): run_size(size) for size in args.sizes}
+
+    commit = git_commit()
+    output = args.output or RESULTS_DIR / f"serialization_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "commit": commit,
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "brotli": brotli is not None,
+        "results": results,
+    }, indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
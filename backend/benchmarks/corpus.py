@@ -0,0 +1,48 @@
+"""Deterministic synthetic corpora for the benchmarks"""
+import random
+from typing import Dict, List
+
+VOCABULARY = [
+    "attention", "transformer", "layer", "translation", "neural", "model", "encoder", "decoder",
+    "retrieval", "document", "hierarchy", "summary", "vector", "embedding", "graph", "query",
+    "supplier", "contract", "invoice", "warehouse", "delivery", "product", "price", "store",
+    "policy", "report", "quarter", "revenue", "customer", "logistics", "inventory", "category",
+]
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 20))
+        sentence = " ".join(rng.choice(VOCABULARY) for _ in range(length))
+        sentences.append(sentence.capitalize() + f" {rng.randint(100000000, 999999999)}.")
+        words -= length
+    return " ".join(sentences)
+
+
+def make_corpus(size: int, words_per_doc: int = 400, seed: int = 13) -> List[Dict[str, str]]:
+    """``size`` documents as {"doc_id", "text"}"""
+    rng = random.Random(seed)
+    return [
+        {"doc_id": f"{doc_idx:08d}_synthetic", "text": make_text(rng, words_per_doc)}
+        for doc_idx in range(size)
+    ]
+
+
+def make_hierarchy(doc_ids: List[str], seed: int = 13, relationships: int = 3) -> Dict[str, dict]:
+    """Random forest of documents with a few related documents each, in the state JSON shape"""
+    rng = random.Random(seed)
+    hierarchy = {}
+    for idx, doc_id in enumerate(doc_ids):
+        parent_id = doc_ids[rng.randrange(idx)] if idx and rng.random() < 0.7 else None
+        hierarchy[doc_id] = {
+            "title": f"Document {doc_id}",
+            "summary": "synthetic",
+            "parent_id": parent_id,
+            "children": [],
+            "level": 0,
+            "relationships": [rng.choice(doc_ids) for _ in range(relationships)],
+            "relationship_type": "related",
+            "key_concepts": rng.sample(VOCABULARY, 3)
+        }
+    return hierarchy
@@ -0,0 +1,162 @@
+"""Local HTTP stand-ins for TEI and the Anthropic Messages API.
+
+The backend talks to them through its real clients (TextEmbeddingsInference with
+TEI_BASE_URL, the Anthropic SDK with ANTHROPIC_BASE_URL), so HTTP, serialization and
+the upstream limiters are all exercised. Latency is configurable to mimic the real
+services; responses are deterministic.
+
+    python -m benchmarks.upstream_stubs --tei-port 8081 --anthropic-port 8082
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.corpus import VOCABULARY
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address: Tuple[str, int], routes: Dict[str, Callable[[Any], Any]], latency_ms: float):
+        self.routes = routes
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self._count_lock = threading.Lock()
+        super().__init__(address, StubHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        route = self.server.routes.get(self.path.split("?")[0])
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if route is None:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+            return
+
+        with self.server._count_lock:
+            self.server.requests += 1
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000)
+        self.send_json(200, route(json.loads(body or b"{}")))
+
+    def do_GET(self) -> None:
+        if self.path in ("/health", "/info"):
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"unknown path {self.path}"})
+
+    def send_json(self, status: int, payload: Any) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def tei_routes(dim: int) -> Dict[str, Callable[[Any], Any]]:
+    """POST /embed: {"inputs": str | [str]} -> [[float]], the same vectors as EMBEDDING_BACKEND=hashing"""
+    from app.services.backends import HashingEmbedding
+
+    embedder = HashingEmbedding(dim=dim)
+
+    def embed(request: Dict[str, Any]) -> List[List[float]]:
+        inputs = request.get("inputs", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        return [embedder._embed(text) for text in inputs]
+
+    return {"/embed": embed}
+
+
+def message_text(request: Dict[str, Any]) -> str:
+    parts = []
+    system = request.get("system") or []
+    for block in [system] if isinstance(system, str) else system:
+        parts.append(block if isinstance(block, str) else block.get("text", ""))
+    for message in request.get("messages", []):
+        content = message.get("content", "")
+        for block in [content] if isinstance(content, str) else content:
+            parts.append(block if isinstance(block, str) else block.get("text", ""))
+    return "\n".join(parts)
+
+
+def anthropic_routes() -> Dict[str, Callable[[Any], Any]]:
+    """POST /v1/messages in the Messages API shape; JSON prompts get a small valid answer"""
+    counter = iter(range(1, 1 << 62))
+
+    def messages(request: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = message_text(request)
+        if "JSON" in prompt:
+            text = json.dumps({"relationship_type": "related", "key_concepts": VOCABULARY[:3]})
+        else:
+            text = "Stub answer: " + " ".join(prompt.split()[-40:])
+        return {
+            "id": f"msg_stub_{next(counter)}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get("model", "stub"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4},
+        }
+
+    return {"/v1/messages": messages}
+
+
+def start_stubs(
+        host: str = "127.0.0.1",
+        tei_port: int = 0,
+        anthropic_port: int = 0,
+        dim: int = 384,
+        tei_latency_ms: float = 0,
+        llm_latency_ms: float = 0
+) -> Tuple[StubServer, StubServer]:
+    """Start both stand-ins in background threads; port 0 picks a free port"""
+    tei = StubServer((host, tei_port), tei_routes(dim), tei_latency_ms).start()
+    anthropic = StubServer((host, anthropic_port), anthropic_routes(), llm_latency_ms).start()
+    return tei, anthropic
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tei-port", type=int, default=8081)
+    parser.add_argument("--anthropic-port", type=int, default=8082)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--tei-latency-ms", type=float, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    tei, anthropic = start_stubs(
+        args.host, args.tei_port, args.anthropic_port, args.dim, args.tei_latency_ms, args.llm_latency_ms
+    )
+    print(f"TEI_BASE_URL={tei.url}")
+    print(f"ANTHROPIC_BASE_URL={anthropic.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
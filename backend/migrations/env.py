@@ -10,6 +10,7 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.models.document import Base
+import app.models.rag_state  # noqa: F401  (registers the RAG state tables)
 from app.core.config import settings
 
 config = context.config
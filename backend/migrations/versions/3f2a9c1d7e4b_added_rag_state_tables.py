@@ -0,0 +1,42 @@
+"""Added RAG state tables
+
+Revision ID: 3f2a9c1d7e4b
+Revises: 8b7bc92dfde9
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7e4b'
+down_revision: Union[str, None] = '8b7bc92dfde9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('rag_documents',
+    sa.Column('doc_id', sa.Text(), nullable=False),
+    sa.Column('summary', sa.Text(), nullable=True),
+    sa.Column('hierarchy', sa.JSON(), nullable=True),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('doc_id')
+    )
+    op.create_index(op.f('ix_rag_documents_version'), 'rag_documents', ['version'], unique=False)
+    op.create_table('rag_state',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO rag_state (id, version) VALUES (1, 0)")
+
+
+def downgrade() -> None:
+    op.drop_table('rag_state')
+    op.drop_index(op.f('ix_rag_documents_version'), table_name='rag_documents')
+    op.drop_table('rag_documents')
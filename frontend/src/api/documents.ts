@@ -26,6 +26,21 @@ export const documentsApi = {
     return response.data;
   },
 
+  uploadMany: async (files: File[], parentId?: number) => {
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+
+    const response = await axios.post(
+      `${API_URL}/documents/bulk/`,
+      formData,
+      {
+        headers: { 'Content-Type': 'multipart/form-data' },
+        params: parentId ? { parent_id: parentId } : undefined,
+      }
+    );
+    return response.data;
+  },
+
   updateDocument: async (documentId: number, newValue: string) => {
       const response = await fetch(
         `${API_URL}/arch/update/`, {
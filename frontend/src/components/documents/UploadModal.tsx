@@ -90,7 +90,7 @@ export const UploadModal: React.FC<UploadModalProps> = ({ isOpen, onClose, paren
     setIsUploading(true);
 
     try {
-      await Promise.all(selectedFiles.map(file => documentsApi.upload(file, parentId)));
+      await documentsApi.uploadMany(selectedFiles, parentId);
       queryClient.invalidateQueries({ queryKey: ['documents'] });
       alert(JSON.stringify({
         title: "Upload successful",
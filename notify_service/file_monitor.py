@@ -1,15 +1,87 @@
 import sys
 import os
+import json
 import asyncio
+import hashlib
 import aiohttp
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 
+MANIFEST_NAME = ".upload_manifest.json"
+
+
+def file_sha256(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Хеш содержимого файла, читаем блоками чтобы не держать файл в памяти"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ChangeManifest:
+    """Локальный манифест загруженных файлов: путь -> размер, mtime, хеш содержимого"""
+
+    def __init__(self, manifest_path: str):
+        self.manifest_path = manifest_path
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                self.entries = json.load(f).get('files', {})
+        except FileNotFoundError:
+            self.entries = {}
+        except Exception as e:
+            print(f"Error loading manifest {self.manifest_path}: {str(e)}")
+            self.entries = {}
+
+    def save(self):
+        # Пишем во временный файл и атомарно подменяем, чтобы не получить битый манифест
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_unchanged_stat(self, rel_path: str, stat: os.stat_result) -> bool:
+        """Быстрая проверка без чтения файла"""
+        entry = self.entries.get(rel_path)
+        return (
+            entry is not None
+            and entry['size'] == stat.st_size
+            and entry['mtime'] == stat.st_mtime
+        )
+
+    def has_hash(self, rel_path: str, content_hash: str) -> bool:
+        entry = self.entries.get(rel_path)
+        return entry is not None and entry['sha256'] == content_hash
+
+    def record(self, rel_path: str, stat: os.stat_result, content_hash: str):
+        self.entries[rel_path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': content_hash,
+        }
+
+    def forget(self, rel_path: str):
+        self.entries.pop(rel_path, None)
+
+    def retain(self, rel_paths) -> int:
+        """Удаляет записи файлов, которых больше нет в дереве; возвращает число удалённых"""
+        missing = [rel_path for rel_path in self.entries if rel_path not in rel_paths]
+        for rel_path in missing:
+            del self.entries[rel_path]
+        return len(missing)
+
+
 class DocumentUploader:
     def __init__(self):
         self.api_url = "https://api.snowjass.ru/v1/documents/"
+        self.bulk_api_url = "https://api.snowjass.ru/v1/documents/bulk/"
         self.supported_extensions = {'.txt', '.pdf'}
         self.session = None
 
@@ -22,9 +94,12 @@ class DocumentUploader:
             await self.session.close()
             self.session = None
 
-    async def upload_file(self, file_path: str):
-        if not any(file_path.lower().endswith(ext) for ext in self.supported_extensions):
-            return
+    def is_supported(self, file_path: str) -> bool:
+        return any(file_path.lower().endswith(ext) for ext in self.supported_extensions)
+
+    async def upload_file(self, file_path: str, source_path: str = None) -> bool:
+        if not self.is_supported(file_path):
+            return False
 
         try:
             await self.init_session()
@@ -42,23 +117,208 @@ class DocumentUploader:
                            filename=os.path.basename(file_path),
                            content_type=mime_type)
 
-            async with self.session.post(self.api_url, data=data) as response:
+            # Повторная загрузка заменяет документ, загруженный с того же пути (одноимённые файлы
+            # из разных папок дерева остаются разными документами)
+            params = {'replace': 'true', 'source_path': source_path} if source_path else None
+            async with self.session.post(self.api_url, data=data, params=params) as response:
                 if response.status == 200:
                     print(f"Successfully uploaded {file_path}")
                     response_data = await response.json()
                     print(f"API Response: {response_data}")
+                    return True
                 else:
                     print(f"Failed to upload {file_path}. Status: {response.status}")
                     print(f"Response: {await response.text()}")
+                    return False
 
         except Exception as e:
             print(f"Error uploading {file_path}: {str(e)}")
+            return False
+
+
+    async def upload_files(self, file_paths, source_paths=None):
+        """Загрузка нескольких файлов одним запросом, возвращает множество загруженных путей"""
+        source_paths = dict(zip(file_paths, source_paths)) if source_paths else {}
+        file_paths = [file_path for file_path in file_paths if self.is_supported(file_path)]
+        if not file_paths:
+            return set()
+
+        try:
+            await self.init_session()
+
+            data = aiohttp.FormData()
+            for file_path in file_paths:
+                with open(file_path, 'rb') as f:
+                    data.add_field('files',
+                                   f.read(),
+                                   filename=os.path.basename(file_path),
+                                   content_type=mimetypes.guess_type(file_path)[0])
+
+            params = None
+            if source_paths:
+                params = [('replace', 'true')] + [('source_paths', source_paths[file_path]) for file_path in file_paths]
+            async with self.session.post(self.bulk_api_url, data=data, params=params) as response:
+                if response.status != 200:
+                    print(f"Failed to upload batch of {len(file_paths)} files. Status: {response.status}")
+                    print(f"Response: {await response.text()}")
+                    return set()
+
+                response_data = await response.json()
+
+            uploaded = set()
+            # Ответ выровнен по порядку файлов в запросе
+            for file_path, item in zip(file_paths, response_data["documents"]):
+                # not_indexed - строка в БД уже создана, повторная загрузка дала бы дубликат
+                if item["status"] != "failed":
+                    uploaded.add(file_path)
+                    print(f"Successfully uploaded {file_path}: {item}")
+                else:
+                    print(f"Failed to upload {file_path}: {item.get('detail')}")
+            return uploaded
+
+        except Exception as e:
+            print(f"Error uploading batch of {len(file_paths)} files: {str(e)}")
+            return set()
+
+
+class SyncedUploader:
+    """Загрузка с учётом манифеста: файл уходит в API только если изменилось содержимое"""
+
+    def __init__(self, root: str, uploader: DocumentUploader, manifest: ChangeManifest,
+                 executor: ThreadPoolExecutor):
+        self.root = root
+        self.uploader = uploader
+        self.manifest = manifest
+        self.executor = executor
+        # Один файл не должен загружаться параллельно из скана и из события watchdog
+        self.path_locks = {}
+
+    def rel_path(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.root)
+
+    async def _changed_files(self, file_paths):
+        """Отбирает файлы, чей хеш отличается от манифеста; для остальных обновляет stat"""
+        loop = asyncio.get_running_loop()
+        changed = []
+        for file_path in file_paths:
+            rel_path = self.rel_path(file_path)
+            try:
+                stat = os.stat(file_path)
+                content_hash = await loop.run_in_executor(self.executor, file_sha256, file_path)
+            except FileNotFoundError:
+                continue
+
+            if self.manifest.has_hash(rel_path, content_hash):
+                # Содержимое не менялось (например, touch) - только обновляем stat
+                self.manifest.record(rel_path, stat, content_hash)
+            else:
+                changed.append((file_path, stat, content_hash))
+        return changed
+
+    def forget_file(self, file_path: str):
+        """Файл удалён из дерева: при повторном появлении он будет загружен заново"""
+        self.manifest.forget(self.rel_path(file_path))
+        self.manifest.save()
+
+    async def sync_file(self, file_path: str) -> bool:
+        """Загрузить файл, если его нет в манифесте или изменился хеш"""
+        return bool(await self.sync_files([file_path]))
+
+    async def sync_files(self, file_paths) -> int:
+        """Загрузить пачку файлов одним запросом, пропуская неизменённые"""
+        locks = [self.path_locks.setdefault(self.rel_path(file_path), asyncio.Lock()) for file_path in file_paths]
+        for lock in locks:
+            await lock.acquire()
+
+        try:
+            changed = await self._changed_files(file_paths)
+            if not changed:
+                return 0
+
+            if len(changed) == 1:
+                file_path = changed[0][0]
+                uploaded = {file_path} if await self.uploader.upload_file(file_path, self.rel_path(file_path)) else set()
+            else:
+                file_paths = [file_path for file_path, _, _ in changed]
+                uploaded = await self.uploader.upload_files(
+                    file_paths, [self.rel_path(file_path) for file_path in file_paths]
+                )
+
+            for file_path, stat, content_hash in changed:
+                if file_path in uploaded:
+                    self.manifest.record(self.rel_path(file_path), stat, content_hash)
+            self.manifest.save()
+            return len(uploaded)
+        finally:
+            for lock in locks:
+                lock.release()
+
+
+class ReconciliationScan:
+    """Стартовое сканирование: сравниваем дерево с манифестом и догружаем новые/изменённые файлы"""
+
+    def __init__(self, synced: SyncedUploader, max_concurrent_uploads: int = 4, batch_size: int = 16):
+        self.synced = synced
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.batch_size = batch_size
+
+    def walk(self):
+        for dir_path, _, file_names in os.walk(self.synced.root):
+            for file_name in file_names:
+                file_path = os.path.join(dir_path, file_name)
+                if self.synced.uploader.is_supported(file_path):
+                    yield file_path
+
+    def find_candidates(self):
+        """Файлы, у которых размер или mtime расходятся с манифестом (без чтения содержимого),
+        и множество всех найденных относительных путей"""
+        manifest = self.synced.manifest
+        candidates = []
+        seen = set()
+        for file_path in self.walk():
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            rel_path = self.synced.rel_path(file_path)
+            seen.add(rel_path)
+            if not manifest.is_unchanged_stat(rel_path, stat):
+                candidates.append(file_path)
+        return candidates, seen
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        candidates, seen = await loop.run_in_executor(self.synced.executor, self.find_candidates)
+        print(f"Reconciliation: {len(candidates)} files differ from manifest by size/mtime")
+
+        # Удалённые файлы убираем из манифеста (в потоке цикла, не в пуле), иначе он растёт без конца,
+        # а файл, созданный заново с тем же содержимым, считался бы уже загруженным
+        forgotten = self.synced.manifest.retain(seen)
+        if forgotten:
+            print(f"Reconciliation: dropped {forgotten} deleted files from manifest")
+
+        # Хеширование идёт в пуле потоков, файлы уходят пачками через bulk-эндпоинт
+        semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+
+        async def sync_batch(batch):
+            async with semaphore:
+                return await self.synced.sync_files(batch)
+
+        results = await asyncio.gather(*[
+            sync_batch(candidates[i:i + self.batch_size])
+            for i in range(0, len(candidates), self.batch_size)
+        ])
+
+        # Сохраняем обновлённые mtime для файлов, которые не пришлось загружать
+        self.synced.manifest.save()
+        print(f"Reconciliation: uploaded {sum(results)} new or changed files")
 
 
 class FileEventHandler(FileSystemEventHandler):
-    def __init__(self, loop, uploader):
+    def __init__(self, loop, uploader, synced):
         self.loop = loop
         self.uploader = uploader
+        self.synced = synced
         super().__init__()
 
     def on_created(self, event):
@@ -71,10 +331,15 @@ class FileEventHandler(FileSystemEventHandler):
 
     def on_moved(self, event):
         if not event.is_directory:
+            self.loop.call_soon_threadsafe(self.synced.forget_file, event.src_path)
             self._handle_file_event(event.dest_path, "moved")
 
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.loop.call_soon_threadsafe(self.synced.forget_file, event.src_path)
+
     def _handle_file_event(self, file_path, event_type):
-        if any(file_path.lower().endswith(ext) for ext in self.uploader.supported_extensions):
+        if self.uploader.is_supported(file_path):
             print(f"File {event_type}: {file_path}")
             asyncio.run_coroutine_threadsafe(
                 self.delayed_upload(file_path),
@@ -84,24 +349,30 @@ class FileEventHandler(FileSystemEventHandler):
     async def delayed_upload(self, file_path, delay=0.5):
         """Загрузка файла с небольшой задержкой"""
         await asyncio.sleep(delay)
-        await self.uploader.upload_file(file_path)
+        await self.synced.sync_file(file_path)
 
 
 class FileMonitor:
-    def __init__(self, path, loop):
+    def __init__(self, path, loop, manifest_path=None, scan_workers=8):
         self.path = path
         self.loop = loop
         self.uploader = DocumentUploader()
+        self.manifest = ChangeManifest(manifest_path or os.path.join(path, MANIFEST_NAME))
+        self.executor = ThreadPoolExecutor(max_workers=scan_workers)
+        self.synced = SyncedUploader(path, self.uploader, self.manifest, self.executor)
         self.observer = Observer()
-        self.event_handler = FileEventHandler(loop, self.uploader)
+        self.event_handler = FileEventHandler(loop, self.uploader, self.synced)
 
     async def start(self):
         """Запуск мониторинга файловой системы"""
         await self.uploader.init_session()
 
+        # Наблюдатель запускается до сканирования, чтобы не потерять события во время скана
         self.observer.schedule(self.event_handler, self.path, recursive=True)
         self.observer.start()
 
+        await ReconciliationScan(self.synced).run()
+
         try:
             while True:
                 await asyncio.sleep(1)
@@ -114,6 +385,7 @@ class FileMonitor:
         self.observer.stop()
         await self.uploader.close_session()
         self.observer.join()
+        self.executor.shutdown(wait=False)
 
 
 async def main(path):
@@ -122,7 +394,7 @@ async def main(path):
         return
 
     loop = asyncio.get_event_loop()
-    monitor = FileMonitor(path, loop)
+    monitor = FileMonitor(path, loop, manifest_path=os.environ.get("MANIFEST_PATH"))
 
     print(f"Starting monitoring directory: {path}")
     print(f"Watching for files with extensions: {', '.join(monitor.uploader.supported_extensions)}")